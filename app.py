@@ -1,31 +1,98 @@
 from __future__ import annotations
 
+import threading
+import time
+from itertools import islice
+
 import requests
 import streamlit as st
 
-from littup.config import ensure_storage_paths, get_settings
+from littup.config import current_settings
+from littup.db import db_session
+from littup.jobs import FINISHED, JobRunner, cancel_job, get_job, submit_job
 from littup.services import (
     DEFAULT_TEAM_ASSIGNMENT,
     ROLES,
-    add_message,
+    add_messages,
     create_project,
+    dashboard,
     evolve_project,
+    file_info,
     get_messages,
     get_snapshots,
     init_db,
-    list_project_files,
-    list_projects,
+    iter_project_files,
+    iter_workspace_diffs,
+    project_version,
+    projects_query,
+    projects_version,
     read_file,
-    run_local_command,
+    read_file_range,
+    restore_snapshot,
     save_snapshot,
     triad_integrations,
     write_file,
 )
 
-settings = ensure_storage_paths(get_settings())
+settings = current_settings()
 
 st.set_page_config(page_title="LittUp v0.2", layout="wide", page_icon="🛠️")
 
+CHAT_PAGE_SIZE = 50
+HISTORY_PAGE_SIZE = 10
+EDITOR_FILE_LIMIT = 500
+EDITOR_MAX_BYTES = 512 * 1024
+DIFF_FILE_LIMIT = 20
+# How stale a rerun may see data written by another process (the API); our own writes clear it at once.
+STATE_TTL_SECONDS = 2
+FILES_TTL_SECONDS = 5
+HEALTH_REFRESH_SECONDS = 10
+JOB_REFRESH_SECONDS = 1.0
+
+
+@st.cache_data(ttl=STATE_TTL_SECONDS, show_spinner=False)
+def cached_projects_version() -> tuple:
+    return projects_version()
+
+
+@st.cache_data(ttl=STATE_TTL_SECONDS, show_spinner=False)
+def cached_project_version(project_id: int) -> tuple:
+    return project_version(project_id)
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def cached_projects(version: tuple) -> list:
+    # Straight from the database: the service's listing cache could hand back rows older than `version`.
+    with db_session() as s:
+        return list(s.scalars(projects_query()).all())
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def cached_dashboard(version: tuple) -> dict:
+    return dashboard()
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_messages(project_id: int, version: tuple, limit: int | None = None, after_id: int | None = None) -> list:
+    return get_messages(project_id, limit=limit, after_id=after_id)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_snapshots(project_id: int, version: tuple, limit: int | None = None, after_id: int | None = None) -> list:
+    return get_snapshots(project_id, limit=limit, after_id=after_id)
+
+
+@st.cache_data(ttl=FILES_TTL_SECONDS, max_entries=64, show_spinner=False)
+def cached_project_files(project_id: int, version: tuple) -> list[str]:
+    return list(islice(iter_project_files(project_id), EDITOR_FILE_LIMIT + 1))
+
+
+def mark_changed() -> None:
+    """Drop the change tokens after a write from this session so the next rerun refetches."""
+    cached_projects_version.clear()
+    cached_project_version.clear()
+    cached_project_files.clear()
+
 
 def inject_css() -> None:
     st.markdown(
@@ -44,13 +111,15 @@ def inject_css() -> None:
 
 def render_dashboard() -> None:
     st.subheader("Project Dashboard")
-    projects = list_projects()
-    if not projects:
+    summary = cached_dashboard(cached_projects_version())
+    if not summary["projects"]:
         st.info("No projects yet. Create your first local forge project.")
-    for p in projects:
+    for p in summary["projects"]:
         st.markdown(
-            f"<div class='block-card'><b>{p.name}</b> · {p.template} · {p.status}<br/>"
-            f"Team: {p.team_name}<br/>Last modified: {p.updated_at}</div>",
+            f"<div class='block-card'><b>{p['name']}</b> · {p['template']} · {p['status']}<br/>"
+            f"Team: {p['team_name']}<br/>"
+            f"{p['message_count']} messages · {p['snapshot_count']} snapshots · {p['bytes_on_disk'] / 1024:.1f} KiB<br/>"
+            f"Last message: {p['last_message_at'] or '—'} · Last modified: {p['updated_at']}</div>",
             unsafe_allow_html=True,
         )
 
@@ -60,19 +129,21 @@ def render_dashboard() -> None:
         team = st.text_input("Agent Team Name", value="Triad Build Squad")
         if st.button("Create Project", type="primary"):
             create_project(name, template, team)
+            mark_changed()
             st.success("Project created.")
             st.rerun()
 
 
 def render_forge_room() -> None:
     st.subheader("Multi-Agent Forge Room")
-    projects = list_projects()
+    projects = cached_projects(cached_projects_version())
     if not projects:
         st.warning("Create a project first.")
         return
 
     selection = st.selectbox("Choose Project", projects, format_func=lambda p: f"#{p.id} {p.name}")
     project_id = selection.id
+    version = cached_project_version(project_id)
 
     st.markdown("#### Team Roles")
     cols = st.columns(len(ROLES))
@@ -82,49 +153,140 @@ def render_forge_room() -> None:
             role_map[role] = st.text_input(role, value=role_map.get(role, ""), key=f"role_{role}")
 
     st.markdown("#### Live Collaboration Chat")
-    for msg in get_messages(project_id):
+    # Older pages never change, so keep them across reruns and only refetch what follows them.
+    older = st.session_state.setdefault(f"older_messages_{project_id}", [])
+    if older:
+        recent = cached_messages(project_id, version, after_id=older[-1].id)
+    else:
+        recent = cached_messages(project_id, version, limit=CHAT_PAGE_SIZE)
+    messages = older + recent
+    if (older or len(recent) == CHAT_PAGE_SIZE) and st.button("Load older messages"):
+        older[:0] = get_messages(project_id, limit=CHAT_PAGE_SIZE, before_id=messages[0].id)
+        st.rerun()
+    for msg in messages:
         st.chat_message(msg.role).write(msg.content)
 
     user_msg = st.chat_input("Coordinate your team...")
     if user_msg:
-        add_message(project_id, "Planner", user_msg)
-        add_message(project_id, "Coder", "Drafted initial implementation path based on planner brief.")
-        add_message(project_id, "Tester", "Prepared sanity checks and regression plan.")
-        add_message(project_id, "Reviewer", "Will evaluate quality gate once commit-ready.")
-        add_message(project_id, "Documenter", "README updates queued for latest architecture.")
+        add_messages(
+            project_id,
+            [
+                ("Planner", user_msg),
+                ("Coder", "Drafted initial implementation path based on planner brief."),
+                ("Tester", "Prepared sanity checks and regression plan."),
+                ("Reviewer", "Will evaluate quality gate once commit-ready."),
+                ("Documenter", "README updates queued for latest architecture."),
+            ],
+        )
+        mark_changed()
         st.rerun()
 
     st.markdown("#### Code Workspace")
-    files = list_project_files(project_id)
+    files = cached_project_files(project_id, version)
     if not files:
         st.info("Template has no files yet.")
         return
+    if len(files) > EDITOR_FILE_LIMIT:
+        files = files[:EDITOR_FILE_LIMIT]
+        st.caption(f"Showing the first {EDITOR_FILE_LIMIT} files.")
 
     file_choice = st.selectbox("File", files)
-    source = read_file(project_id, file_choice)
-    edited = st.text_area("Editor", value=source, height=320)
+    info = file_info(project_id, file_choice) or {"size": 0, "binary": False}
+    source = edited = None
+    if info["binary"]:
+        st.info(f"Binary file ({info['size']:,} bytes) — not shown in the editor.")
+    elif info["size"] > EDITOR_MAX_BYTES:
+        preview = read_file_range(project_id, file_choice, 0, EDITOR_MAX_BYTES).decode("utf-8", errors="replace")
+        st.caption(f"Large file ({info['size']:,} bytes) — read-only preview of the first {EDITOR_MAX_BYTES // 1024} KiB.")
+        st.code(preview)
+    else:
+        source = read_file(project_id, file_choice)
+        edited = st.text_area("Editor", value=source, height=320)
     col1, col2, col3 = st.columns(3)
     with col1:
-        if st.button("💾 Save"):
-            write_file(project_id, file_choice, edited)
-            save_snapshot(project_id, f"Edited {file_choice}")
-            st.success("Saved and snapshotted.")
+        if st.button("💾 Save", disabled=source is None):
+            if edited == source:
+                st.info("No changes to save.")
+            else:
+                write_file(project_id, file_choice, edited)
+                save_snapshot(project_id, f"Edited {file_choice}")
+                mark_changed()
+                st.success("Saved and snapshotted.")
+    job_key = f"job_{project_id}"
     with col2:
+        use_cache = st.checkbox("Reuse cached results", value=True, help="Skip running when the files and command are unchanged")
         if st.button("▶️ Run"):
-            code, out = run_local_command(project_id, "python main.py")
-            st.code(out or f"Exited with {code}")
+            st.session_state[job_key] = submit_job(project_id, "python main.py", use_cache=use_cache).id
     with col3:
+        impacted = st.checkbox("Only affected tests", value=True, help="Rerun only tests touched by changes since the last test run")
         if st.button("🧪 Test"):
-            code, out = run_local_command(project_id, "pytest -q")
-            st.code(out or f"Exited with {code}")
+            command = "pytest -q --impacted" if impacted else "pytest -q"
+            st.session_state[job_key] = submit_job(project_id, command, use_cache=use_cache).id
+    if job_key in st.session_state:
+        render_job(st.session_state[job_key])
 
     st.markdown("#### History & Evolution")
     feedback = st.text_input("Evolution feedback")
     if st.button("Evolve"):
         st.success(evolve_project(project_id, feedback or "General improvements"))
+        mark_changed()
+
+    diff_key = f"diff_snapshot_{project_id}"
+    # Like the chat: loaded older pages stay in the session and only snapshots after them are refetched.
+    older_snaps = st.session_state.setdefault(f"older_snapshots_{project_id}", [])
+    if older_snaps:
+        snapshots = cached_snapshots(project_id, version, after_id=older_snaps[0].id) + older_snaps
+    else:
+        snapshots = cached_snapshots(project_id, version, limit=HISTORY_PAGE_SIZE)
+    for snap in snapshots:
+        note_col, diff_col, restore_col = st.columns([6, 1, 1])
+        note_col.caption(f"{snap.created_at} — {snap.note}")
+        if diff_col.button("Diff", key=f"diff_{snap.id}"):
+            st.session_state[diff_key] = snap.id
+        if restore_col.button("Restore", key=f"restore_{snap.id}"):
+            changes = restore_snapshot(project_id, snap.id)
+            mark_changed()
+            st.success(f"Restored snapshot {snap.id}: {sum(len(paths) for paths in changes.values())} file(s) changed.")
+    if (older_snaps or len(snapshots) == HISTORY_PAGE_SIZE) and st.button("Load older snapshots"):
+        older_snaps.extend(get_snapshots(project_id, limit=HISTORY_PAGE_SIZE, before_id=snapshots[-1].id))
+        st.rerun()
+    if diff_key in st.session_state:
+        snapshot_id = st.session_state[diff_key]
+        diffs = list(islice(iter_workspace_diffs(project_id, snapshot_id), DIFF_FILE_LIMIT))
+        st.markdown(f"##### Snapshot {snapshot_id} → working tree")
+        if diffs:
+            st.code("".join(d["diff"] for d in diffs), language="diff")
+        else:
+            st.caption("No changes.")
+
 
-    for snap in get_snapshots(project_id)[:10]:
-        st.caption(f"{snap.created_at} — {snap.note}")
+def render_job(job_id: int) -> None:
+    job = get_job(job_id)
+    if job is None:
+        return
+    if job.status in FINISHED:
+        reused = " · ♻️ reused result of an identical run on unchanged files" if job.cached else ""
+        st.caption(f"`{job.command}` · {job.status}{reused}")
+        st.code(job.output or f"Exited with {job.exit_code}")
+        return
+    if hasattr(st, "fragment"):
+        # Only this block reruns while the job is live, so output streams in without reloading the page.
+        st.fragment(run_every=JOB_REFRESH_SECONDS)(render_live_job)(job_id)
+    else:
+        render_live_job(job_id)
+        st.button("🔄 Refresh status")
+
+
+def render_live_job(job_id: int) -> None:
+    job = get_job(job_id)
+    if job is None or job.status in FINISHED:
+        st.rerun()
+    st.info(f"`{job.command}` is {job.status}…")
+    if job.output:
+        st.code(job.output)
+    if st.button("✖️ Cancel run"):
+        cancel_job(job_id)
+        st.rerun()
 
 
 def render_integrations() -> None:
@@ -134,7 +296,7 @@ def render_integrations() -> None:
         st.markdown(f"- **{name}**: {desc}")
 
 
-def api_health_status() -> str:
+def probe_api() -> str:
     try:
         response = requests.get(f"{settings.api_base_url}/health", timeout=0.5)
         if response.ok:
@@ -144,6 +306,29 @@ def api_health_status() -> str:
     return "⚠️ API companion unavailable"
 
 
+class HealthMonitor:
+    """Probes the API on a daemon thread so reruns read the last status instead of waiting on HTTP."""
+
+    def __init__(self, interval: float = HEALTH_REFRESH_SECONDS) -> None:
+        self.interval = interval
+        self.status = "⏳ Checking API companion…"
+        threading.Thread(target=self._run, name="littup-health", daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            self.status = probe_api()
+            time.sleep(self.interval)
+
+
+@st.cache_resource
+def health_monitor() -> HealthMonitor:
+    return HealthMonitor()
+
+
+def api_health_status() -> str:
+    return health_monitor().status
+
+
 def render_sidebar() -> None:
     st.sidebar.title("LittUp v0.2")
     st.sidebar.caption("Local AI Code Forge · Private by default")
@@ -155,8 +340,15 @@ def render_sidebar() -> None:
     st.sidebar.caption(f"Data dir: {settings.data_dir}")
 
 
-def main() -> None:
+@st.cache_resource
+def bootstrap() -> JobRunner:
+    """One-time per-process setup: schema creation and the job runner."""
     init_db()
+    return JobRunner().start()
+
+
+def main() -> None:
+    bootstrap()
     inject_css()
     render_sidebar()
     st.title("🛠️ LittUp — The Local AI Code Forge")
@@ -1,24 +1,68 @@
 from __future__ import annotations
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections.abc import AsyncIterator, Iterable, Iterator
+from contextlib import asynccontextmanager
+from typing import Literal
 
-from .config import ensure_storage_paths, get_settings
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from sqlalchemy.exc import IntegrityError
+
+from . import async_services as aio
+from .config import current_settings
 from .services import (
-    add_message,
     create_project,
+    create_projects,
+    READ_CHUNK_BYTES,
     evolve_project,
-    get_messages,
+    file_info,
     get_project,
-    get_snapshots,
     init_db,
-    list_projects,
+    iter_messages,
+    iter_snapshot_diffs,
+    iter_snapshots,
+    iter_workspace_diffs,
+    list_project_dir,
+    project_cache_stats,
+    read_file_range,
+    require_snapshot,
+    restore_snapshot,
+    search_memories,
     triad_integrations,
 )
+from .jobs import FINISHED, JobRunner, cancel_job, get_job, job_stats, list_jobs, submit_job
+from .launchpad import ARCHIVE_FORMATS, ARCHIVE_MEDIA_TYPES, export_project, import_project
+from .metrics import REGISTRY, http_request_seconds
+from .retention import Compactor, compact
+from .search import SOURCES, search
+from .writebehind import MessageWriteBehind
+
+settings = current_settings()
+
+router = APIRouter()
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_BATCH_PROJECTS = 500
+SUBSCRIBE_POLL_SECONDS = 1.0
+SUBSCRIBE_KEEPALIVE_POLLS = 15
+JOB_STREAM_POLL_SECONDS = 0.25
+MAX_READ_BYTES = 1024 * 1024
 
-settings = ensure_storage_paths(get_settings())
+write_behind = MessageWriteBehind() if settings.chat_write_behind else None
+job_runner = JobRunner()
+compactor = Compactor()
 
-app = FastAPI(title="LittUp API", version="0.2.0")
+StreamFormat = Literal["ndjson", "sse"]
+DiffFormat = Literal["patch", "ndjson", "sse"]
+ArchiveFormat = Literal[ARCHIVE_FORMATS]
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream", "patch": "text/x-diff"}
 
 
 class ProjectIn(BaseModel):
@@ -27,28 +71,132 @@ class ProjectIn(BaseModel):
     team_name: str = "Core Team"
 
 
+class ProjectBatchIn(BaseModel):
+    projects: list[ProjectIn] = Field(min_length=1, max_length=MAX_BATCH_PROJECTS)
+
+
 class MessageIn(BaseModel):
     role: str
     content: str
 
 
+class MessageBatchIn(BaseModel):
+    messages: list[MessageIn] = Field(min_length=1, max_length=MAX_PAGE_SIZE)
+
+
 class EvolveIn(BaseModel):
     feedback: str
 
 
-@app.on_event("startup")
-def startup() -> None:
-    ensure_storage_paths(settings)
+class RunIn(BaseModel):
+    command: str = "python main.py"
+    # False re-executes even when an identical run on the same tree is cached (and refreshes the cache).
+    use_cache: bool = True
+
+
+class JobIn(RunIn):
+    priority: int = 0
+
+
+def _message_out(m) -> dict:
+    return {"id": m.id, "role": m.role, "content": m.content, "created_at": m.created_at.isoformat()}
+
+
+def _job_out(job, include_output: bool = True) -> dict:
+    out = {
+        "id": job.id,
+        "project_id": job.project_id,
+        "command": job.command,
+        "priority": job.priority,
+        "status": job.status,
+        "exit_code": job.exit_code,
+        "cached": job.cached,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if include_output:
+        out["output"] = job.output
+    return out
+
+
+def _snapshot_out(s) -> dict:
+    return {"id": s.id, "note": s.note, "created_at": s.created_at.isoformat()}
+
+
+def _sse_event(item: dict) -> str:
+    return f"id: {item['id']}\ndata: {json.dumps(item)}\n\n"
+
+
+def _encode_stream(items: Iterable[dict], fmt: StreamFormat) -> Iterator[str]:
+    for item in items:
+        yield _sse_event(item) if fmt == "sse" else json.dumps(item) + "\n"
+
+
+def _require_project(project_id: int) -> None:
+    if not get_project(project_id):
+        raise HTTPException(404, "Project not found")
+
+
+async def _require_project_async(project_id: int) -> None:
+    if not await aio.get_project(project_id):
+        raise HTTPException(404, "Project not found")
+
+
+async def record_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, so project ids don't explode the series count.
+        # Streaming routes are timed to their first byte.
+        route = request.scope.get("route")
+        http_request_seconds.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status),
+        )
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncIterator[None]:
     init_db()
+    job_runner.start()
+    compactor.start()
+    try:
+        yield
+    finally:
+        compactor.stop()
+        job_runner.stop()
+        if write_behind is not None:
+            write_behind.close()
 
 
-@app.get("/health")
+@router.get("/health")
 def health() -> dict[str, str]:
     return {"status": "ok", "mode": "local-first", "env": settings.env}
 
 
-@app.get("/projects")
-def projects() -> list[dict]:
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/dashboard")
+async def dashboard() -> dict:
+    """Summaries and activity counters of all projects, read in one query."""
+    return await aio.dashboard()
+
+
+@router.get("/projects")
+async def projects(
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after_id: int | None = None,
+) -> list[dict]:
     return [
         {
             "id": p.id,
@@ -58,45 +206,392 @@ def projects() -> list[dict]:
             "updated_at": p.updated_at.isoformat(),
             "team_name": p.team_name,
         }
-        for p in list_projects()
+        for p in await aio.list_projects(limit=limit, after_id=after_id)
     ]
 
 
-@app.post("/projects")
+@router.post("/projects")
 def create(payload: ProjectIn) -> dict:
-    p = create_project(payload.name, payload.template, payload.team_name)
+    try:
+        p = create_project(payload.name, payload.template, payload.team_name)
+    except IntegrityError as exc:
+        raise HTTPException(409, f"A project named {payload.name!r} already exists") from exc
     return {"id": p.id, "name": p.name}
 
 
-@app.get("/projects/{project_id}/chat")
-def chat(project_id: int) -> list[dict]:
-    if not get_project(project_id):
-        raise HTTPException(404, "Project not found")
-    return [{"role": m.role, "content": m.content, "created_at": m.created_at.isoformat()} for m in get_messages(project_id)]
+@router.post("/projects:batch", status_code=201)
+def create_batch(payload: ProjectBatchIn) -> list[dict]:
+    names = [spec.name for spec in payload.projects]
+    if len(set(names)) != len(names):
+        raise HTTPException(422, "Project names must be unique within a batch")
+    try:
+        projects = create_projects([(spec.name, spec.template, spec.team_name) for spec in payload.projects])
+    except IntegrityError as exc:
+        raise HTTPException(409, "A project with one of these names already exists") from exc
+    return [{"id": p.id, "name": p.name} for p in projects]
 
 
-@app.post("/projects/{project_id}/chat")
-def add_chat(project_id: int, payload: MessageIn) -> dict:
-    if not get_project(project_id):
-        raise HTTPException(404, "Project not found")
-    add_message(project_id, payload.role, payload.content)
+class _BodyReader:
+    """Blocking file-like view of a request body, for code running in a worker thread."""
+
+    def __init__(self, request: Request, loop: asyncio.AbstractEventLoop) -> None:
+        self._chunks = request.stream().__aiter__()
+        self._loop = loop
+        self._buffer = bytearray()
+        self._done = False
+
+    async def _next(self) -> bytes:
+        return await self._chunks.__anext__()
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._done and (size < 0 or len(self._buffer) < size):
+            try:
+                self._buffer += asyncio.run_coroutine_threadsafe(self._next(), self._loop).result()
+            except StopAsyncIteration:
+                self._done = True
+        size = len(self._buffer) if size < 0 else size
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+@router.post("/projects:import", status_code=201)
+async def import_archive(request: Request, name: str | None = None) -> dict:
+    """Create a project from a Launchpad package streamed as the raw request body."""
+    reader = _BodyReader(request, asyncio.get_running_loop())
+    try:
+        p = await asyncio.to_thread(import_project, reader, name)
+    except ValueError as exc:
+        raise HTTPException(400, str(exc)) from exc
+    return {"id": p.id, "name": p.name}
+
+
+@router.get("/projects/{project_id}/export")
+def export_archive(project_id: int, format: ArchiveFormat = "tar.gz", history: bool = True) -> StreamingResponse:
+    _require_project(project_id)
+    try:
+        body = export_project(project_id, format, include_history=history)
+    except ValueError as exc:
+        raise HTTPException(400, str(exc)) from exc
+    headers = {"Content-Disposition": f'attachment; filename="project_{project_id}.{format}"'}
+    return StreamingResponse(body, media_type=ARCHIVE_MEDIA_TYPES[format], headers=headers)
+
+
+@router.get("/projects/{project_id}/chat")
+async def chat(
+    project_id: int,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before_id: int | None = None,
+    after_id: int | None = None,
+) -> list[dict]:
+    await _require_project_async(project_id)
+    messages = await aio.get_messages(project_id, limit=limit, before_id=before_id, after_id=after_id)
+    return [_message_out(m) for m in messages]
+
+
+@router.get("/projects/{project_id}/chat/stream")
+def chat_stream(project_id: int, format: StreamFormat = "ndjson", after_id: int | None = None) -> StreamingResponse:
+    _require_project(project_id)
+    items = (_message_out(m) for m in iter_messages(project_id, after_id=after_id))
+    return StreamingResponse(_encode_stream(items, format), media_type=MEDIA_TYPES[format])
+
+
+@router.get("/projects/{project_id}/chat/subscribe")
+async def chat_subscribe(
+    project_id: int,
+    request: Request,
+    after_id: int | None = None,
+    last_event_id: str | None = Header(None),
+) -> StreamingResponse:
+    await _require_project_async(project_id)
+    if after_id is None and last_event_id and last_event_id.isdigit():
+        after_id = int(last_event_id)
+    if after_id is None:
+        latest = await aio.get_messages(project_id, limit=1)
+        after_id = latest[-1].id if latest else 0
+
+    async def events() -> AsyncIterator[str]:
+        cursor = after_id
+        idle_polls = 0
+        while not await request.is_disconnected():
+            batch = await aio.get_messages(project_id, limit=PAGE_SIZE, after_id=cursor)
+            for m in batch:
+                yield _sse_event(_message_out(m))
+                cursor = m.id
+            if len(batch) == PAGE_SIZE:
+                continue
+            idle_polls = 0 if batch else idle_polls + 1
+            if idle_polls >= SUBSCRIBE_KEEPALIVE_POLLS:
+                idle_polls = 0
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(SUBSCRIBE_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type=MEDIA_TYPES["sse"], headers={"Cache-Control": "no-cache"})
+
+
+@router.post("/projects/{project_id}/chat")
+async def add_chat(project_id: int, payload: MessageIn) -> dict:
+    await _require_project_async(project_id)
+    if write_behind is not None:
+        write_behind.submit(project_id, payload.role, payload.content)
+        return {"ok": True, "queued": True}
+    await aio.add_message(project_id, payload.role, payload.content)
     return {"ok": True}
 
 
-@app.post("/projects/{project_id}/evolve")
+@router.post("/projects/{project_id}/chat:batch")
+async def add_chat_batch(project_id: int, payload: MessageBatchIn) -> dict:
+    await _require_project_async(project_id)
+    await aio.add_messages(project_id, [(m.role, m.content) for m in payload.messages])
+    return {"ok": True, "count": len(payload.messages)}
+
+
+@router.post("/projects/{project_id}/evolve")
 def evolve(project_id: int, payload: EvolveIn) -> dict:
-    if not get_project(project_id):
-        raise HTTPException(404, "Project not found")
+    _require_project(project_id)
     return {"message": evolve_project(project_id, payload.feedback)}
 
 
-@app.get("/projects/{project_id}/history")
-def history(project_id: int) -> list[dict]:
-    if not get_project(project_id):
-        raise HTTPException(404, "Project not found")
-    return [{"id": s.id, "note": s.note, "created_at": s.created_at.isoformat()} for s in get_snapshots(project_id)]
+@router.post("/projects/{project_id}/run")
+async def run(project_id: int, payload: RunIn) -> dict:
+    await _require_project_async(project_id)
+    code, output, cached = await aio.run_project_command(project_id, payload.command, payload.use_cache)
+    return {"exit_code": code, "output": output, "cached": cached}
+
+
+@router.post("/projects/{project_id}/run/stream")
+async def run_stream(project_id: int, payload: RunIn, format: StreamFormat = "ndjson") -> StreamingResponse:
+    """Output as the command produces it; the last item carries the exit code."""
+    await _require_project_async(project_id)
+
+    async def events() -> AsyncIterator[str]:
+        seq = 0
+        async for chunk in aio.stream_local_command(project_id, payload.command, payload.use_cache):
+            seq += 1
+            item = {"id": seq, "output": chunk.output, "exit_code": chunk.exit_code, "cached": chunk.cached}
+            for line in _encode_stream([item], format):
+                yield line
+
+    return StreamingResponse(events(), media_type=MEDIA_TYPES[format], headers={"Cache-Control": "no-cache"})
+
+
+@router.post("/projects/{project_id}/jobs")
+def create_job(project_id: int, payload: JobIn) -> dict:
+    _require_project(project_id)
+    return _job_out(submit_job(project_id, payload.command, payload.priority, payload.use_cache))
+
+
+@router.get("/projects/{project_id}/jobs")
+def project_jobs(project_id: int, limit: int = Query(20, ge=1, le=PAGE_SIZE)) -> list[dict]:
+    _require_project(project_id)
+    return [_job_out(job, include_output=False) for job in list_jobs(project_id, limit)]
+
+
+@router.get("/jobs/stats")
+def jobs_stats() -> dict:
+    return job_stats()
+
+
+@router.get("/jobs/{job_id}")
+def job_status(job_id: int) -> dict:
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return _job_out(job)
+
+
+@router.post("/jobs/{job_id}/cancel")
+def job_cancel(job_id: int) -> dict:
+    job = cancel_job(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return _job_out(job, include_output=False)
+
+
+@router.get("/jobs/{job_id}/stream")
+def job_stream(job_id: int, format: StreamFormat = "ndjson") -> StreamingResponse:
+    if get_job(job_id) is None:
+        raise HTTPException(404, "Job not found")
+
+    async def events() -> AsyncIterator[str]:
+        sent = 0
+        seq = 0
+        while True:
+            job = await asyncio.to_thread(get_job, job_id)
+            chunk = job.output[sent:]
+            sent = len(job.output)
+            done = job.status in FINISHED
+            if chunk or done:
+                seq += 1
+                item = {"id": seq, "status": job.status, "output": chunk, "exit_code": job.exit_code}
+                for line in _encode_stream([item], format):
+                    yield line
+            if done:
+                return
+            await asyncio.sleep(JOB_STREAM_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type=MEDIA_TYPES[format], headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/projects/{project_id}/history")
+async def history(
+    project_id: int,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before_id: int | None = None,
+) -> list[dict]:
+    await _require_project_async(project_id)
+    return [_snapshot_out(s) for s in await aio.get_snapshots(project_id, limit=limit, before_id=before_id)]
 
 
-@app.get("/integrations")
-def integrations() -> dict[str, str]:
+@router.get("/projects/{project_id}/history/stream")
+def history_stream(project_id: int, format: StreamFormat = "ndjson", before_id: int | None = None) -> StreamingResponse:
+    _require_project(project_id)
+    items = (_snapshot_out(s) for s in iter_snapshots(project_id, before_id=before_id))
+    return StreamingResponse(_encode_stream(items, format), media_type=MEDIA_TYPES[format])
+
+
+@router.get("/projects/{project_id}/diff")
+def snapshot_diff(
+    project_id: int,
+    old_id: int,
+    new_id: int | None = None,
+    format: DiffFormat = "patch",
+    context: int = Query(3, ge=0, le=100),
+) -> StreamingResponse:
+    """Stream per-file unified diffs from `old_id` to `new_id`, or to the working tree when omitted."""
+    _require_project(project_id)
+    try:
+        if new_id is None:
+            diffs = iter_workspace_diffs(project_id, old_id, context)
+        else:
+            for snapshot_id in (old_id, new_id):
+                require_snapshot(project_id, snapshot_id)
+            diffs = iter_snapshot_diffs(old_id, new_id, context)
+        # Pull the first item now so a bad snapshot id is a 404, not a broken stream.
+        first = next(diffs, None)
+    except ValueError as exc:
+        raise HTTPException(404, str(exc)) from exc
+    items = itertools.chain([first] if first else [], diffs)
+    body = (d["diff"] for d in items) if format == "patch" else _encode_stream(items, format)
+    return StreamingResponse(body, media_type=MEDIA_TYPES[format])
+
+
+@router.post("/projects/{project_id}/history/{snapshot_id}/restore")
+def restore_project_snapshot(project_id: int, snapshot_id: int) -> dict:
+    _require_project(project_id)
+    try:
+        return restore_snapshot(project_id, snapshot_id)
+    except ValueError as exc:
+        raise HTTPException(404, str(exc)) from exc
+
+
+@router.get("/projects/{project_id}/files")
+def project_files(
+    project_id: int,
+    dir: str = "",
+    offset: int = Query(0, ge=0),
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+) -> dict:
+    _require_project(project_id)
+    try:
+        entries, has_more = list_project_dir(project_id, dir, offset, limit)
+    except ValueError as exc:
+        raise HTTPException(400, str(exc)) from exc
+    return {
+        "dir": dir.strip("/"),
+        "entries": [{"path": e.path, "is_dir": e.is_dir, "size": e.size} for e in entries],
+        "next_offset": offset + len(entries) if has_more else None,
+    }
+
+
+@router.get("/projects/{project_id}/files/content")
+def project_file_content(
+    project_id: int,
+    path: str,
+    offset: int = Query(0, ge=0),
+    length: int = Query(READ_CHUNK_BYTES, ge=1, le=MAX_READ_BYTES),
+) -> Response:
+    _require_project(project_id)
+    try:
+        info = file_info(project_id, path)
+    except ValueError as exc:
+        raise HTTPException(400, str(exc)) from exc
+    if info is None:
+        raise HTTPException(404, "File not found")
+    chunk = read_file_range(project_id, path, offset, length)
+    headers = {
+        "X-File-Size": str(info["size"]),
+        "X-File-Binary": str(info["binary"]).lower(),
+        "Content-Range": f"bytes {offset}-{offset + max(len(chunk), 1) - 1}/{info['size']}",
+    }
+    return Response(chunk, media_type="application/octet-stream", headers=headers)
+
+
+@router.get("/search")
+def search_history(
+    q: str = Query(..., min_length=1),
+    project_id: int | None = None,
+    kind: list[str] | None = Query(None),
+    limit: int = Query(20, ge=1, le=PAGE_SIZE),
+) -> list[dict]:
+    unknown = set(kind or []) - SOURCES.keys()
+    if unknown:
+        raise HTTPException(422, f"Unknown search kind(s): {', '.join(sorted(unknown))}")
+    return search(q, project_id=project_id, kinds=kind, limit=limit)
+
+
+@router.get("/projects/{project_id}/memories/search")
+def memory_search(
+    project_id: int,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=PAGE_SIZE),
+) -> list[dict]:
+    _require_project(project_id)
+    return search_memories(project_id, q, limit)
+
+
+@router.get("/maintenance/retention")
+def retention_report() -> dict:
+    """Dry run of the next compaction pass: what it would drop and how much space that frees."""
+    return compact(dry_run=True)
+
+
+@router.post("/maintenance/compact")
+def run_compaction(full_vacuum: bool = False) -> dict:
+    return compact(full_vacuum=full_vacuum)
+
+
+@router.get("/cache/stats")
+def cache_stats() -> dict:
+    return project_cache_stats()
+
+
+@router.get("/integrations")
+async def integrations() -> dict[str, str]:
     return triad_integrations()
+
+
+def create_app() -> FastAPI:
+    """Build the API application; storage, engines and background workers are set up when it starts serving.
+
+    `uvicorn --factory littup.api:create_app --workers N` gives every worker process its own app, engines and
+    connection pools, sharing only the SQLite database and the data directory.
+    """
+    application = FastAPI(title="LittUp API", version="0.2.0", routes=router.routes, lifespan=lifespan)
+    application.middleware("http")(record_latency)
+    return application
+
+
+_default_app: FastAPI | None = None
+_default_app_lock = threading.Lock()
+
+
+def __getattr__(name: str) -> FastAPI:
+    # `littup.api:app` keeps working for uvicorn and tests, but is only built when first asked for.
+    global _default_app
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _default_app_lock:
+        if _default_app is None:
+            _default_app = create_app()
+    return _default_app
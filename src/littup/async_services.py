@@ -0,0 +1,118 @@
+"""Async counterparts of the `services` functions on the API's hot request paths.
+
+Queries are shared with `services`; only the session and execution differ.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import AsyncIterator
+
+from . import memory_index, run_cache
+from .db import async_db_session
+from .impact import JOBS_ONLY_MESSAGE, is_impact_command
+from .models import AgentMessage, Project, Snapshot
+from .sandbox import RunChunk, run_command_async, stream_command
+from .services import (
+    cache_projects,
+    dashboard_out,
+    dashboard_query,
+    get_project_path,
+    message_inserts,
+    messages_query,
+    project_cache,
+    project_list_cache,
+    projects_query,
+    run_cache_key,
+    snapshots_query,
+    store_run_result,
+)
+
+
+async def get_project(project_id: int) -> Project | None:
+    project = project_cache.get(project_id)
+    if project is None:
+        async with async_db_session() as s:
+            project = await s.get(Project, project_id)
+        if project is not None:
+            project_cache.put(project_id, project)
+    return project
+
+
+async def list_projects(limit: int | None = None, after_id: int | None = None) -> list[Project]:
+    projects = project_list_cache.get((limit, after_id))
+    if projects is None:
+        async with async_db_session() as s:
+            projects = list((await s.scalars(projects_query(limit, after_id))).all())
+        cache_projects(projects, (limit, after_id))
+    return list(projects)
+
+
+async def dashboard() -> dict:
+    async with async_db_session() as s:
+        return dashboard_out((await s.execute(dashboard_query())).all())
+
+
+async def add_message(project_id: int, role: str, content: str) -> None:
+    await add_messages(project_id, [(role, content)])
+
+
+async def add_messages(project_id: int, turns: list[tuple[str, str]]) -> None:
+    if not turns:
+        return
+    async with async_db_session() as s:
+        for stmt in message_inserts(project_id, turns):
+            await s.execute(stmt)
+    await asyncio.to_thread(memory_index.update, project_id)
+
+
+async def get_messages(
+    project_id: int,
+    limit: int | None = None,
+    before_id: int | None = None,
+    after_id: int | None = None,
+) -> list[AgentMessage]:
+    stmt, newest_first = messages_query(project_id, limit, before_id, after_id)
+    async with async_db_session() as s:
+        rows = list((await s.scalars(stmt)).all())
+    return rows[::-1] if newest_first else rows
+
+
+async def get_snapshots(project_id: int, limit: int | None = None, before_id: int | None = None) -> list[Snapshot]:
+    async with async_db_session() as s:
+        return list((await s.scalars(snapshots_query(project_id, limit, before_id))).all())
+
+
+async def run_project_command(project_id: int, command: str, use_cache: bool = True) -> tuple[int, str, bool]:
+    if is_impact_command(command):
+        return 1, JOBS_ONLY_MESSAGE, False
+    key = await asyncio.to_thread(run_cache_key, project_id, command)
+    hit = await asyncio.to_thread(run_cache.lookup, key, use_cache) if key is not None else None
+    if hit is not None:
+        return *hit, True
+    code, output = await run_command_async(get_project_path(project_id), command)
+    if key is not None:
+        await asyncio.to_thread(store_run_result, key, project_id, command, code, output)
+    return code, output, False
+
+
+async def run_local_command(project_id: int, command: str, use_cache: bool = True) -> tuple[int, str]:
+    code, output, _ = await run_project_command(project_id, command, use_cache)
+    return code, output
+
+
+async def stream_local_command(project_id: int, command: str, use_cache: bool = True) -> AsyncIterator[RunChunk]:
+    if is_impact_command(command):
+        yield RunChunk(JOBS_ONLY_MESSAGE, 1)
+        return
+    key = await asyncio.to_thread(run_cache_key, project_id, command)
+    hit = await asyncio.to_thread(run_cache.lookup, key, use_cache) if key is not None else None
+    if hit is not None:
+        yield RunChunk(hit[1], hit[0], cached=True)
+        return
+    parts: list[str] = []
+    async for chunk in stream_command(get_project_path(project_id), command):
+        parts.append(chunk.output)
+        if chunk.exit_code is not None and key is not None:
+            await asyncio.to_thread(store_run_result, key, project_id, command, chunk.exit_code, "".join(parts).strip())
+        yield chunk
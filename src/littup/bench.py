@@ -0,0 +1,333 @@
+"""Benchmarks for LittUp's service layer, storage and API.
+
+    python -m littup.bench writes --processes 2 --messages 500 --profile tuned
+    python -m littup.bench services --files 200 --messages 2000 --snapshots 20
+    python -m littup.bench api --concurrency 8 --requests 400
+
+Each scenario runs against a throwaway data directory seeded with synthetic projects and prints a
+JSON report (or writes it with `--output`) so results can be compared between releases.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import socket
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from importlib import metadata
+from pathlib import Path
+
+from .config import STORAGE_PROFILES
+
+
+def _use_data_dir(data_dir: str, profile: str) -> None:
+    # Settings are read at import time, so this must run before any littup module is imported.
+    os.environ["LITTUP_DATA_DIR"] = data_dir
+    os.environ["LITTUP_DB_PATH"] = str(Path(data_dir) / "littup.db")
+    os.environ["LITTUP_PROJECTS_DIR"] = str(Path(data_dir) / "projects")
+    os.environ["LITTUP_STORAGE_PROFILE"] = profile
+
+
+def _setup_worker(data_dir: str, profile: str, results: mp.Queue) -> None:
+    _use_data_dir(data_dir, profile)
+    from .services import create_project, init_db
+
+    init_db()
+    results.put(create_project("Bench Project", "python_script").id)
+
+
+def _write_worker(data_dir: str, profile: str, project_id: int, count: int, start: mp.Event, results: mp.Queue) -> None:
+    _use_data_dir(data_dir, profile)
+    from sqlalchemy.exc import OperationalError
+
+    from .services import add_message
+
+    errors = 0
+    start.wait()
+    began = time.perf_counter()
+    for idx in range(count):
+        try:
+            add_message(project_id, "Coder", f"bench message {idx}")
+        except OperationalError:
+            errors += 1
+    results.put({"seconds": time.perf_counter() - began, "written": count - errors, "errors": errors})
+
+
+def bench_concurrent_writes(processes: int = 2, messages: int = 500, profile: str = "tuned") -> dict:
+    """Write chat messages from several processes at once, as the API and Streamlit UI do."""
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    with tempfile.TemporaryDirectory(prefix="littup-bench-") as data_dir:
+        setup = ctx.Process(target=_setup_worker, args=(data_dir, profile, results))
+        setup.start()
+        setup.join()
+        project_id = results.get()
+
+        start = ctx.Event()
+        workers = [
+            ctx.Process(target=_write_worker, args=(data_dir, profile, project_id, messages, start, results))
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        start.set()
+        reports = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+
+    wall = max(r["seconds"] for r in reports)
+    written = sum(r["written"] for r in reports)
+    return {
+        "scenario": "concurrent_writes",
+        "profile": profile,
+        "processes": processes,
+        "messages_per_process": messages,
+        "written": written,
+        "locked_errors": sum(r["errors"] for r in reports),
+        "seconds": round(wall, 4),
+        "writes_per_second": round(written / wall, 1) if wall else None,
+    }
+
+
+def environment() -> dict:
+    try:
+        version = metadata.version("littup")
+    except metadata.PackageNotFoundError:
+        version = "unknown"
+    return {
+        "littup": version,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def summarize(samples: list[float], wall: float | None = None) -> dict:
+    """Latency stats in milliseconds; throughput uses `wall` when calls overlapped."""
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+
+    elapsed = wall if wall is not None else sum(samples)
+    return {
+        "calls": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": pct(0.5),
+        "p95_ms": pct(0.95),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "ops_per_second": round(len(samples) / elapsed, 1) if elapsed else None,
+    }
+
+
+def timed(fn: Callable[[int], object], iterations: int) -> dict:
+    samples = []
+    for idx in range(iterations):
+        began = time.perf_counter()
+        fn(idx)
+        samples.append(time.perf_counter() - began)
+    return summarize(samples)
+
+
+def seed_project(files: int, messages: int, snapshots: int, name: str = "Bench Seed") -> int:
+    """Create a project with `files` source files, `messages` chat messages and `snapshots` snapshots."""
+    from .services import add_messages, create_project, save_snapshot, write_file
+
+    project_id = create_project(name, "python_script").id
+    for idx in range(files):
+        write_file(project_id, f"pkg/mod_{idx // 50}/file_{idx}.py", f"VALUE_{idx} = {idx}\n" * 40)
+    turns = [("Coder", f"seed message {idx}") for idx in range(messages)]
+    for start in range(0, len(turns), 500):
+        add_messages(project_id, turns[start : start + 500])
+    for idx in range(snapshots):
+        write_file(project_id, f"pkg/mod_0/file_{idx % max(files, 1)}.py", f"EDIT = {idx}\n")
+        save_snapshot(project_id, f"seed snapshot {idx}")
+    return project_id
+
+
+def _services_worker(data_dir: str, profile: str, options: dict, results: mp.Queue) -> None:
+    _use_data_dir(data_dir, profile)
+    from .services import (
+        add_message,
+        create_project,
+        get_messages,
+        init_db,
+        list_project_files,
+        run_local_command,
+        save_snapshot,
+        write_file,
+    )
+
+    init_db()
+    began = time.perf_counter()
+    project_id = seed_project(options["files"], options["messages"], options["snapshots"])
+    seed_seconds = time.perf_counter() - began
+    n = options["iterations"]
+
+    def edit_and_snapshot(idx: int) -> None:
+        write_file(project_id, "pkg/mod_0/file_0.py", f"BENCH = {idx}\n")
+        save_snapshot(project_id, f"bench {idx}")
+
+    results.put(
+        {
+            "seed_seconds": round(seed_seconds, 3),
+            "results": {
+                "create_project": timed(lambda idx: create_project(f"Bench {idx}", "python_script"), min(n, 50)),
+                "add_message": timed(lambda idx: add_message(project_id, "Coder", f"bench {idx}"), n),
+                "save_snapshot": timed(edit_and_snapshot, n),
+                "get_messages": timed(lambda _: get_messages(project_id, limit=100), n),
+                "list_project_files": timed(lambda _: list_project_files(project_id), n),
+                "run_local_command": timed(lambda _: run_local_command(project_id, "python -c pass", use_cache=False), min(n, 20)),
+            },
+        }
+    )
+
+
+def _run_in_fresh_process(target: Callable, profile: str, *args) -> dict:
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    with tempfile.TemporaryDirectory(prefix="littup-bench-") as data_dir:
+        worker = ctx.Process(target=target, args=(data_dir, profile, *args, results))
+        worker.start()
+        report = results.get()
+        worker.join()
+    return report
+
+
+def bench_services(
+    files: int = 200,
+    messages: int = 2000,
+    snapshots: int = 20,
+    iterations: int = 100,
+    profile: str = "tuned",
+) -> dict:
+    """Time the service-layer hot paths one call at a time against a seeded project."""
+    options = {"files": files, "messages": messages, "snapshots": snapshots, "iterations": iterations}
+    report = _run_in_fresh_process(_services_worker, profile, options)
+    return {"scenario": "services", "profile": profile, "seed": options, "environment": environment(), **report}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _api_worker(data_dir: str, profile: str, options: dict, results: mp.Queue) -> None:
+    _use_data_dir(data_dir, profile)
+    os.environ["LITTUP_COMPACTION_INTERVAL"] = "0"
+    import requests
+    import uvicorn
+
+    from .api import app
+    from .services import init_db
+
+    init_db()
+    project_id = seed_project(options["files"], options["messages"], options["snapshots"])
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    base = f"http://127.0.0.1:{port}"
+    routes = {
+        "GET /health": ("get", "/health", None),
+        "GET /projects": ("get", "/projects", None),
+        "GET /projects/{id}/chat": ("get", f"/projects/{project_id}/chat", None),
+        "GET /projects/{id}/history": ("get", f"/projects/{project_id}/history", None),
+        "POST /projects/{id}/chat": ("post", f"/projects/{project_id}/chat", {"role": "Coder", "content": "load"}),
+    }
+    local = threading.local()
+
+    def call(method: str, path: str, body: dict | None) -> tuple[float, bool]:
+        session = getattr(local, "session", None) or requests.Session()
+        local.session = session
+        began = time.perf_counter()
+        response = session.request(method, base + path, json=body, timeout=30)
+        return time.perf_counter() - began, response.ok
+
+    report = {}
+    with ThreadPoolExecutor(options["concurrency"]) as pool:
+        for name, (method, path, body) in routes.items():
+            began = time.perf_counter()
+            outcomes = list(pool.map(lambda _: call(method, path, body), range(options["requests"])))
+            wall = time.perf_counter() - began
+            report[name] = summarize([seconds for seconds, _ in outcomes], wall)
+            report[name]["errors"] = sum(1 for _, ok in outcomes if not ok)
+    server.should_exit = True
+    thread.join()
+    results.put({"results": report})
+
+
+def bench_api(
+    concurrency: int = 8,
+    requests_per_route: int = 400,
+    files: int = 200,
+    messages: int = 2000,
+    snapshots: int = 20,
+    profile: str = "tuned",
+) -> dict:
+    """Drive the API over real HTTP with `concurrency` parallel clients per route."""
+    options = {
+        "concurrency": concurrency,
+        "requests": requests_per_route,
+        "files": files,
+        "messages": messages,
+        "snapshots": snapshots,
+    }
+    report = _run_in_fresh_process(_api_worker, profile, options)
+    return {"scenario": "api", "profile": profile, "seed": options, "environment": environment(), **report}
+
+
+def _add_seed_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--snapshots", type=int, default=20)
+    parser.add_argument("--profile", choices=sorted(STORAGE_PROFILES), default="tuned")
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m littup.bench", description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="scenario", required=True)
+    writes = sub.add_parser("writes", help="concurrent add_message throughput across processes")
+    writes.add_argument("--processes", type=int, default=2)
+    writes.add_argument("--messages", type=int, default=500)
+    writes.add_argument("--profile", choices=sorted(STORAGE_PROFILES), action="append")
+    services = sub.add_parser("services", help="per-call latency of the service-layer hot paths")
+    _add_seed_args(services)
+    services.add_argument("--iterations", type=int, default=100)
+    api = sub.add_parser("api", help="API route latency and throughput under concurrent HTTP load")
+    _add_seed_args(api)
+    api.add_argument("--concurrency", type=int, default=8)
+    api.add_argument("--requests", type=int, default=400, help="requests per route")
+    for scenario in (writes, services, api):
+        scenario.add_argument("--output", type=Path, help="also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    if args.scenario == "writes":
+        profiles = args.profile or ["legacy", "tuned"]
+        report = [bench_concurrent_writes(args.processes, args.messages, profile) for profile in profiles]
+    elif args.scenario == "services":
+        report = bench_services(args.files, args.messages, args.snapshots, args.iterations, args.profile)
+    else:
+        report = bench_api(args.concurrency, args.requests, args.files, args.messages, args.snapshots, args.profile)
+    rendered = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(rendered + "\n")
+    print(rendered)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import hashlib
+import zlib
+from collections.abc import Iterable, Iterator
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .models import Blob
+
+# Tiny files rarely shrink under zlib and cost a decompress on every read.
+MIN_COMPRESS_SIZE = 256
+# Stay well under SQLite's bound-parameter limit for IN (...) lookups.
+LOOKUP_CHUNK = 500
+
+
+def blob_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def encode_blob(data: bytes, compress: bool) -> tuple[bytes, bool]:
+    if compress and len(data) >= MIN_COMPRESS_SIZE:
+        packed = zlib.compress(data, 6)
+        if len(packed) < len(data):
+            return packed, True
+    return data, False
+
+
+def decode_blob(data: bytes, compressed: bool) -> bytes:
+    return zlib.decompress(data) if compressed else data
+
+
+def _chunks(items: list[str], size: int = LOOKUP_CHUNK) -> Iterator[list[str]]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def existing_hashes(session: Session, hashes: Iterable[str]) -> set[str]:
+    found: set[str] = set()
+    for chunk in _chunks(list(set(hashes))):
+        found.update(session.scalars(select(Blob.hash).where(Blob.hash.in_(chunk))))
+    return found
+
+
+def put_blobs(session: Session, contents: dict[str, bytes], compress: bool = True) -> int:
+    """Store blobs keyed by their hash, skipping any already present. Returns the number written."""
+    if not contents:
+        return 0
+    present = existing_hashes(session, contents)
+    rows = []
+    for digest, data in contents.items():
+        if digest in present:
+            continue
+        payload, compressed = encode_blob(data, compress)
+        rows.append({"hash": digest, "size": len(data), "compressed": compressed, "data": payload})
+    if rows:
+        # Another process may race us to the same content; identical hash means identical bytes.
+        session.execute(sqlite_insert(Blob).on_conflict_do_nothing(index_elements=["hash"]), rows)
+    return len(rows)
+
+
+def get_blobs(session: Session, hashes: Iterable[str]) -> dict[str, bytes]:
+    out: dict[str, bytes] = {}
+    for chunk in _chunks(list(set(hashes))):
+        for digest, data, compressed in session.execute(
+            select(Blob.hash, Blob.data, Blob.compressed).where(Blob.hash.in_(chunk))
+        ):
+            out[digest] = decode_blob(data, compressed)
+    return out
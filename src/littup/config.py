@@ -2,9 +2,62 @@ from __future__ import annotations
 
 import os
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 
 
+@dataclass(frozen=True)
+class StorageProfile:
+    name: str
+    journal_mode: str
+    synchronous: str
+    busy_timeout_ms: int
+    mmap_size: int
+    cache_size_kib: int
+    pool_size: int
+
+
+JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+SYNCHRONOUS_LEVELS = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+STORAGE_PROFILES = {
+    # WAL lets the API and Streamlit processes read while the other writes.
+    "tuned": StorageProfile("tuned", "WAL", "NORMAL", 5000, 256 * 1024 * 1024, 64 * 1024, 8),
+    "durable": StorageProfile("durable", "WAL", "FULL", 5000, 256 * 1024 * 1024, 64 * 1024, 8),
+    # SQLite's own defaults, kept for comparison and for filesystems without shared-memory support.
+    "legacy": StorageProfile("legacy", "DELETE", "FULL", 5000, 0, 2000, 5),
+}
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    keep_last: int
+    keep_hourly: int
+    keep_daily: int
+    keep_weekly: int
+    max_bytes: int
+    cold_after_days: int
+
+
+@dataclass(frozen=True)
+class SandboxLimits:
+    timeout: float
+    # First word of the command -> timeout, e.g. a longer budget for `pytest` than for `python`.
+    command_timeouts: dict[str, float]
+    cpu_seconds: int
+    memory_bytes: int
+    file_bytes: int
+    output_chars: int
+
+    def timeout_for(self, command: str) -> float:
+        parts = command.split()
+        return self.command_timeouts.get(parts[0], self.timeout) if parts else self.timeout
+
+    @property
+    def max_timeout(self) -> float:
+        return max([self.timeout, *self.command_timeouts.values()])
+
+
 @dataclass(frozen=True)
 class LittUpSettings:
     env: str
@@ -13,9 +66,24 @@ class LittUpSettings:
     port: int
     api_host: str
     api_port: int
+    api_workers: int
     data_dir: Path
     db_path: Path
     projects_dir: Path
+    snapshot_compression: bool
+    storage: StorageProfile
+    chat_write_behind: bool
+    job_workers: int
+    job_project_concurrency: int
+    sandbox_mode: str
+    sandbox_cache_bytes: int
+    sandbox_limits: SandboxLimits
+    run_cache_bytes: int
+    project_cache_size: int
+    project_cache_ttl: int
+    retention: RetentionPolicy
+    compaction_interval: int
+    slow_query_ms: int
 
     @property
     def api_base_url(self) -> str:
@@ -29,6 +97,71 @@ def _as_int(name: str, default: int) -> int:
     return int(value)
 
 
+def _as_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+def get_storage_profile() -> StorageProfile:
+    name = os.getenv("LITTUP_STORAGE_PROFILE", "tuned").lower()
+    if name not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown LITTUP_STORAGE_PROFILE {name!r}; expected one of {sorted(STORAGE_PROFILES)}")
+    base = STORAGE_PROFILES[name]
+    journal_mode = os.getenv("LITTUP_SQLITE_JOURNAL_MODE", base.journal_mode).upper()
+    synchronous = os.getenv("LITTUP_SQLITE_SYNCHRONOUS", base.synchronous).upper()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError(f"Unsupported LITTUP_SQLITE_JOURNAL_MODE {journal_mode!r}")
+    if synchronous not in SYNCHRONOUS_LEVELS:
+        raise ValueError(f"Unsupported LITTUP_SQLITE_SYNCHRONOUS {synchronous!r}")
+    return StorageProfile(
+        name=name,
+        journal_mode=journal_mode,
+        synchronous=synchronous,
+        busy_timeout_ms=_as_int("LITTUP_SQLITE_BUSY_TIMEOUT_MS", base.busy_timeout_ms),
+        mmap_size=_as_int("LITTUP_SQLITE_MMAP_SIZE", base.mmap_size),
+        cache_size_kib=_as_int("LITTUP_SQLITE_CACHE_SIZE_KIB", base.cache_size_kib),
+        pool_size=_as_int("LITTUP_DB_POOL_SIZE", base.pool_size),
+    )
+
+
+def get_retention_policy() -> RetentionPolicy:
+    """Snapshot retention; a snapshot survives if any rule keeps it and the byte budget allows."""
+    return RetentionPolicy(
+        keep_last=max(1, _as_int("LITTUP_RETENTION_KEEP_LAST", 20)),
+        keep_hourly=_as_int("LITTUP_RETENTION_KEEP_HOURLY", 24),
+        keep_daily=_as_int("LITTUP_RETENTION_KEEP_DAILY", 14),
+        keep_weekly=_as_int("LITTUP_RETENTION_KEEP_WEEKLY", 8),
+        # 0 means no per-project byte budget.
+        max_bytes=_as_int("LITTUP_RETENTION_MAX_MB", 0) * 1024 * 1024,
+        cold_after_days=_as_int("LITTUP_RETENTION_COLD_DAYS", 7),
+    )
+
+
+def _as_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return float(value)
+
+
+def get_sandbox_limits() -> SandboxLimits:
+    """Per-run caps for sandboxed commands; a limit of 0 disables it."""
+    timeout = _as_float("LITTUP_RUN_TIMEOUT", 30)
+    return SandboxLimits(
+        timeout=timeout,
+        command_timeouts={
+            "python": _as_float("LITTUP_RUN_TIMEOUT_PYTHON", timeout),
+            "pytest": _as_float("LITTUP_RUN_TIMEOUT_PYTEST", timeout),
+        },
+        cpu_seconds=_as_int("LITTUP_RUN_CPU_SECONDS", 60),
+        memory_bytes=_as_int("LITTUP_RUN_MEMORY_MB", 2048) * 1024 * 1024,
+        file_bytes=_as_int("LITTUP_RUN_FILE_MB", 256) * 1024 * 1024,
+        output_chars=max(1024, _as_int("LITTUP_RUN_OUTPUT_KB", 1024) * 1024),
+    )
+
+
 def get_settings() -> LittUpSettings:
     env = os.getenv("LITTUP_ENV", "development").lower()
     host_default = "0.0.0.0" if env == "production" else "127.0.0.1"
@@ -37,6 +170,7 @@ def get_settings() -> LittUpSettings:
 
     api_host = os.getenv("LITTUP_API_HOST", "127.0.0.1")
     api_port = _as_int("LITTUP_API_PORT", 8756)
+    api_workers = max(1, _as_int("LITTUP_API_WORKERS", 1))
 
     data_dir = Path(os.getenv("LITTUP_DATA_DIR", Path.home() / ".littup")).expanduser().resolve()
     db_path = Path(os.getenv("LITTUP_DB_PATH", data_dir / "littup.db")).expanduser().resolve()
@@ -49,12 +183,33 @@ def get_settings() -> LittUpSettings:
         port=port,
         api_host=api_host,
         api_port=api_port,
+        api_workers=api_workers,
         data_dir=data_dir,
         db_path=db_path,
         projects_dir=projects_dir,
+        snapshot_compression=_as_bool("LITTUP_SNAPSHOT_COMPRESSION", True),
+        storage=get_storage_profile(),
+        chat_write_behind=_as_bool("LITTUP_CHAT_WRITE_BEHIND", False),
+        job_workers=_as_int("LITTUP_JOB_WORKERS", 4),
+        job_project_concurrency=_as_int("LITTUP_JOB_PROJECT_CONCURRENCY", 1),
+        sandbox_mode=os.getenv("LITTUP_SANDBOX_MODE", "warm").lower(),
+        sandbox_cache_bytes=_as_int("LITTUP_SANDBOX_CACHE_MB", 1024) * 1024 * 1024,
+        sandbox_limits=get_sandbox_limits(),
+        run_cache_bytes=_as_int("LITTUP_RUN_CACHE_MB", 64) * 1024 * 1024,
+        project_cache_size=_as_int("LITTUP_PROJECT_CACHE_SIZE", 1024),
+        project_cache_ttl=_as_int("LITTUP_PROJECT_CACHE_TTL", 30),
+        retention=get_retention_policy(),
+        compaction_interval=_as_int("LITTUP_COMPACTION_INTERVAL", 0),
+        slow_query_ms=_as_int("LITTUP_SLOW_QUERY_MS", 0),
     )
 
 
+@lru_cache(maxsize=1)
+def current_settings() -> LittUpSettings:
+    """This process's settings, read from the environment once; nothing is created on disk."""
+    return get_settings()
+
+
 def ensure_storage_paths(settings: LittUpSettings | None = None) -> LittUpSettings:
     settings = settings or get_settings()
     settings.data_dir.mkdir(parents=True, exist_ok=True)
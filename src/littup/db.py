@@ -1,16 +1,139 @@
 from __future__ import annotations
 
-from contextlib import contextmanager
+import threading
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
+from sqlalchemy.schema import CreateColumn
 
-from .config import ensure_storage_paths, get_settings
+from .config import LittUpSettings, current_settings, ensure_storage_paths
+from .metrics import instrument_engine
 
-settings = ensure_storage_paths(get_settings())
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent schema setup is not serialized across processes.
+    fcntl = None
 
-engine = create_engine(f"sqlite:///{settings.db_path}", echo=False, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False)
+# Engines and storage paths are created on first use, once per process, so importing the API (or forking
+# a worker before it serves anything) stays cheap and every worker opens its own connection pools.
+_resources: dict[str, Any] = {}
+_resources_lock = threading.RLock()
+
+
+def _install_pragmas(engine: Engine, settings: LittUpSettings) -> None:
+    profile = settings.storage
+
+    @event.listens_for(engine, "connect")
+    def _apply_pragmas(dbapi_connection, _record) -> None:
+        cursor = dbapi_connection.cursor()
+        # Only takes effect on a new database (or at the next VACUUM); lets compaction hand pages back.
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute(f"PRAGMA journal_mode={profile.journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={profile.synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(profile.busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA mmap_size={int(profile.mmap_size)}")
+        # Negative cache_size is in KiB rather than pages.
+        cursor.execute(f"PRAGMA cache_size=-{int(profile.cache_size_kib)}")
+        cursor.close()
+
+
+def build_engine(settings: LittUpSettings) -> Engine:
+    profile = settings.storage
+    engine = create_engine(
+        f"sqlite:///{settings.db_path}",
+        echo=False,
+        future=True,
+        pool_size=profile.pool_size,
+        max_overflow=profile.pool_size * 2,
+        # Connections are handed between uvicorn's worker threads by the pool.
+        connect_args={"check_same_thread": False, "timeout": profile.busy_timeout_ms / 1000},
+    )
+    _install_pragmas(engine, settings)
+    instrument_engine(engine, "sync", settings.slow_query_ms)
+    return engine
+
+
+def build_async_engine(settings: LittUpSettings) -> AsyncEngine:
+    profile = settings.storage
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{settings.db_path}",
+        echo=False,
+        pool_size=profile.pool_size,
+        max_overflow=profile.pool_size * 2,
+        connect_args={"timeout": profile.busy_timeout_ms / 1000},
+    )
+    _install_pragmas(engine.sync_engine, settings)
+    instrument_engine(engine.sync_engine, "async", settings.slow_query_ms)
+    return engine
+
+
+def _resource(name: str, factory: Callable[[], Any]) -> Any:
+    value = _resources.get(name)
+    if value is None:
+        with _resources_lock:
+            value = _resources.get(name)
+            if value is None:
+                value = _resources[name] = factory()
+    return value
+
+
+def storage_settings() -> LittUpSettings:
+    """The process settings, with the data, project and database directories created."""
+    return _resource("settings", lambda: ensure_storage_paths(current_settings()))
+
+
+def get_engine() -> Engine:
+    return _resource("engine", lambda: build_engine(storage_settings()))
+
+
+def get_async_engine() -> AsyncEngine:
+    return _resource("async_engine", lambda: build_async_engine(storage_settings()))
+
+
+def session_factory() -> sessionmaker[Session]:
+    return _resource(
+        "sessions",
+        lambda: sessionmaker(bind=get_engine(), autoflush=False, autocommit=False, expire_on_commit=False),
+    )
+
+
+def async_session_factory() -> async_sessionmaker[AsyncSession]:
+    return _resource(
+        "async_sessions",
+        lambda: async_sessionmaker(bind=get_async_engine(), autoflush=False, expire_on_commit=False),
+    )
+
+
+@contextmanager
+def schema_lock() -> Iterator[None]:
+    """Serialize schema setup across processes, e.g. API workers starting together on a fresh database."""
+    settings = storage_settings()
+    if fcntl is None:
+        yield
+        return
+    with open(settings.db_path.with_name(settings.db_path.name + ".init.lock"), "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        yield
+
+
+_LAZY = {
+    "settings": storage_settings,
+    "engine": get_engine,
+    "async_engine": get_async_engine,
+    "SessionLocal": session_factory,
+    "AsyncSessionLocal": async_session_factory,
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name in _LAZY:
+        return _LAZY[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Base(DeclarativeBase):
@@ -19,7 +142,7 @@ class Base(DeclarativeBase):
 
 @contextmanager
 def db_session() -> Session:
-    session = SessionLocal()
+    session = session_factory()()
     try:
         yield session
         session.commit()
@@ -28,3 +151,36 @@ def db_session() -> Session:
         raise
     finally:
         session.close()
+
+
+@asynccontextmanager
+async def async_db_session() -> AsyncIterator[AsyncSession]:
+    async with async_session_factory()() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+
+def add_missing_columns(engine: Engine) -> list[str]:
+    """Add columns the models gained since an existing table was created; `create_all` only adds tables.
+
+    New non-nullable columns must declare a `server_default` for the rows already there.
+    """
+    added: list[str] = []
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            missing = [column for column in table.columns if column.name not in existing]
+            for column in missing:
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=conn.dialect)}")
+                added.append(f"{table.name}.{column.name}")
+            if missing:
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+    return added
@@ -0,0 +1,121 @@
+"""Test-impact analysis: rerun only the tests a change can affect.
+
+A pytest job whose command carries `--impacted` (e.g. `pytest -q --impacted`) runs with the
+`littup.pytest_impact` plugin, which records the project files every test executes. The project's
+latest coverage map and the tree it was recorded against are kept in `coverage_maps`; the next such
+job diffs the current tree against that tree and runs only tests whose files changed, changed test
+files and tests that failed last time. Anything the map cannot vouch for falls back to a full run:
+no map yet, a changed conftest, non-Python or shared (session fixture/collection-time) file.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import shlex
+from dataclasses import dataclass
+from pathlib import Path
+
+from .db import db_session
+from .models import CoverageMap
+from .tree import DEFAULT_IGNORES
+
+IMPACT_FLAG = "--impacted"
+PLUGIN = "littup.pytest_impact"
+REPORT_NAME = "impact.json"
+SELECTION_NAME = "selection.json"
+# Direct runs have no place to record coverage, and pytest itself rejects the flag.
+JOBS_ONLY_MESSAGE = f"{IMPACT_FLAG} only works for queued jobs (POST /projects/{{id}}/jobs or the Forge Room Test button)."
+# Changes to these never affect a test run.
+DOC_SUFFIXES = (".md", ".rst")
+NOISE_DIRS = {pattern.rstrip("/") for pattern in DEFAULT_IGNORES}
+TEST_FILE = re.compile(r"(^|/)(test_[^/]*|[^/]*_test)\.py$")
+
+
+@dataclass(frozen=True)
+class ImpactPlan:
+    project_id: int
+    # The tree being tested, recorded with the coverage once the run completes.
+    manifest: dict[str, str]
+    # Node ids or test files to run; None runs everything.
+    selected: list[str] | None
+    summary: str
+
+
+def is_impact_command(command: str) -> bool:
+    parts = command.split()
+    return bool(parts) and parts[0] == "pytest" and IMPACT_FLAG in parts[1:]
+
+
+def changed_files(before: dict[str, str], after: dict[str, str]) -> set[str]:
+    return {
+        rel
+        for rel in before.keys() | after.keys()
+        if before.get(rel) != after.get(rel) and NOISE_DIRS.isdisjoint(rel.split("/")[:-1]) and not rel.endswith(".pyc")
+    }
+
+
+def _unknown_change(rel: str, shared: set[str]) -> bool:
+    if rel.endswith(DOC_SUFFIXES):
+        return False
+    return rel in shared or not rel.endswith(".py") or rel.rsplit("/", 1)[-1] == "conftest.py"
+
+
+def plan_tests(project_id: int, manifest: dict[str, str]) -> ImpactPlan:
+    """What to run for the project tree `manifest` (path -> hash), given the recorded coverage."""
+    with db_session() as s:
+        coverage = s.get(CoverageMap, project_id)
+    if coverage is None:
+        return ImpactPlan(project_id, manifest, None, "Running all tests: no coverage recorded yet.")
+    tested, tests = json.loads(coverage.manifest), json.loads(coverage.tests)
+    shared, failed = set(json.loads(coverage.shared)), set(json.loads(coverage.failed))
+    changed = changed_files(tested, manifest)
+    for rel in sorted(changed):
+        if _unknown_change(rel, shared):
+            return ImpactPlan(project_id, manifest, None, f"Running all tests: {rel} changed.")
+    selected = failed | {rel for rel in changed if TEST_FILE.search(rel) and rel in manifest}
+    selected.update(nodeid for nodeid, files in tests.items() if not changed.isdisjoint(files))
+    if not selected:
+        return ImpactPlan(project_id, manifest, [], f"No tests affected by {len(changed)} changed file(s).")
+    summary = f"Running {len(selected)} of {len(tests)} recorded test(s) affected by {len(changed)} changed file(s)"
+    return ImpactPlan(project_id, manifest, sorted(selected), summary + (f", including {len(failed)} that failed last time." if failed else "."))
+
+
+def impact_command(command: str, plan: ImpactPlan, scratch: Path) -> str:
+    """`command` without the impact flag, running the plugin with its report (and selection) in `scratch`."""
+    args = [arg for arg in shlex.split(command)[1:] if arg != IMPACT_FLAG]
+    options = ["-p", PLUGIN, f"--impact-out={scratch / REPORT_NAME}"]
+    if plan.selected is not None:
+        (scratch / SELECTION_NAME).write_text(json.dumps(plan.selected), encoding="utf-8")
+        options.append(f"--impact-select={scratch / SELECTION_NAME}")
+    return shlex.join(["pytest", *options, *args])
+
+
+def record_coverage(plan: ImpactPlan, scratch: Path) -> bool:
+    """Fold the run's report into the project's coverage map; False if the run did not complete."""
+    try:
+        report = json.loads((scratch / REPORT_NAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    if not report["complete"]:
+        return False
+    with db_session() as s:
+        coverage = s.get(CoverageMap, plan.project_id)
+        if coverage is None:
+            coverage = CoverageMap(project_id=plan.project_id)
+            s.add(coverage)
+        tests, shared, failed = {}, set(), set()
+        if report["selective"] and coverage.tests:
+            tests, shared, failed = json.loads(coverage.tests), set(json.loads(coverage.shared)), set(json.loads(coverage.failed))
+        collected = set(report["collected"])
+        tests = {nodeid: files for nodeid, files in tests.items() if nodeid in collected}
+        for nodeid, test in report["tests"].items():
+            tests[nodeid] = test["files"]
+            failed.discard(nodeid)
+            if test["outcome"] == "failed":
+                failed.add(nodeid)
+        coverage.manifest = json.dumps(plan.manifest)
+        coverage.tests = json.dumps(tests)
+        coverage.shared = json.dumps(sorted(shared | set(report["shared"])))
+        coverage.failed = json.dumps(sorted(failed & collected))
+    return True
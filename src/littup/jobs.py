@@ -0,0 +1,342 @@
+"""Persistent run/test job queue executed by a bounded pool of sandbox processes.
+
+The `run_jobs` table is the queue. Any process may submit jobs; every process that starts a
+`JobRunner` claims work from it atomically, so the API and Streamlit processes can share it.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import func, or_, select, update
+
+from .db import db_session
+from . import run_cache
+from .impact import impact_command, is_impact_command, plan_tests, record_coverage
+from .metrics import REGISTRY
+from .models import RunJob
+from .sandbox import (
+    BLOCKED_MESSAGE,
+    TIMEOUT_EXIT_CODE,
+    OutputBuffer,
+    exit_note,
+    is_allowed,
+    kill_process_group,
+    limits,
+    pump_output,
+    sandbox_copy,
+    spawn,
+    track_run,
+)
+from .services import get_project_path, refresh_file_index, run_cache_key, settings, store_run_result
+
+logger = logging.getLogger(__name__)
+
+FINISHED = {"succeeded", "failed", "cancelled"}
+POLL_SECONDS = 0.25
+CANCELLED_EXIT_CODE = -9
+STATS_WINDOW = 200
+HEARTBEAT_SECONDS = 5.0
+# A running job whose runner has not checked in for this long is presumed orphaned and requeued.
+ORPHAN_SECONDS = 30.0
+
+
+def submit_job(project_id: int, command: str, priority: int = 0, use_cache: bool = True) -> RunJob:
+    with db_session() as s:
+        job = RunJob(
+            project_id=project_id, command=command, priority=priority, use_cache=use_cache, status="queued", output=""
+        )
+        s.add(job)
+        s.flush()
+    JobRunner.notify_all()
+    return job
+
+
+def get_job(job_id: int) -> RunJob | None:
+    with db_session() as s:
+        return s.get(RunJob, job_id)
+
+
+def list_jobs(project_id: int, limit: int = 20) -> list[RunJob]:
+    with db_session() as s:
+        stmt = select(RunJob).where(RunJob.project_id == project_id).order_by(RunJob.id.desc()).limit(limit)
+        return list(s.scalars(stmt).all())
+
+
+def cancel_job(job_id: int) -> RunJob | None:
+    """Cancel a queued job immediately; a running job is killed by its runner on the next poll."""
+    with db_session() as s:
+        s.execute(
+            update(RunJob)
+            .where(RunJob.id == job_id, RunJob.status == "queued")
+            .values(status="cancelled", finished_at=datetime.utcnow())
+        )
+        s.execute(update(RunJob).where(RunJob.id == job_id, RunJob.status == "running").values(cancel_requested=True))
+        return s.get(RunJob, job_id)
+
+
+def wait_for_job(job_id: int, timeout: float | None = None) -> RunJob | None:
+    deadline = time.monotonic() + (limits.max_timeout + 5 if timeout is None else timeout)
+    while True:
+        job = get_job(job_id)
+        if job is None or job.status in FINISHED or time.monotonic() >= deadline:
+            return job
+        time.sleep(POLL_SECONDS)
+
+
+def _percentile(values: list[float], pct: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(pct * len(ordered)))], 3)
+
+
+def job_stats(window: int = STATS_WINDOW) -> dict:
+    with db_session() as s:
+        counts = dict(
+            s.execute(
+                select(RunJob.status, func.count()).where(RunJob.status.in_(["queued", "running"])).group_by(RunJob.status)
+            ).all()
+        )
+        recent = s.execute(
+            select(RunJob.created_at, RunJob.started_at, RunJob.finished_at)
+            .where(RunJob.status.in_(FINISHED), RunJob.started_at.is_not(None))
+            .order_by(RunJob.id.desc())
+            .limit(window)
+        ).all()
+    waits = [(started - created).total_seconds() for created, started, _ in recent]
+    runs = [(finished - started).total_seconds() for _, started, finished in recent]
+    return {
+        "queue_depth": counts.get("queued", 0),
+        "running": counts.get("running", 0),
+        "workers": settings.job_workers,
+        "sample_size": len(recent),
+        "queue_wait_seconds": {"p50": _percentile(waits, 0.5), "p95": _percentile(waits, 0.95)},
+        "run_seconds": {"p50": _percentile(runs, 0.5), "p95": _percentile(runs, 0.95)},
+    }
+
+
+def _count_jobs(status: str) -> int:
+    with db_session() as s:
+        return s.scalar(select(func.count()).select_from(RunJob).where(RunJob.status == status))
+
+
+REGISTRY.gauge("littup_job_queue_depth", "Run jobs waiting for a worker.", function=lambda: _count_jobs("queued"))
+REGISTRY.gauge("littup_jobs_running", "Run jobs currently claimed by a worker.", function=lambda: _count_jobs("running"))
+
+
+class JobRunner:
+    _instances: list[JobRunner] = []
+
+    def __init__(
+        self,
+        max_workers: int | None = None,
+        per_project: int | None = None,
+        timeout: float | None = None,
+    ) -> None:
+        self.max_workers = max_workers or settings.job_workers
+        self.per_project = per_project or settings.job_project_concurrency
+        self.timeout = timeout
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._active: set[threading.Thread] = set()
+        # Ids of the jobs this runner is executing, kept alive by its heartbeat.
+        self._held: set[int] = set()
+        self._lock = threading.Lock()
+        self._dispatcher: threading.Thread | None = None
+        self._last_beat = 0.0
+
+    @classmethod
+    def notify_all(cls) -> None:
+        for runner in cls._instances:
+            runner._wake.set()
+
+    def start(self) -> JobRunner:
+        if self._dispatcher is None:
+            self.recover_orphans()
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name="littup-job-dispatch", daemon=True)
+            self._dispatcher.start()
+            JobRunner._instances.append(self)
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop claiming work; running jobs are killed and requeued for the next runner."""
+        self._stopping.set()
+        self._wake.set()
+        if self._dispatcher is not None:
+            self._dispatcher.join(timeout)
+        with self._lock:
+            active = list(self._active)
+        for worker in active:
+            worker.join(timeout)
+        if self in JobRunner._instances:
+            JobRunner._instances.remove(self)
+
+    def recover_orphans(self) -> int:
+        """Requeue running jobs whose runner stopped heartbeating, e.g. because its process died."""
+        stale = datetime.utcnow() - timedelta(seconds=ORPHAN_SECONDS)
+        with db_session() as s:
+            orphaned = s.scalars(
+                update(RunJob)
+                .where(RunJob.status == "running", or_(RunJob.heartbeat_at.is_(None), RunJob.heartbeat_at < stale))
+                .values(status="queued", claimed_by=None, started_at=None, heartbeat_at=None, output="")
+                .returning(RunJob.id)
+            ).all()
+        return len(orphaned)
+
+    def _heartbeat(self) -> None:
+        with self._lock:
+            held = list(self._held)
+        if held:
+            with db_session() as s:
+                s.execute(
+                    update(RunJob)
+                    .where(RunJob.id.in_(held), RunJob.status == "running")
+                    .values(heartbeat_at=datetime.utcnow())
+                )
+        self.recover_orphans()
+
+    def _claim_next(self) -> RunJob | None:
+        running = RunJob.__table__.alias("running")
+        busy = (
+            select(func.count())
+            .select_from(running)
+            .where(running.c.project_id == RunJob.project_id, running.c.status == "running")
+            .scalar_subquery()
+        )
+        candidate = (
+            select(RunJob.id)
+            .where(RunJob.status == "queued", busy < self.per_project)
+            .order_by(RunJob.priority.desc(), RunJob.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        # One UPDATE statement, so SQLite's write lock makes the claim atomic across processes.
+        now = datetime.utcnow()
+        with db_session() as s:
+            job_id = s.scalar(
+                update(RunJob)
+                .where(RunJob.id == candidate, RunJob.status == "queued")
+                .values(status="running", claimed_by=os.getpid(), started_at=now, heartbeat_at=now)
+                .returning(RunJob.id)
+            )
+            return s.get(RunJob, job_id) if job_id is not None else None
+
+    def _dispatch_loop(self) -> None:
+        while not self._stopping.is_set():
+            if time.monotonic() - self._last_beat >= HEARTBEAT_SECONDS:
+                # From the dispatcher, so a job stays claimed however long its worker blocks.
+                self._heartbeat()
+                self._last_beat = time.monotonic()
+            with self._lock:
+                free = self.max_workers - len(self._active)
+            job = self._claim_next() if free > 0 else None
+            if job is None:
+                self._wake.wait(POLL_SECONDS)
+                self._wake.clear()
+                continue
+            worker = threading.Thread(target=self._run_job, args=(job,), name=f"littup-job-{job.id}", daemon=True)
+            with self._lock:
+                self._active.add(worker)
+                self._held.add(job.id)
+            worker.start()
+
+    def _run_job(self, job: RunJob) -> None:
+        try:
+            status, code, tail = self._execute(job)
+        except Exception as exc:
+            logger.exception("Job %s crashed", job.id)
+            status, code, tail = "failed", 1, f"\n{exc}"
+        finally:
+            with self._lock:
+                self._active.discard(threading.current_thread())
+            self._wake.set()
+        values = {"exit_code": code, "finished_at": datetime.utcnow(), "status": status}
+        if status == "queued":
+            values = {"status": "queued", "claimed_by": None, "started_at": None, "heartbeat_at": None, "output": ""}
+        try:
+            with db_session() as s:
+                stmt = update(RunJob).where(RunJob.id == job.id).values(**values)
+                if tail and status != "queued":
+                    stmt = stmt.values(output=RunJob.output + tail)
+                s.execute(stmt)
+        finally:
+            with self._lock:
+                self._held.discard(job.id)
+
+    def _append_output(self, job_id: int, chunks: list[str]) -> bool:
+        """Flush captured output and report whether cancellation was requested."""
+        with db_session() as s:
+            if chunks:
+                s.execute(update(RunJob).where(RunJob.id == job_id).values(output=RunJob.output + "".join(chunks)))
+            return bool(s.scalar(select(RunJob.cancel_requested).where(RunJob.id == job_id)))
+
+    def _execute(self, job: RunJob) -> tuple[str, int, str]:
+        if not is_allowed(job.command):
+            return "failed", 1, BLOCKED_MESSAGE
+        key = run_cache_key(job.project_id, job.command)
+        hit = run_cache.lookup(key, job.use_cache) if key is not None else None
+        if hit is not None:
+            with db_session() as s:
+                s.execute(update(RunJob).where(RunJob.id == job.id).values(cached=True))
+            return "succeeded" if hit[0] == 0 else "failed", hit[0], hit[1]
+        plan = plan_tests(job.project_id, refresh_file_index(job.project_id)[0]) if is_impact_command(job.command) else None
+        if plan is not None and plan.selected == []:
+            return "succeeded", 0, plan.summary + "\n"
+        timeout = self.timeout or limits.timeout_for(job.command)
+        with (
+            track_run("job") as result,
+            sandbox_copy(get_project_path(job.project_id)) as cwd,
+            tempfile.TemporaryDirectory(prefix="littup-impact-") as scratch,
+        ):
+            command = job.command
+            if plan is not None:
+                command = impact_command(job.command, plan, Path(scratch))
+                self._append_output(job.id, [plan.summary + "\n"])
+            output = OutputBuffer(limits.output_chars)
+            proc = spawn(command, cwd)
+            reader = pump_output(proc.stdout, output)
+            deadline = time.monotonic() + timeout
+            streamed: list[str] = []
+            outcome: tuple[str, int, str] | None = None
+            while outcome is None:
+                try:
+                    proc.wait(POLL_SECONDS)
+                except subprocess.TimeoutExpired:
+                    pass
+                live = output.drain()
+                streamed.append(live)
+                cancelled = self._append_output(job.id, [live] if live else [])
+                if proc.poll() is not None:
+                    reader.join()
+                    note = exit_note(proc.returncode, False, timeout)
+                    outcome = ("succeeded" if proc.returncode == 0 else "failed", proc.returncode, note and "\n" + note)
+                elif cancelled:
+                    kill_process_group(proc)
+                    outcome = ("cancelled", CANCELLED_EXIT_CODE, "\nCancelled.")
+                elif time.monotonic() >= deadline:
+                    kill_process_group(proc)
+                    outcome = ("failed", TIMEOUT_EXIT_CODE, "\n" + exit_note(TIMEOUT_EXIT_CODE, True, timeout))
+                elif self._stopping.is_set():
+                    kill_process_group(proc)
+                    outcome = ("queued", 0, "")
+            proc.wait()
+            reader.join()
+            proc.stdout.close()
+            if outcome[0] == "queued":
+                return outcome
+            result.append(outcome[1])
+            if plan is not None and outcome[0] != "cancelled":
+                record_coverage(plan, Path(scratch))
+            # Whatever the live stream had no room for: the retained tail, after an omission marker.
+            tail = output.drain() + output.close() + outcome[2]
+            if key is not None and outcome[0] != "cancelled":
+                store_run_result(key, job.project_id, job.command, outcome[1], "".join(streamed) + tail)
+            return outcome[0], outcome[1], tail
@@ -0,0 +1,440 @@
+"""Launchpad packages: a whole project as one streamed archive.
+
+    launchpad_manifest.json     project metadata, the file list with hashes, what else is included
+    files/<path>                the working tree
+    history/<kind>-<n>.ndjson   messages, memories and snapshot manifests, in batches
+    blobs/<sha256>              file versions referenced by the exported snapshots
+
+Exports are written by a background thread into a small bounded queue, so a multi-GB project is
+never staged on disk or in memory. Tar imports are read as a stream; zip's directory sits at the
+end of the file, so zip imports are spooled to a temporary file first.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from collections.abc import Callable, Iterator
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO
+
+from sqlalchemy import delete, insert, select
+
+from . import memory_index
+from .blobs import blob_hash, get_blobs, put_blobs
+from .db import db_session
+from .models import AgentMessage, CoverageMap, FileState, Memory, Project, RunResult, Snapshot, SnapshotFile
+from .services import (
+    STREAM_BATCH_SIZE,
+    get_project,
+    get_project_path,
+    get_snapshot_manifest,
+    insert_project,
+    invalidate_project,
+    iter_messages,
+    iter_snapshots,
+    recount_projects,
+    refresh_file_index,
+    resolve_project_file,
+    save_snapshot,
+    settings,
+)
+
+try:
+    import zstandard
+except ImportError:  # Optional: `pip install littup[zstd]` enables tar.zst packages.
+    zstandard = None
+
+ARCHIVE_FORMATS = ("tar", "tar.gz", "tar.zst", "zip")
+ARCHIVE_MEDIA_TYPES = {
+    "tar": "application/x-tar",
+    "tar.gz": "application/gzip",
+    "tar.zst": "application/zstd",
+    "zip": "application/zip",
+}
+MANIFEST_NAME = "launchpad_manifest.json"
+MANIFEST_VERSION = 1
+CHUNK_BYTES = 256 * 1024
+QUEUE_CHUNKS = 16
+BLOB_BATCH = 50
+ZIP_MAGIC = b"PK\x03\x04"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _QueueSink:
+    """Write-only file object that hands coalesced chunks to the consuming generator."""
+
+    def __init__(self, chunks: queue.Queue, cancelled: threading.Event) -> None:
+        self._chunks = chunks
+        self._cancelled = cancelled
+        self._buffer = bytearray()
+
+    def put(self, item: bytes | None) -> None:
+        while True:
+            if self._cancelled.is_set():
+                raise _Cancelled
+            try:
+                self._chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        if len(self._buffer) >= CHUNK_BYTES:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> None:
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+
+
+def _stream(build: Callable[[_QueueSink], None]) -> Iterator[bytes]:
+    chunks: queue.Queue = queue.Queue(QUEUE_CHUNKS)
+    cancelled = threading.Event()
+    failure: list[BaseException] = []
+
+    def run() -> None:
+        sink = _QueueSink(chunks, cancelled)
+        try:
+            build(sink)
+            sink.drain()
+        except _Cancelled:
+            return
+        except BaseException as exc:
+            failure.append(exc)
+        try:
+            sink.put(None)
+        except _Cancelled:
+            pass
+
+    threading.Thread(target=run, name="littup-export", daemon=True).start()
+    try:
+        while (chunk := chunks.get()) is not None:
+            yield chunk
+        if failure:
+            raise failure[0]
+    finally:
+        # Also reached when the client goes away mid-download; stops the writer thread.
+        cancelled.set()
+
+
+class _TarWriter:
+    def __init__(self, sink: _QueueSink, fmt: str) -> None:
+        self._zstd = zstandard.ZstdCompressor().stream_writer(sink, closefd=False) if fmt == "tar.zst" else None
+        self._tar = tarfile.open(fileobj=self._zstd or sink, mode="w|gz" if fmt == "tar.gz" else "w|")
+
+    def add_bytes(self, name: str, data: bytes) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def add_file(self, name: str, path: Path) -> None:
+        st = path.stat()
+        info = tarfile.TarInfo(name)
+        info.size = st.st_size
+        info.mtime = int(st.st_mtime)
+        info.mode = st.st_mode & 0o777
+        with open(path, "rb") as handle:
+            self._tar.addfile(info, handle)
+
+    def close(self) -> None:
+        self._tar.close()
+        if self._zstd is not None:
+            self._zstd.close()
+
+
+class _ZipWriter:
+    def __init__(self, sink: _QueueSink) -> None:
+        # An unseekable target makes zipfile write data descriptors instead of seeking back.
+        self._zip = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def add_bytes(self, name: str, data: bytes) -> None:
+        self._zip.writestr(name, data)
+
+    def add_file(self, name: str, path: Path) -> None:
+        info = zipfile.ZipInfo.from_file(path, name)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with open(path, "rb") as source, self._zip.open(info, "w", force_zip64=True) as target:
+            shutil.copyfileobj(source, target, CHUNK_BYTES)
+
+    def close(self) -> None:
+        self._zip.close()
+
+
+def _iter_rows(model, project_id: int) -> Iterator:
+    after_id = 0
+    while True:
+        with db_session() as s:
+            stmt = select(model).where(model.project_id == project_id, model.id > after_id)
+            rows = s.scalars(stmt.order_by(model.id).limit(STREAM_BATCH_SIZE)).all()
+        yield from rows
+        if len(rows) < STREAM_BATCH_SIZE:
+            return
+        after_id = rows[-1].id
+
+
+def _write_ndjson(writer, kind: str, records: Iterator[dict]) -> None:
+    batch: list[str] = []
+    part = 0
+    for record in records:
+        batch.append(json.dumps(record))
+        if len(batch) == STREAM_BATCH_SIZE:
+            part += 1
+            writer.add_bytes(f"history/{kind}-{part:06d}.ndjson", ("\n".join(batch) + "\n").encode())
+            batch = []
+    if batch:
+        writer.add_bytes(f"history/{kind}-{part + 1:06d}.ndjson", ("\n".join(batch) + "\n").encode())
+
+
+def export_project(project_id: int, fmt: str = "tar.gz", include_history: bool = True) -> Iterator[bytes]:
+    """Stream a Launchpad package of the project as archive bytes."""
+    if fmt not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown archive format {fmt!r}; expected one of {', '.join(ARCHIVE_FORMATS)}")
+    if fmt == "tar.zst" and zstandard is None:
+        raise ValueError("tar.zst packages need the optional 'zstandard' package")
+    project = get_project(project_id)
+    if project is None:
+        raise ValueError(f"Project {project_id} not found")
+
+    def build(sink: _QueueSink) -> None:
+        writer = _ZipWriter(sink) if fmt == "zip" else _TarWriter(sink, fmt)
+        files, _ = refresh_file_index(project_id)
+        root = get_project_path(project_id)
+        manifest = {
+            "format": "launchpad",
+            "version": MANIFEST_VERSION,
+            "exported_at": datetime.utcnow().isoformat(),
+            "project": {
+                "name": project.name,
+                "template": project.template,
+                "team_name": project.team_name,
+                "status": project.status,
+            },
+            "files": [{"path": rel, "sha256": files[rel]} for rel in sorted(files)],
+            "history": include_history,
+        }
+        writer.add_bytes(MANIFEST_NAME, json.dumps(manifest, indent=2).encode())
+        for rel in sorted(files):
+            writer.add_file(f"files/{rel}", root / rel)
+        if include_history:
+            messages = iter_messages(project_id)
+            _write_ndjson(
+                writer,
+                "messages",
+                ({"role": m.role, "content": m.content, "created_at": m.created_at.isoformat()} for m in messages),
+            )
+            memories = _iter_rows(Memory, project_id)
+            _write_ndjson(
+                writer,
+                "memories",
+                ({"source": m.source, "content": m.content, "created_at": m.created_at.isoformat()} for m in memories),
+            )
+            referenced: set[str] = set()
+
+            def snapshot_records() -> Iterator[dict]:
+                for snap in sorted(iter_snapshots(project_id), key=lambda snap: snap.id):
+                    snap_files = get_snapshot_manifest(snap.id)
+                    referenced.update(snap_files.values())
+                    yield {"note": snap.note, "created_at": snap.created_at.isoformat(), "files": snap_files}
+
+            _write_ndjson(writer, "snapshots", snapshot_records())
+            ordered = sorted(referenced)
+            for start in range(0, len(ordered), BLOB_BATCH):
+                with db_session() as s:
+                    blobs = get_blobs(s, ordered[start : start + BLOB_BATCH])
+                for digest in ordered[start : start + BLOB_BATCH]:
+                    writer.add_bytes(f"blobs/{digest}", blobs[digest])
+        writer.close()
+
+    return _stream(build)
+
+
+class _Prefixed:
+    """Puts already-sniffed bytes back in front of a stream."""
+
+    def __init__(self, head: bytes, stream: BinaryIO) -> None:
+        self._head = head
+        self._stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if self._head:
+            if size < 0:
+                data, self._head = self._head + self._stream.read(), b""
+                return data
+            data, self._head = self._head[:size], self._head[size:]
+            return data
+        return self._stream.read(size)
+
+
+def _iter_members(stream: BinaryIO) -> Iterator[tuple[str, BinaryIO]]:
+    head = stream.read(4)
+    source = _Prefixed(head, stream)
+    if head.startswith(ZIP_MAGIC):
+        with tempfile.TemporaryFile() as spool:
+            shutil.copyfileobj(source, spool, CHUNK_BYTES)
+            spool.seek(0)
+            with zipfile.ZipFile(spool) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        with archive.open(info) as handle:
+                            yield info.filename, handle
+        return
+    if head.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ValueError("tar.zst packages need the optional 'zstandard' package")
+        source = zstandard.ZstdDecompressor().stream_reader(source)
+    with tarfile.open(fileobj=source, mode="r|*") as archive:
+        for member in archive:
+            if member.isfile():
+                yield member.name, archive.extractfile(member)
+
+
+def _parse_time(value: str | None) -> datetime:
+    return datetime.fromisoformat(value) if value else datetime.utcnow()
+
+
+def _import_history(project_id: int, kind: str, records: list[dict]) -> set[str]:
+    """Insert one history member's records; returns the blob hashes its snapshots reference."""
+    referenced: set[str] = set()
+    with db_session() as s:
+        if kind in ("messages", "memories"):
+            model, label = (AgentMessage, "role") if kind == "messages" else (Memory, "source")
+            rows = [
+                {"project_id": project_id, label: r[label], "content": r["content"], "created_at": _parse_time(r.get("created_at"))}
+                for r in records
+            ]
+            s.execute(insert(model).values(rows))
+        elif kind == "snapshots":
+            for r in records:
+                for rel in r["files"]:
+                    # Restoring writes these paths, so one outside the project rejects the whole package.
+                    resolve_project_file(project_id, rel)
+                referenced.update(r["files"].values())
+                created_at = _parse_time(r.get("created_at"))
+                snap = Snapshot(project_id=project_id, note=r["note"], content="", created_at=created_at)
+                s.add(snap)
+                s.flush()
+                if r["files"]:
+                    s.execute(
+                        insert(SnapshotFile),
+                        [{"snapshot_id": snap.id, "path": rel, "blob_hash": digest} for rel, digest in r["files"].items()],
+                    )
+        recount_projects(s, [project_id])
+    return referenced
+
+
+def _free_name(wanted: str | None, exported: str) -> str:
+    with db_session() as s:
+        taken = set(s.scalars(select(Project.name).where(Project.name.startswith(wanted or exported))))
+    if wanted is not None:
+        if wanted in taken:
+            raise ValueError(f"A project named {wanted!r} already exists")
+        return wanted
+    candidate, n = exported, 1
+    while candidate in taken:
+        n += 1
+        candidate = f"{exported} ({n})"
+    return candidate
+
+
+def discard_project(project_id: int) -> None:
+    """Remove a project's rows and working tree; blobs are left for compaction to collect."""
+    with db_session() as s:
+        snapshot_ids = select(Snapshot.id).where(Snapshot.project_id == project_id)
+        s.execute(delete(SnapshotFile).where(SnapshotFile.snapshot_id.in_(snapshot_ids)))
+        for model in (Snapshot, AgentMessage, Memory, FileState, CoverageMap, RunResult):
+            s.execute(delete(model).where(model.project_id == project_id))
+        s.execute(delete(Project).where(Project.id == project_id))
+    invalidate_project(project_id)
+    memory_index.drop(project_id)
+    shutil.rmtree(get_project_path(project_id), ignore_errors=True)
+
+
+def import_project(stream: BinaryIO, name: str | None = None) -> Project:
+    """Create a new project from a Launchpad package read from `stream`."""
+    project_id: int | None = None
+    expected: dict[str, str] = {}
+    pending_blobs: dict[str, bytes] = {}
+    imported_blobs: set[str] = set()
+    referenced_blobs: set[str] = set()
+
+    def flush_blobs() -> None:
+        with db_session() as s:
+            put_blobs(s, pending_blobs, settings.snapshot_compression)
+        pending_blobs.clear()
+
+    try:
+        for member, handle in _iter_members(stream):
+            if member == MANIFEST_NAME:
+                manifest = json.load(handle)
+                if manifest.get("format") != "launchpad" or manifest.get("version", 0) > MANIFEST_VERSION:
+                    raise ValueError("Unsupported Launchpad manifest")
+                meta = manifest["project"]
+                team_name, status = meta.get("team_name", "Core Team"), meta.get("status", "active")
+                project_id = insert_project(_free_name(name, meta["name"]), meta["template"], team_name, status)
+                expected = {entry["path"]: entry["sha256"] for entry in manifest.get("files", [])}
+                continue
+            if project_id is None:
+                raise ValueError(f"{MANIFEST_NAME} must be the first entry of a Launchpad package")
+            if member.startswith("files/"):
+                rel = member.removeprefix("files/")
+                target = resolve_project_file(project_id, rel)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                digest = hashlib.sha256()
+                with open(target, "wb") as out:
+                    while chunk := handle.read(CHUNK_BYTES):
+                        digest.update(chunk)
+                        out.write(chunk)
+                if rel in expected and digest.hexdigest() != expected[rel]:
+                    raise ValueError(f"Checksum mismatch for {rel}")
+            elif member.startswith("blobs/"):
+                data = handle.read()
+                digest = member.removeprefix("blobs/")
+                if blob_hash(data) != digest:
+                    raise ValueError(f"Checksum mismatch for {member}")
+                pending_blobs[digest] = data
+                imported_blobs.add(digest)
+                if len(pending_blobs) >= BLOB_BATCH:
+                    flush_blobs()
+            elif member.startswith("history/"):
+                kind = member.removeprefix("history/").split("-", 1)[0]
+                records = [json.loads(line) for line in handle.read().decode("utf-8").splitlines() if line.strip()]
+                if records:
+                    referenced_blobs |= _import_history(project_id, kind, records)
+        if project_id is None:
+            raise ValueError(f"Not a Launchpad package: no {MANIFEST_NAME}")
+        missing = referenced_blobs - imported_blobs
+        if missing:
+            raise ValueError(f"Invalid Launchpad package: {len(missing)} snapshot blob(s) missing, e.g. {min(missing)}")
+        flush_blobs()
+        save_snapshot(project_id, "Imported from Launchpad package")
+    except (tarfile.TarError, zipfile.BadZipFile, KeyError, json.JSONDecodeError) as exc:
+        if project_id is not None:
+            discard_project(project_id)
+        raise ValueError(f"Invalid Launchpad package: {exc}") from exc
+    except BaseException:
+        if project_id is not None:
+            discard_project(project_id)
+        raise
+    return get_project(project_id)
@@ -0,0 +1,253 @@
+"""Memoria recall: top-k cosine search over each project's memories.
+
+Memories are embedded with the hashing trick (sublinear term frequencies hashed into 2**20 buckets) and
+appended to flat per-project arrays under `<data dir>/memory_index/<project id>/`:
+
+    ids.i64      memory id of each row
+    ends.i64     end offset of each row's entries
+    buckets.u32  hashed term of each entry
+    weights.f32  L2-normalized weight of each entry
+
+Rows are only ever appended, so catching up with new memories costs one indexed query and a read of
+the last committed row, however large the index has grown. Document vectors are stored without IDF,
+which would change with every insert; IDF is computed at query time for the query's own terms and
+applied to the query side. With NumPy installed the arrays are memory-mapped and scored vectorized;
+otherwise the same files are scanned in pure Python.
+"""
+
+from __future__ import annotations
+
+import heapq
+import math
+import os
+import re
+import shutil
+import threading
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator
+
+from sqlalchemy import func, select
+
+from .config import current_settings
+from .db import db_session
+from .models import Memory
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within a process.
+    fcntl = None
+
+BUCKET_BITS = 20
+TOKEN_PATTERN = re.compile(r"\w{2,}")
+UPDATE_BATCH = 5000
+# (array typecode, NumPy dtype) of each file; both use native byte order.
+FILES = {"ids": ("q", "int64"), "ends": ("q", "int64"), "buckets": ("I", "uint32"), "weights": ("f", "float32")}
+FILE_NAMES = {name: f"{name}.{dtype[0]}{array(code).itemsize * 8}" for name, (code, dtype) in FILES.items()}
+
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _numpy():
+    # Imported on first search rather than with the module, keeping it off the API's startup path.
+    try:
+        import numpy
+    except ImportError:  # Optional: `pip install littup[memory]` vectorizes scoring over memory-mapped arrays.
+        return None
+    return numpy
+
+
+def index_dir(project_id: int) -> Path:
+    return current_settings().data_dir / "memory_index" / str(int(project_id))
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def embed(text: str) -> dict[int, float]:
+    """Hashed, sublinear-tf, L2-normalized sparse vector of `text` as {bucket: weight}."""
+    weights: dict[int, float] = {}
+    for token, count in Counter(tokenize(text)).items():
+        bucket = zlib.crc32(token.encode()) >> (32 - BUCKET_BITS)
+        weights[bucket] = weights.get(bucket, 0.0) + 1.0 + math.log(count)
+    norm = math.sqrt(sum(w * w for w in weights.values()))
+    return {bucket: w / norm for bucket, w in weights.items()} if norm else {}
+
+
+def _read(path: Path, name: str) -> array:
+    values = array(FILES[name][0])
+    target = path / FILE_NAMES[name]
+    if target.exists():
+        data = target.read_bytes()
+        values.frombytes(data[: len(data) - len(data) % values.itemsize])
+    return values
+
+
+def _count(path: Path, name: str) -> int:
+    target = path / FILE_NAMES[name]
+    return target.stat().st_size // array(FILES[name][0]).itemsize if target.exists() else 0
+
+
+def _item(path: Path, name: str, index: int) -> int:
+    """One value of an array file, read in place; appends stay O(1) however large the index grows."""
+    values = array(FILES[name][0])
+    with open(path / FILE_NAMES[name], "rb") as handle:
+        handle.seek(index * values.itemsize, os.SEEK_SET)
+        values.frombytes(handle.read(values.itemsize))
+    return values[0]
+
+
+def _last_id(path: Path) -> int:
+    count = _count(path, "ids")
+    return _item(path, "ids", count - 1) if count else 0
+
+
+def _rows(path: Path) -> tuple[array, array]:
+    """(ids, ends) of the committed rows; ids are written last, so a torn append is never visible."""
+    ids, ends = _read(path, "ids"), _read(path, "ends")
+    return ids, ends[: len(ids)]
+
+
+@contextmanager
+def _writer(project_id: int) -> Iterator[Path]:
+    path = index_dir(project_id)
+    path.mkdir(parents=True, exist_ok=True)
+    with _lock, open(path / "lock", "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield path
+
+
+def _repair(path: Path) -> tuple[int, int]:
+    """Cut off anything a crashed append left past the last committed row; returns (last id, entries)."""
+    count = _count(path, "ids")
+    entries = _item(path, "ends", count - 1) if count else 0
+    for name, keep in (("ids", count), ("ends", count), ("buckets", entries), ("weights", entries)):
+        target = path / FILE_NAMES[name]
+        size = keep * array(FILES[name][0]).itemsize
+        if target.exists() and target.stat().st_size != size:
+            with open(target, "r+b") as handle:
+                handle.truncate(size)
+    return (_item(path, "ids", count - 1) if count else 0), entries
+
+
+def _append(path: Path, rows: list[tuple[int, str]], entries: int) -> int:
+    ids, ends, buckets, weights = array("q"), array("q"), array("I"), array("f")
+    for memory_id, content in rows:
+        vector = embed(content)
+        buckets.extend(vector)
+        weights.extend(vector.values())
+        entries += len(vector)
+        ids.append(memory_id)
+        ends.append(entries)
+    for name, values in (("buckets", buckets), ("weights", weights), ("ends", ends), ("ids", ids)):
+        with open(path / FILE_NAMES[name], "ab") as handle:
+            values.tofile(handle)
+    return entries
+
+
+def update(project_id: int) -> int:
+    """Append memories added since the last update (by any writer); returns how many were indexed."""
+    with db_session() as s:
+        latest = s.scalar(select(func.max(Memory.id)).where(Memory.project_id == project_id)) or 0
+    if _last_id(index_dir(project_id)) == latest:
+        return 0
+    added = 0
+    with _writer(project_id) as path:
+        last, entries = _repair(path)
+        if last > latest:
+            # The memories were deleted (or the database replaced); start over.
+            drop(project_id, locked=True)
+            path.mkdir(parents=True, exist_ok=True)
+            last = entries = 0
+        while True:
+            with db_session() as s:
+                rows = s.execute(
+                    select(Memory.id, Memory.content)
+                    .where(Memory.project_id == project_id, Memory.id > last)
+                    .order_by(Memory.id)
+                    .limit(UPDATE_BATCH)
+                ).all()
+            if not rows:
+                return added
+            entries = _append(path, rows, entries)
+            last = rows[-1].id
+            added += len(rows)
+
+
+def drop(project_id: int, locked: bool = False) -> None:
+    path = index_dir(project_id)
+    for name in FILE_NAMES.values():
+        (path / name).unlink(missing_ok=True)
+    if not locked:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _query_vector(text: str) -> tuple[list[int], list[float]]:
+    vector = embed(text)
+    buckets = sorted(vector)
+    return buckets, [vector[bucket] for bucket in buckets]
+
+
+def _idf(document_frequency: int, rows: int) -> float:
+    return math.log((1 + rows) / (1 + document_frequency)) + 1.0
+
+
+def _top_numpy(path: Path, ids: array, ends: array, query: str, k: int) -> list[tuple[float, int]]:
+    entries = ends[-1] if ends else 0
+    if not entries:
+        return []
+    np = _numpy()
+    q_buckets, q_weights = (np.asarray(v) for v in _query_vector(query))
+    buckets = np.memmap(path / FILE_NAMES["buckets"], dtype=np.uint32, mode="r", shape=(entries,))
+    weights = np.memmap(path / FILE_NAMES["weights"], dtype=np.float32, mode="r", shape=(entries,))
+    hits = np.flatnonzero(np.isin(buckets, q_buckets))
+    if not hits.size:
+        return []
+    slots = np.searchsorted(q_buckets, buckets[hits])
+    idf = np.log((1 + len(ids)) / (1 + np.bincount(slots, minlength=len(q_buckets)))) + 1.0
+    query_weights = q_weights * idf
+    query_weights /= np.linalg.norm(query_weights)
+    rows = np.searchsorted(np.frombuffer(ends, dtype=np.int64), hits, side="right")
+    scores = np.bincount(rows, weights=weights[hits] * query_weights[slots], minlength=len(ids))
+    top = np.flatnonzero(scores)
+    if top.size > k:
+        top = top[np.argpartition(scores[top], -k)[-k:]]
+    return [(float(scores[row]), ids[row]) for row in top]
+
+
+def _top_python(path: Path, ids: array, ends: array, query: str, k: int) -> list[tuple[float, int]]:
+    entries = ends[-1] if ends else 0
+    q_buckets, q_weights = _query_vector(query)
+    slot_of = {bucket: slot for slot, bucket in enumerate(q_buckets)}
+    buckets = _read(path, "buckets")[:entries]
+    hits = [(position, slot_of[bucket]) for position, bucket in enumerate(buckets) if bucket in slot_of]
+    if not hits:
+        return []
+    frequency = Counter(slot for _, slot in hits)
+    query_weights = [w * _idf(frequency[slot], len(ids)) for slot, w in enumerate(q_weights)]
+    norm = math.sqrt(sum(w * w for w in query_weights))
+    weights = _read(path, "weights")
+    scores: dict[int, float] = {}
+    for position, slot in hits:
+        row = bisect_right(ends, position)
+        scores[row] = scores.get(row, 0.0) + weights[position] * query_weights[slot] / norm
+    return [(score, ids[row]) for row, score in heapq.nlargest(k, scores.items(), key=lambda item: item[1])]
+
+
+def search(project_id: int, query: str, k: int = 10) -> list[tuple[int, float]]:
+    """The `k` memories most similar to `query` as (memory id, cosine score), best first."""
+    update(project_id)
+    path = index_dir(project_id)
+    ids, ends = _rows(path)
+    if not ids:
+        return []
+    top = (_top_numpy if _numpy() is not None else _top_python)(path, ids, ends, query, k)
+    return [(memory_id, score) for score, memory_id in sorted(top, reverse=True)[:k]]
@@ -0,0 +1,259 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Metrics are per process; scrape the API process, which serves them at `/metrics`.
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+slow_query_logger = logging.getLogger("littup.sql.slow")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = tuple(float(4**n) for n in range(4, 16))
+COUNT_BUCKETS = (1.0, 5.0, 10.0, 50.0, 100.0, 500.0, 1000.0, 5000.0, 10000.0)
+MAX_LOGGED_STATEMENT = 500
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        """The metric's sample lines in the exposition format."""
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()])
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        function: Callable[[], float] | None = None,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> Iterator[str]:
+        if self._function is not None:
+            yield f"{self.name} {_number(self._function())}"
+            return
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: a count per bucket (plus +Inf), the sum and the total count.
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, totals = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0, 0]))
+            counts[slot] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return int(series[1][1]) if series else 0
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), list(totals))) for key, (counts, totals) in self._series.items())
+        for key, (counts, (total, count)) in items:
+            running = 0
+            for bound, hits in zip((*self.buckets, float("inf")), counts):
+                running += hits
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {running}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {int(count)}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            # Modules may be re-imported (Streamlit reruns); keep the first instance.
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        function: Callable[[], float] | None = None,
+    ) -> Gauge:
+        return self._register(Gauge(name, help, labelnames, function))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        parts = []
+        for metric in metrics:
+            try:
+                parts.append(metric.render())
+            except Exception:
+                logging.getLogger(__name__).exception("Could not collect %s", metric.name)
+        return "\n".join(parts) + "\n"
+
+
+REGISTRY = Registry()
+
+http_request_seconds = REGISTRY.histogram(
+    "littup_http_request_duration_seconds", "API request latency by route.", ("method", "route", "status")
+)
+db_queries = REGISTRY.counter("littup_db_queries_total", "SQL statements executed.", ("engine", "operation"))
+db_query_seconds = REGISTRY.histogram(
+    "littup_db_query_duration_seconds", "SQL statement execution time.", ("engine", "operation")
+)
+slow_queries = REGISTRY.counter("littup_db_slow_queries_total", "SQL statements slower than LITTUP_SLOW_QUERY_MS.")
+snapshot_seconds = REGISTRY.histogram("littup_snapshot_duration_seconds", "save_snapshot wall time.")
+snapshot_files = REGISTRY.histogram(
+    "littup_snapshot_files", "Files recorded per snapshot.", buckets=COUNT_BUCKETS
+)
+snapshot_bytes = REGISTRY.histogram(
+    "littup_snapshot_changed_bytes", "Bytes re-read from disk per snapshot.", buckets=SIZE_BUCKETS
+)
+sandbox_run_seconds = REGISTRY.histogram(
+    "littup_sandbox_run_duration_seconds", "Sandboxed command wall time.", ("mode", "outcome")
+)
+sandbox_runs_active = REGISTRY.gauge("littup_sandbox_runs_in_progress", "Sandboxed commands currently executing.", ("mode",))
+
+
+def _operation(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+
+
+def instrument_engine(engine: Engine, label: str, slow_query_ms: int = 0) -> None:
+    """Count and time every statement on `engine`; log those slower than `slow_query_ms` when set."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, _cursor, _statement, _parameters, _context, _executemany) -> None:
+        conn.info.setdefault("littup_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, _cursor, statement, parameters, _context, _executemany) -> None:
+        starts = conn.info.get("littup_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        operation = _operation(statement)
+        db_queries.inc(engine=label, operation=operation)
+        db_query_seconds.observe(elapsed, engine=label, operation=operation)
+        if slow_query_ms and elapsed * 1000 >= slow_query_ms:
+            slow_queries.inc()
+            slow_query_logger.warning(
+                "%.1f ms %s %s", elapsed * 1000, statement[:MAX_LOGGED_STATEMENT], str(parameters)[:MAX_LOGGED_STATEMENT]
+            )
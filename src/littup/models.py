@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from datetime import datetime
 
-from sqlalchemy import DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import BigInteger, Boolean, DateTime, ForeignKey, Integer, Index, LargeBinary, String, Text, UniqueConstraint, false, true
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .db import Base
@@ -17,12 +17,19 @@ class Project(Base):
     status: Mapped[str] = mapped_column(String(40), default="active")
     team_name: Mapped[str] = mapped_column(String(120), default="Core Team")
     summary: Mapped[str] = mapped_column(Text, default="")
+    # Denormalized activity counters, kept in step by the writes they summarize; see `recount_projects`.
+    message_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    snapshot_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    # Size of the working tree as of the last file-state index refresh.
+    bytes_on_disk: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0")
+    last_message_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     messages: Mapped[list[AgentMessage]] = relationship(back_populates="project", cascade="all, delete-orphan")
     snapshots: Mapped[list[Snapshot]] = relationship(back_populates="project", cascade="all, delete-orphan")
     memories: Mapped[list[Memory]] = relationship(back_populates="project", cascade="all, delete-orphan")
+    file_states: Mapped[list[FileState]] = relationship(cascade="all, delete-orphan")
 
 
 class AgentMessage(Base):
@@ -43,10 +50,32 @@ class Snapshot(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     project_id: Mapped[int] = mapped_column(ForeignKey("projects.id"), index=True)
     note: Mapped[str] = mapped_column(String(255), default="Checkpoint")
-    content: Mapped[str] = mapped_column(Text)
+    # Legacy full JSON dump of the tree; new snapshots keep this empty and
+    # store their files as a manifest of content-addressed blobs instead.
+    content: Mapped[str] = mapped_column(Text, default="")
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     project: Mapped[Project] = relationship(back_populates="snapshots")
+    files: Mapped[list[SnapshotFile]] = relationship(back_populates="snapshot", cascade="all, delete-orphan")
+
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    size: Mapped[int] = mapped_column(Integer)
+    compressed: Mapped[bool] = mapped_column(Boolean, default=False)
+    data: Mapped[bytes] = mapped_column(LargeBinary)
+
+
+class SnapshotFile(Base):
+    __tablename__ = "snapshot_files"
+
+    snapshot_id: Mapped[int] = mapped_column(ForeignKey("snapshots.id"), primary_key=True)
+    path: Mapped[str] = mapped_column(String(512), primary_key=True)
+    blob_hash: Mapped[str] = mapped_column(ForeignKey("blobs.hash"), index=True)
+
+    snapshot: Mapped[Snapshot] = relationship(back_populates="files")
 
 
 class Memory(Base):
@@ -59,3 +88,83 @@ class Memory(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     project: Mapped[Project] = relationship(back_populates="memories")
+
+
+class FileState(Base):
+    __tablename__ = "file_states"
+
+    project_id: Mapped[int] = mapped_column(ForeignKey("projects.id"), primary_key=True)
+    path: Mapped[str] = mapped_column(String(512), primary_key=True)
+    size: Mapped[int] = mapped_column(BigInteger)
+    mtime_ns: Mapped[int] = mapped_column(BigInteger)
+    blob_hash: Mapped[str] = mapped_column(String(64))
+
+
+class SnapshotText(Base):
+    """Searchable text of each distinct file version; external content for the `snapshot_texts_fts` index."""
+
+    __tablename__ = "snapshot_texts"
+    __table_args__ = (UniqueConstraint("project_id", "path", "blob_hash"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    project_id: Mapped[int] = mapped_column(ForeignKey("projects.id"), index=True)
+    path: Mapped[str] = mapped_column(String(512))
+    blob_hash: Mapped[str] = mapped_column(String(64))
+    # First snapshot this version appeared in; not a foreign key so pruning snapshots keeps the text.
+    snapshot_id: Mapped[int] = mapped_column(Integer)
+    body: Mapped[str] = mapped_column(Text)
+
+
+class RunJob(Base):
+    __tablename__ = "run_jobs"
+    __table_args__ = (Index("ix_run_jobs_queue", "status", "priority", "id"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    project_id: Mapped[int] = mapped_column(ForeignKey("projects.id"), index=True)
+    command: Mapped[str] = mapped_column(String(255))
+    priority: Mapped[int] = mapped_column(Integer, default=0)
+    status: Mapped[str] = mapped_column(String(20), default="queued")
+    cancel_requested: Mapped[bool] = mapped_column(Boolean, default=False)
+    # PID of the process whose runner claimed the job, for diagnostics only: PIDs are reused across restarts.
+    claimed_by: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    # Refreshed by the claiming runner while the job runs; a stale one marks the job as orphaned.
+    heartbeat_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    exit_code: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    output: Mapped[str] = mapped_column(Text, default="")
+    # Whether the job may be answered from the run result cache, and whether it was.
+    use_cache: Mapped[bool] = mapped_column(Boolean, default=True, server_default=true())
+    cached: Mapped[bool] = mapped_column(Boolean, default=False, server_default=false())
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class CoverageMap(Base):
+    """Per-test file coverage from a project's last recorded pytest run, used to select impacted tests."""
+
+    __tablename__ = "coverage_maps"
+
+    project_id: Mapped[int] = mapped_column(ForeignKey("projects.id"), primary_key=True)
+    # JSON documents: path -> hash of the tested tree, node id -> files it ran, files every test may
+    # depend on, and node ids that failed.
+    manifest: Mapped[str] = mapped_column(Text, default="{}")
+    tests: Mapped[str] = mapped_column(Text, default="{}")
+    shared: Mapped[str] = mapped_column(Text, default="[]")
+    failed: Mapped[str] = mapped_column(Text, default="[]")
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class RunResult(Base):
+    """Cached outcome of a sandboxed command, keyed by the command, project tree and interpreter."""
+
+    __tablename__ = "run_results"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    project_id: Mapped[int] = mapped_column(ForeignKey("projects.id"), index=True)
+    command: Mapped[str] = mapped_column(String(255))
+    exit_code: Mapped[int] = mapped_column(Integer)
+    output: Mapped[str] = mapped_column(Text, default="")
+    size: Mapped[int] = mapped_column(Integer)
+    hits: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    used_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
@@ -0,0 +1,198 @@
+"""pytest plugin recording which project files each test executes, for test-impact selection.
+
+    pytest -p littup.pytest_impact --impact-out=report.json [--impact-select=selection.json]
+
+Files are recorded when their code starts running: with `sys.monitoring` (Python 3.12+) each code
+object reports once per test and is then disabled, otherwise through a profile hook. Files imported
+while collecting a test module count for every test in it; files run by non-function-scoped fixtures
+or outside any test module are reported as shared, since the tests depending on them are unknown.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+from types import ModuleType
+
+import pytest
+
+TOOL_NAME = "littup-impact"
+
+
+class Recorder:
+    def __init__(self, root: str) -> None:
+        self.root = os.path.realpath(root) + os.sep
+        # A virtualenv inside the project is not project code.
+        self.environments = tuple({os.path.realpath(prefix) + os.sep for prefix in (sys.prefix, sys.base_prefix)})
+        self.files: set[str] = set()
+        self._relative: dict[str, str | None] = {}
+        self._monitoring = self._use_monitoring()
+
+    def _use_monitoring(self) -> bool:
+        monitoring = getattr(sys, "monitoring", None)
+        if monitoring is None:
+            return False
+        try:
+            monitoring.use_tool_id(monitoring.COVERAGE_ID, TOOL_NAME)
+        except ValueError:  # coverage.py (or another tracer) already holds the id.
+            return False
+        monitoring.register_callback(monitoring.COVERAGE_ID, monitoring.events.PY_START, self._py_start)
+        return True
+
+    def _py_start(self, code, _offset):
+        self.files.add(code.co_filename)
+        return sys.monitoring.DISABLE
+
+    def _profile(self, frame, event, _arg) -> None:
+        if event == "call":
+            self.files.add(frame.f_code.co_filename)
+
+    def start(self) -> None:
+        if self._monitoring:
+            sys.monitoring.set_events(sys.monitoring.COVERAGE_ID, sys.monitoring.events.PY_START)
+        else:
+            sys.setprofile(self._profile)
+            threading.setprofile(self._profile)
+
+    def stop(self) -> None:
+        if self._monitoring:
+            sys.monitoring.set_events(sys.monitoring.COVERAGE_ID, 0)
+            sys.monitoring.free_tool_id(sys.monitoring.COVERAGE_ID)
+            self._monitoring = False
+        else:
+            sys.setprofile(None)
+            threading.setprofile(None)
+
+    def take(self) -> set[str]:
+        """Files recorded since the last take, as project-relative POSIX paths."""
+        taken, self.files = self.files, set()
+        if self._monitoring:
+            sys.monitoring.restart_events()
+        return {rel for rel in map(self.relative, taken) if rel is not None}
+
+    def relative(self, filename: str) -> str | None:
+        if filename not in self._relative:
+            path = os.path.realpath(filename) if filename and not filename.startswith("<") else ""
+            inside = path.startswith(self.root) and not path.startswith(self.environments)
+            rel = path[len(self.root) :] if inside and "site-packages" not in path else None
+            self._relative[filename] = rel.replace(os.sep, "/") if rel else None
+        return self._relative[filename]
+
+    def module_files(self, module: ModuleType) -> set[str]:
+        """Project files of the modules, classes and functions a test module imported by name."""
+        found = set()
+        for value in list(vars(module).values()):
+            if not isinstance(value, ModuleType):
+                value = sys.modules.get(getattr(value, "__module__", None) or "")
+            rel = self.relative(getattr(value, "__file__", None) or "")
+            if rel is not None:
+                found.add(rel)
+        return found
+
+
+class ImpactPlugin:
+    def __init__(self, config: pytest.Config, out: str, select: str | None) -> None:
+        self.out = out
+        self.selected: set[str] | None = None
+        if select:
+            with open(select, encoding="utf-8") as handle:
+                self.selected = set(json.load(handle))
+        self.recorder = Recorder(str(config.invocation_params.dir))
+        self.shared: set[str] = set()
+        self.module_deps: dict[str, set[str]] = {}
+        self.tests: dict[str, dict] = {}
+        self.collected: list[str] = []
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_collection(self, session: pytest.Session):
+        self.recorder.take()
+        self.recorder.start()
+        yield
+        self.shared |= self.recorder.take()
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_make_collect_report(self, collector: pytest.Collector):
+        if not isinstance(collector, pytest.Module):
+            yield
+            return
+        self.shared |= self.recorder.take()
+        outcome = yield
+        files = self.recorder.take()
+        if outcome.get_result().passed:
+            files |= self.recorder.module_files(collector.obj)
+        self.module_deps[collector.nodeid] = files
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_collection_modifyitems(self, config: pytest.Config, items: list[pytest.Item]) -> None:
+        self.collected = [item.nodeid for item in items]
+        if self.selected is None:
+            return
+        keep, drop = [], []
+        for item in items:
+            wanted = item.nodeid in self.selected or item.nodeid.split("::", 1)[0] in self.selected
+            (keep if wanted else drop).append(item)
+        if drop:
+            config.hook.pytest_deselected(items=drop)
+            items[:] = keep
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item: pytest.Item, nextitem):
+        self.shared |= self.recorder.take()
+        self.tests[item.nodeid] = {"files": [], "outcome": "passed"}
+        yield
+        files = self.recorder.take() | self.module_deps.get(item.nodeid.split("::", 1)[0], set())
+        self.tests[item.nodeid]["files"] = sorted(files)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        if fixturedef.scope == "function":
+            yield
+            return
+        pending = self.recorder.take()
+        yield
+        files = self.recorder.take()
+        # Later tests reuse the fixture without running its code, so its files are shared.
+        self.shared |= files
+        self.recorder.files.update(os.path.join(self.recorder.root, rel) for rel in pending | files)
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        test = self.tests.get(report.nodeid)
+        if test is None:
+            return
+        if report.failed:
+            test["outcome"] = "failed"
+        elif report.skipped and test["outcome"] == "passed":
+            test["outcome"] = "skipped"
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_sessionfinish(self, session: pytest.Session, exitstatus):
+        self.recorder.stop()
+        self.shared |= self.recorder.take()
+        status = int(session.exitstatus)
+        if self.selected is not None and status == pytest.ExitCode.NO_TESTS_COLLECTED and self.collected:
+            # Everything selected has since been removed; not an error.
+            session.exitstatus = status = pytest.ExitCode.OK
+        report = {
+            "complete": status in (pytest.ExitCode.OK, pytest.ExitCode.TESTS_FAILED, pytest.ExitCode.NO_TESTS_COLLECTED),
+            "selective": self.selected is not None,
+            "collected": self.collected,
+            "shared": sorted(self.shared),
+            "tests": self.tests,
+        }
+        with open(self.out, "w", encoding="utf-8") as handle:
+            json.dump(report, handle)
+        yield
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("littup-impact")
+    group.addoption("--impact-out", help="write per-test file coverage to this JSON file")
+    group.addoption("--impact-select", help="only run the node ids or test files listed in this JSON file")
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    out = config.getoption("--impact-out")
+    if out:
+        config.pluginmanager.register(ImpactPlugin(config, out, config.getoption("--impact-select")), TOOL_NAME)
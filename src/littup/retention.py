@@ -0,0 +1,313 @@
+"""Snapshot retention and storage compaction.
+
+    python -m littup.retention --dry-run
+
+A compaction pass thins each project's snapshots to the configured retention policy, drops blobs and
+search-index rows nothing references any more, compresses blobs only cold snapshots still use, and
+hands free pages back to the filesystem with an incremental vacuum.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+
+from .blobs import LOOKUP_CHUNK, MIN_COMPRESS_SIZE, encode_blob
+from .config import RetentionPolicy, current_settings
+from .db import db_session, get_engine, session_factory
+from .models import Blob, FileState, Project, Snapshot, SnapshotFile, SnapshotText
+from .services import counters_update
+
+try:
+    import fcntl
+except ImportError:  # Windows: every process that runs a Compactor compacts.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (("keep_hourly", "%Y-%m-%d %H"), ("keep_daily", "%Y-%m-%d"), ("keep_weekly", "%G-W%V"))
+# Pages released per pass, so one compaction never holds the write lock for long.
+VACUUM_PAGES = 4096
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+settings = current_settings()
+
+
+def snapshots_to_keep(snapshots: list[tuple[int, datetime]], policy: RetentionPolicy) -> set[int]:
+    """Ids kept by the count and checkpoint rules; `snapshots` is (id, created_at), newest first."""
+    keep = {snap_id for snap_id, _ in snapshots[: policy.keep_last]}
+    for field, fmt in BUCKETS:
+        limit = getattr(policy, field)
+        buckets: set[str] = set()
+        for snap_id, created_at in snapshots:
+            bucket = created_at.strftime(fmt)
+            if bucket in buckets:
+                continue
+            if len(buckets) >= limit:
+                break
+            buckets.add(bucket)
+            keep.add(snap_id)
+    return keep
+
+
+def _within_budget(s: Session, snapshot_ids: list[int], max_bytes: int) -> set[int]:
+    """Keep snapshots newest first until their distinct blobs exceed `max_bytes`; the newest always stays."""
+    sizes: dict[int, list[tuple[str, int]]] = {}
+    for start in range(0, len(snapshot_ids), LOOKUP_CHUNK):
+        rows = s.execute(
+            select(SnapshotFile.snapshot_id, Blob.hash, func.length(Blob.data))
+            .join(Blob, Blob.hash == SnapshotFile.blob_hash)
+            .where(SnapshotFile.snapshot_id.in_(snapshot_ids[start : start + LOOKUP_CHUNK]))
+        )
+        for snap_id, digest, size in rows:
+            sizes.setdefault(snap_id, []).append((digest, size))
+    seen: set[str] = set()
+    total = 0
+    kept: set[int] = set()
+    for snap_id in snapshot_ids:
+        added = {digest: size for digest, size in sizes.get(snap_id, []) if digest not in seen}
+        if kept and total + sum(added.values()) > max_bytes:
+            break
+        seen.update(added)
+        total += sum(added.values())
+        kept.add(snap_id)
+    return kept
+
+
+def _delete_snapshots(s: Session, project_id: int, snapshot_ids: list[int]) -> None:
+    deleted = 0
+    for start in range(0, len(snapshot_ids), LOOKUP_CHUNK):
+        chunk = snapshot_ids[start : start + LOOKUP_CHUNK]
+        s.execute(delete(SnapshotFile).where(SnapshotFile.snapshot_id.in_(chunk)))
+        deleted += s.execute(delete(Snapshot).where(Snapshot.id.in_(chunk))).rowcount
+    s.execute(counters_update(project_id).values(snapshot_count=Project.snapshot_count - deleted))
+
+
+def _id_set(ids: list[int]):
+    # One JSON parameter instead of one per id, however many snapshots a pass drops.
+    return select(func.json_each(json.dumps(ids)).table_valued("value").c.value)
+
+
+def _live_files(dropped: list[int]):
+    """Snapshot files that survive the pass; a dry run has not deleted `dropped` yet, so exclude them."""
+    return select(SnapshotFile).where(SnapshotFile.snapshot_id.not_in(_id_set(dropped))).subquery()
+
+
+def _orphaned_blobs(dropped: list[int]) -> tuple:
+    # Blobs the file-state index points at are kept so the next snapshot need not reread those files.
+    return (
+        ~Blob.hash.in_(select(_live_files(dropped).c.blob_hash)),
+        ~Blob.hash.in_(select(FileState.blob_hash)),
+    )
+
+
+def _collect_blobs(dropped: list[int], dry_run: bool) -> tuple[int, int]:
+    orphaned = _orphaned_blobs(dropped)
+    with session_factory()() as s:
+        sizes = dict(s.execute(select(Blob.hash, func.length(Blob.data)).where(*orphaned)).all())
+    if dry_run:
+        return len(sizes), sum(sizes.values())
+    removed: list[str] = []
+    hashes = list(sizes)
+    for start in range(0, len(hashes), LOOKUP_CHUNK):
+        with db_session() as s:
+            # Rechecked under the write lock: a snapshot taken since the scan may reference the blob again.
+            removed += s.scalars(
+                delete(Blob).where(Blob.hash.in_(hashes[start : start + LOOKUP_CHUNK]), *orphaned).returning(Blob.hash)
+            ).all()
+    return len(removed), sum(sizes[digest] for digest in removed)
+
+
+def _collect_texts(dropped: list[int], dry_run: bool) -> int:
+    live_files = _live_files(dropped)
+    orphaned = ~(
+        select(live_files.c.path)
+        .join(Snapshot, Snapshot.id == live_files.c.snapshot_id)
+        .where(
+            Snapshot.project_id == SnapshotText.project_id,
+            live_files.c.path == SnapshotText.path,
+            live_files.c.blob_hash == SnapshotText.blob_hash,
+        )
+        .exists()
+    )
+    with session_factory()() as s:
+        ids = s.scalars(select(SnapshotText.id).where(orphaned)).all()
+    if dry_run:
+        return len(ids)
+    removed = 0
+    for start in range(0, len(ids), LOOKUP_CHUNK):
+        with db_session() as s:
+            removed += s.execute(delete(SnapshotText).where(SnapshotText.id.in_(ids[start : start + LOOKUP_CHUNK]), orphaned)).rowcount
+    return removed
+
+
+def _compress_cold(dropped: list[int], cutoff: datetime, dry_run: bool) -> tuple[int, int]:
+    live_files = _live_files(dropped)
+    hot = select(live_files.c.blob_hash).join(Snapshot, Snapshot.id == live_files.c.snapshot_id).where(
+        Snapshot.created_at >= cutoff
+    )
+    with session_factory()() as s:
+        hashes = s.scalars(
+            select(Blob.hash).where(
+                Blob.compressed.is_(False),
+                Blob.size >= MIN_COMPRESS_SIZE,
+                Blob.hash.in_(select(live_files.c.blob_hash)),
+                ~Blob.hash.in_(hot),
+                ~Blob.hash.in_(select(FileState.blob_hash)),
+            )
+        ).all()
+    count = saved = 0
+    for start in range(0, len(hashes), LOOKUP_CHUNK):
+        with session_factory()() as s:
+            rows = s.execute(select(Blob.hash, Blob.data).where(Blob.hash.in_(hashes[start : start + LOOKUP_CHUNK]))).all()
+        packed_rows = []
+        for digest, data in rows:
+            packed, compressed = encode_blob(data, True)
+            if compressed:
+                packed_rows.append((digest, packed))
+                count += 1
+                saved += len(data) - len(packed)
+        if packed_rows and not dry_run:
+            # One short transaction per chunk; compression happens outside it.
+            with db_session() as s:
+                for digest, packed in packed_rows:
+                    s.execute(update(Blob).where(Blob.hash == digest, Blob.compressed.is_(False)).values(data=packed, compressed=True))
+    return count, saved
+
+
+def _vacuum(dry_run: bool, full: bool) -> dict:
+    with get_engine().connect() as conn:
+        def free_bytes() -> int:
+            page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+            return conn.exec_driver_sql("PRAGMA freelist_count").scalar() * page_size
+
+        mode = AUTO_VACUUM_MODES[conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()]
+        before = free_bytes()
+        if not dry_run:
+            if full:
+                # Also converts a database created before incremental vacuum was enabled.
+                conn.exec_driver_sql("VACUUM")
+            elif mode == "incremental":
+                # sqlite3's execute() steps this pragma once, freeing a single page; executescript runs it out.
+                conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+            conn.commit()
+        return {"auto_vacuum": mode, "free_bytes": before, "free_bytes_after": before if dry_run else free_bytes()}
+
+
+def compact(
+    policy: RetentionPolicy | None = None,
+    dry_run: bool = False,
+    full_vacuum: bool = False,
+    now: datetime | None = None,
+) -> dict:
+    """Run one compaction pass and report what it removed; with `dry_run` nothing is changed.
+
+    Plans are read without locking, and changes are written in one short transaction per project or
+    chunk, so chat and snapshot writes interleave with a pass instead of queueing behind all of it.
+    A dry run only reads.
+    """
+    policy = policy or settings.retention
+    now = now or datetime.utcnow()
+    report: dict = {"dry_run": dry_run, "projects": []}
+    with session_factory()() as s:
+        project_ids = s.scalars(select(Snapshot.project_id).distinct().order_by(Snapshot.project_id)).all()
+    dropped: list[int] = []
+    for project_id in project_ids:
+        with session_factory()() as s:
+            snapshots = s.execute(
+                select(Snapshot.id, Snapshot.created_at)
+                .where(Snapshot.project_id == project_id)
+                .order_by(Snapshot.created_at.desc(), Snapshot.id.desc())
+            ).all()
+            keep = snapshots_to_keep(snapshots, policy)
+            if policy.max_bytes:
+                keep = _within_budget(s, [snap_id for snap_id, _ in snapshots if snap_id in keep], policy.max_bytes)
+        drop = [snap_id for snap_id, _ in snapshots if snap_id not in keep]
+        if not drop:
+            continue
+        report["projects"].append({"project_id": project_id, "snapshots": len(snapshots), "dropped": drop})
+        dropped.extend(drop)
+        if not dry_run:
+            with db_session() as s:
+                _delete_snapshots(s, project_id, drop)
+    report["snapshots_dropped"] = len(dropped)
+    report["blobs_removed"], report["blob_bytes_reclaimed"] = _collect_blobs(dropped, dry_run)
+    report["search_rows_removed"] = _collect_texts(dropped, dry_run)
+    cutoff = now - timedelta(days=policy.cold_after_days)
+    report["blobs_compressed"], report["compression_bytes_saved"] = _compress_cold(dropped, cutoff, dry_run)
+    report["vacuum"] = _vacuum(dry_run, full_vacuum)
+    return report
+
+
+@contextmanager
+def _exclusive(name: str) -> Iterator[bool]:
+    """Non-blocking cross-process lock under the data directory; yields whether it was acquired."""
+    if fcntl is None:
+        yield True
+        return
+    settings.data_dir.mkdir(parents=True, exist_ok=True)
+    with open(settings.data_dir / name, "a") as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+
+
+class Compactor:
+    """Runs `compact()` every `interval` seconds on a daemon thread; an interval of 0 disables it.
+
+    With several API workers each runs a Compactor, but only one of them compacts at a time.
+    """
+
+    def __init__(self, interval: float | None = None) -> None:
+        self.interval = settings.compaction_interval if interval is None else interval
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> Compactor:
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="littup-compactor", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval):
+            try:
+                with _exclusive("compaction.lock") as acquired:
+                    if not acquired:
+                        continue
+                    report = compact()
+                logger.info(
+                    "Compaction dropped %d snapshots and reclaimed %d blob bytes",
+                    report["snapshots_dropped"],
+                    report["blob_bytes_reclaimed"],
+                )
+            except Exception:
+                logger.exception("Compaction failed")
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m littup.retention", description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="report reclaimable space without changing anything")
+    parser.add_argument("--full-vacuum", action="store_true", help="rewrite the whole database file afterwards")
+    args = parser.parse_args(argv)
+    print(json.dumps(compact(dry_run=args.dry_run, full_vacuum=args.full_vacuum), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Result cache for sandboxed runs of unchanged code.
+
+A run is keyed by its project, command and execution mode, a hash of the project tree (from the
+file-state index, so unchanged files are not reread) and the sandbox interpreter's version. Finished
+runs are stored in `run_results` and the least recently used are evicted past `LITTUP_RUN_CACHE_MB`.
+Timeouts, resource-limit kills and test-impact runs, whose output depends on more than the tree, are
+never cached.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import subprocess
+from datetime import datetime
+from functools import lru_cache
+
+from sqlalchemy import delete, func, select, update
+
+from .config import current_settings
+from .db import db_session
+from .impact import is_impact_command
+from .metrics import REGISTRY
+from .models import RunResult
+from .sandbox import EXECUTION_MODE, TIMEOUT_EXIT_CODE, is_allowed
+
+settings = current_settings()
+
+lookups = REGISTRY.counter("littup_run_cache_lookups_total", "Run result cache lookups by result.", ("result",))
+
+
+@lru_cache(maxsize=1)
+def interpreter() -> str:
+    """Version of the `python` sandboxed commands run with, read once per process."""
+    try:
+        return subprocess.run(
+            ["python", "-c", "import sys; print(sys.executable, sys.version)"],
+            capture_output=True,
+            text=True,
+            timeout=10,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def tree_hash(manifest: dict[str, str]) -> str:
+    digest = hashlib.sha256()
+    for rel in sorted(manifest):
+        digest.update(f"{rel}\0{manifest[rel]}\n".encode())
+    return digest.hexdigest()
+
+
+def cache_key(project_id: int, command: str, manifest: dict[str, str]) -> str:
+    # Tracebacks name the project's sandbox path, so identical trees of two projects are not shared. The
+    # execution mode keeps results of differently executed commands (and entries from before all paths
+    # used the shell) apart.
+    parts = (str(project_id), EXECUTION_MODE, command, tree_hash(manifest), interpreter())
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+def cacheable(command: str) -> bool:
+    return settings.run_cache_bytes > 0 and is_allowed(command) and not is_impact_command(command)
+
+
+def lookup(key: str, use_cache: bool = True) -> tuple[int, str] | None:
+    """The cached (exit code, output) for `key`, marking it recently used; None when bypassed."""
+    if not use_cache:
+        lookups.inc(result="bypass")
+        return None
+    with db_session() as s:
+        row = s.execute(
+            update(RunResult)
+            .where(RunResult.key == key)
+            .values(hits=RunResult.hits + 1, used_at=datetime.utcnow())
+            .returning(RunResult.exit_code, RunResult.output)
+        ).first()
+    lookups.inc(result="miss" if row is None else "hit")
+    return None if row is None else (row.exit_code, row.output)
+
+
+def store(key: str, project_id: int, command: str, exit_code: int, output: str) -> bool:
+    if exit_code < 0 or exit_code == TIMEOUT_EXIT_CODE:
+        return False
+    size = len(output.encode())
+    if size > settings.run_cache_bytes:
+        return False
+    with db_session() as s:
+        s.merge(RunResult(key=key, project_id=project_id, command=command, exit_code=exit_code, output=output, size=size))
+    evict()
+    return True
+
+
+def evict(budget: int | None = None) -> int:
+    """Drop least recently used results until the cache fits `budget` bytes; returns how many went."""
+    budget = settings.run_cache_bytes if budget is None else budget
+    with db_session() as s:
+        total = s.scalar(select(func.coalesce(func.sum(RunResult.size), 0)))
+        if total <= budget:
+            return 0
+        doomed = []
+        for key, size in s.execute(select(RunResult.key, RunResult.size).order_by(RunResult.used_at)):
+            if total <= budget:
+                break
+            doomed.append(key)
+            total -= size
+        s.execute(delete(RunResult).where(RunResult.key.in_(doomed)))
+    return len(doomed)
+
+
+def stats() -> dict[str, int]:
+    with db_session() as s:
+        entries, size, hits = s.execute(
+            select(func.count(), func.coalesce(func.sum(RunResult.size), 0), func.coalesce(func.sum(RunResult.hits), 0))
+        ).one()
+    return {
+        "entries": entries,
+        "bytes": size,
+        "budget_bytes": settings.run_cache_bytes,
+        "stored_hits": hits,
+        "hits": int(lookups.value(result="hit")),
+        "misses": int(lookups.value(result="miss")),
+        "bypassed": int(lookups.value(result="bypass")),
+    }
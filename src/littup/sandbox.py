@@ -0,0 +1,412 @@
+from __future__ import annotations
+
+import asyncio
+import codecs
+import json
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+from .config import current_settings
+from .metrics import sandbox_run_seconds, sandbox_runs_active
+from .tree import clone_file, scan_files
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, so every run gets a fresh copy.
+    fcntl = None
+
+try:
+    import resource
+except ImportError:  # Windows: runs are bounded by their timeout and output cap only.
+    resource = None
+
+settings = current_settings()
+limits = settings.sandbox_limits
+SANDBOX_ROOT = settings.data_dir / "sandboxes"
+
+ALLOWED_COMMANDS = {"python", "pytest", "bash", "sh"}
+BLOCKED_MESSAGE = "Command blocked by local sandbox policy."
+# Same convention as coreutils `timeout`.
+TIMEOUT_EXIT_CODE = 124
+OUTPUT_CHUNK_BYTES = 64 * 1024
+# How every path (sync, async, jobs) executes a command; part of the run cache key.
+EXECUTION_MODE = "shell"
+LIMIT_SIGNALS = {signal.SIGXCPU: "CPU time limit", signal.SIGXFSZ: "file size limit"} if hasattr(signal, "SIGXCPU") else {}
+
+
+def is_allowed(command: str) -> bool:
+    parts = command.split()
+    return bool(parts) and parts[0] in ALLOWED_COMMANDS
+
+
+class SandboxLease:
+    def __init__(self, path: Path, release: Callable[[], None], warm: bool) -> None:
+        self.path = path
+        self.warm = warm
+        self._release = release
+
+    def release(self) -> None:
+        self._release()
+
+
+def _remove(path: Path) -> None:
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    elif path.exists() or path.is_symlink():
+        path.unlink()
+
+
+def _sync_tree(source: Path, slot: Path) -> None:
+    """Mirror `source` into `slot/project`, copying only files whose stat differs on either side.
+
+    Files a previous run created or modified inside the sandbox are reverted or removed as well.
+    """
+    target = slot / "project"
+    manifest_path = slot / "manifest.json"
+    previous = json.loads(manifest_path.read_text()).get("files", {}) if manifest_path.exists() else {}
+    src = scan_files(source)
+    dst = scan_files(target) if target.exists() else {}
+    files: dict[str, list[int]] = {}
+    for rel, st in src.items():
+        current = dst.get(rel)
+        recorded = previous.get(rel)
+        if current is not None and recorded == [st.st_size, st.st_mtime_ns, current.st_size, current.st_mtime_ns]:
+            files[rel] = recorded
+            continue
+        dest = target / rel
+        for parent in reversed(Path(rel).parents[:-1]):
+            if (target / parent).is_file():
+                (target / parent).unlink()
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        _remove(dest)
+        clone_file(source / rel, dest)
+        copied = dest.stat()
+        files[rel] = [st.st_size, st.st_mtime_ns, copied.st_size, copied.st_mtime_ns]
+    for rel in dst.keys() - src.keys():
+        (target / rel).unlink(missing_ok=True)
+    for dirpath, _dirnames, _filenames in os.walk(target, topdown=False):
+        if Path(dirpath) != target and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+    total = sum(st.st_size for st in src.values())
+    manifest_path.write_text(json.dumps({"files": files, "bytes": total, "last_used": time.time()}))
+
+
+def _fresh_sandbox(workdir: Path) -> SandboxLease:
+    sandbox = Path(tempfile.mkdtemp(prefix="littup-run-"))
+    target = sandbox / "project"
+    shutil.copytree(workdir, target, dirs_exist_ok=True)
+    return SandboxLease(target, lambda: shutil.rmtree(sandbox, ignore_errors=True), warm=False)
+
+
+def _warm_sandbox(workdir: Path) -> SandboxLease | None:
+    slot = SANDBOX_ROOT / workdir.name
+    slot.mkdir(parents=True, exist_ok=True)
+    lock = open(slot / ".lock", "a+")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        # Another run is using this project's warm copy; don't wait for it.
+        lock.close()
+        return None
+
+    def release() -> None:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+        evict_sandboxes()
+
+    try:
+        _sync_tree(workdir, slot)
+    except Exception:
+        shutil.rmtree(slot / "project", ignore_errors=True)
+        (slot / "manifest.json").unlink(missing_ok=True)
+        release()
+        raise
+    return SandboxLease(slot / "project", release, warm=True)
+
+
+def acquire_sandbox(workdir: Path, fresh: bool = False) -> SandboxLease:
+    """Lease a private copy of `workdir`: the project's warm copy when free, otherwise a fresh one."""
+    if not fresh and settings.sandbox_mode == "warm" and fcntl is not None:
+        lease = _warm_sandbox(workdir)
+        if lease is not None:
+            return lease
+    return _fresh_sandbox(workdir)
+
+
+def evict_sandboxes(budget_bytes: int | None = None) -> list[str]:
+    """Drop least recently used warm copies until the cache fits its disk budget."""
+    budget = settings.sandbox_cache_bytes if budget_bytes is None else budget_bytes
+    if fcntl is None or not SANDBOX_ROOT.exists():
+        return []
+    slots = []
+    for slot in SANDBOX_ROOT.iterdir():
+        try:
+            meta = json.loads((slot / "manifest.json").read_text())
+        except (OSError, ValueError):
+            meta = {"bytes": 0, "last_used": 0}
+        slots.append((meta.get("last_used", 0), meta.get("bytes", 0), slot))
+    total = sum(size for _, size, _ in slots)
+    evicted = []
+    for _, size, slot in sorted(slots, key=lambda item: item[0]):
+        if total <= budget:
+            break
+        with open(slot / ".lock", "a+") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            shutil.rmtree(slot / "project", ignore_errors=True)
+            (slot / "manifest.json").unlink(missing_ok=True)
+        total -= size
+        evicted.append(slot.name)
+    return evicted
+
+
+@contextmanager
+def sandbox_copy(workdir: Path, fresh: bool = False) -> Iterator[Path]:
+    lease = acquire_sandbox(workdir, fresh=fresh)
+    try:
+        yield lease.path
+    finally:
+        lease.release()
+
+
+def _outcome(code: int) -> str:
+    return "timeout" if code == TIMEOUT_EXIT_CODE else "ok" if code == 0 else "error"
+
+
+@contextmanager
+def track_run(mode: str) -> Iterator[list[int]]:
+    """Record a run's duration and outcome; the caller appends the exit code to the yielded list."""
+    result: list[int] = []
+    started = time.perf_counter()
+    sandbox_runs_active.inc(mode=mode)
+    try:
+        yield result
+    finally:
+        sandbox_runs_active.dec(mode=mode)
+        outcome = _outcome(result[0]) if result else "crashed"
+        sandbox_run_seconds.observe(time.perf_counter() - started, mode=mode, outcome=outcome)
+
+
+class OutputBuffer:
+    """Bounded capture of a run's output: the first half of the cap streams live, the rest is a ring buffer.
+
+    Once the head is full, later output only keeps its most recent part; it is released, after a marker
+    saying how much was dropped, when the command exits. Memory stays bounded however chatty the run is.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self._head_room = limit // 2
+        self._tail_limit = limit - self._head_room
+        self._pending: list[str] = []
+        self._tail: deque[str] = deque()
+        self._tail_size = 0
+        self.omitted = 0
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> None:
+        with self._lock:
+            if self._head_room:
+                live = text[: self._head_room]
+                self._pending.append(live)
+                self._head_room -= len(live)
+                text = text[len(live) :]
+            if not text:
+                return
+            self._tail.append(text)
+            self._tail_size += len(text)
+            while self._tail_size > self._tail_limit:
+                excess = self._tail_size - self._tail_limit
+                first = self._tail[0]
+                if len(first) <= excess:
+                    self._tail.popleft()
+                    dropped = len(first)
+                else:
+                    self._tail[0] = first[excess:]
+                    dropped = excess
+                self._tail_size -= dropped
+                self.omitted += dropped
+
+    def drain(self) -> str:
+        """Output that can be shown now and has not been drained yet."""
+        with self._lock:
+            live, self._pending = "".join(self._pending), []
+            return live
+
+    def close(self) -> str:
+        """Everything not drained yet, including the retained tail; call once the command has exited."""
+        with self._lock:
+            marker = f"\n[... {self.omitted} characters omitted ...]\n" if self.omitted else ""
+            rest = "".join(self._pending) + marker + "".join(self._tail)
+            self._pending, self._tail, self._tail_size = [], deque(), 0
+            return rest
+
+
+def _set_limit(kind: int, soft: int, hard: int) -> None:
+    current = resource.getrlimit(kind)[1]
+    if current != resource.RLIM_INFINITY:
+        soft, hard = min(soft, current), min(hard, current)
+    resource.setrlimit(kind, (soft, hard))
+
+
+def _apply_limits() -> None:
+    # Runs in the child between fork and exec, so the caps cover the shell and everything it starts.
+    if limits.cpu_seconds:
+        # The extra second lets SIGXCPU (reported below) land before the kernel's SIGKILL.
+        _set_limit(resource.RLIMIT_CPU, limits.cpu_seconds, limits.cpu_seconds + 1)
+    if limits.memory_bytes:
+        _set_limit(resource.RLIMIT_AS, limits.memory_bytes, limits.memory_bytes)
+    if limits.file_bytes:
+        _set_limit(resource.RLIMIT_FSIZE, limits.file_bytes, limits.file_bytes)
+
+
+def _process_options() -> dict:
+    return {
+        "stdout": subprocess.PIPE,
+        "stderr": subprocess.STDOUT,
+        # Own process group, so a timeout or cancellation can take down everything the command started.
+        "start_new_session": True,
+        "preexec_fn": _apply_limits if resource is not None else None,
+    }
+
+
+def spawn(command: str, cwd: Path) -> subprocess.Popen:
+    """Start `command` under the shell with the run limits applied and stderr merged into stdout (bytes)."""
+    return subprocess.Popen(command, shell=True, cwd=cwd, **_process_options())
+
+
+def kill_process_group(proc: subprocess.Popen | asyncio.subprocess.Process) -> None:
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        return
+    proc.kill()
+
+
+def pump_output(stream: BinaryIO, output: OutputBuffer) -> threading.Thread:
+    """Copy `stream` into `output` on a thread, in chunks, so one endless line cannot exhaust memory."""
+
+    def run() -> None:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        for chunk in iter(lambda: stream.read1(OUTPUT_CHUNK_BYTES), b""):
+            output.write(decoder.decode(chunk))
+        output.write(decoder.decode(b"", final=True))
+
+    reader = threading.Thread(target=run, name="littup-run-output", daemon=True)
+    reader.start()
+    return reader
+
+
+def exit_note(code: int, timed_out: bool, timeout: float) -> str:
+    if timed_out:
+        return f"Timed out after {timeout:g}s."
+    if code < 0 and -code in LIMIT_SIGNALS:
+        return f"Killed: {LIMIT_SIGNALS[-code]} exceeded."
+    return ""
+
+
+def _result(text: str, note: str) -> str:
+    return (text.rstrip() + "\n" + note).strip()
+
+
+def run_command(workdir: Path, command: str, timeout: float | None = None) -> tuple[int, str]:
+    if not is_allowed(command):
+        return 1, BLOCKED_MESSAGE
+    timeout = limits.timeout_for(command) if timeout is None else timeout
+    with track_run("sync") as result, sandbox_copy(workdir) as cwd:
+        output = OutputBuffer(limits.output_chars)
+        proc = spawn(command, cwd)
+        reader = pump_output(proc.stdout, output)
+        timed_out = False
+        try:
+            code = proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_group(proc)
+            proc.wait()
+            code, timed_out = TIMEOUT_EXIT_CODE, True
+        reader.join()
+        proc.stdout.close()
+        result.append(code)
+        return code, _result(output.close(), exit_note(code, timed_out, timeout))
+
+
+async def run_command_async(workdir: Path, command: str, timeout: float | None = None) -> tuple[int, str]:
+    """Like `run_command`, but the child is awaited on the event loop instead of blocking a thread."""
+    parts: list[str] = []
+    code = 1
+    async for chunk in stream_command(workdir, command, timeout):
+        parts.append(chunk.output)
+        if chunk.exit_code is not None:
+            code = chunk.exit_code
+    return code, "".join(parts).strip()
+
+
+@dataclass(frozen=True)
+class RunChunk:
+    output: str
+    # Set on the last chunk only.
+    exit_code: int | None = None
+    # Whether the result was reused from the run cache rather than executed.
+    cached: bool = False
+
+
+async def stream_command(workdir: Path, command: str, timeout: float | None = None) -> AsyncIterator[RunChunk]:
+    """Run `command` in a sandbox, yielding its output as it arrives and finally the exit code."""
+    if not is_allowed(command):
+        yield RunChunk(BLOCKED_MESSAGE, 1)
+        return
+    timeout = limits.timeout_for(command) if timeout is None else timeout
+    with track_run("async") as result:
+        lease = await asyncio.to_thread(acquire_sandbox, workdir)
+        proc = None
+        try:
+            # Under the shell, like `spawn`, so a command behaves (and caches) the same on every path.
+            proc = await asyncio.create_subprocess_shell(command, cwd=lease.path, **_process_options())
+            output = OutputBuffer(limits.output_chars)
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            deadline = asyncio.get_running_loop().time() + timeout
+            timed_out = False
+            while True:
+                remaining = deadline - asyncio.get_running_loop().time()
+                try:
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError
+                    data = await asyncio.wait_for(proc.stdout.read(OUTPUT_CHUNK_BYTES), remaining)
+                    if not data:
+                        await asyncio.wait_for(proc.wait(), max(deadline - asyncio.get_running_loop().time(), 0))
+                        break
+                except asyncio.TimeoutError:
+                    kill_process_group(proc)
+                    await proc.wait()
+                    timed_out = True
+                    break
+                output.write(decoder.decode(data))
+                live = output.drain()
+                if live:
+                    yield RunChunk(live)
+            output.write(decoder.decode(b"", final=True))
+            code = TIMEOUT_EXIT_CODE if timed_out else proc.returncode
+            result.append(code)
+            tail = output.close()
+            note = exit_note(code, timed_out, timeout)
+            yield RunChunk(tail.rstrip() + "\n" + note if note else tail, code)
+        finally:
+            if proc is not None and proc.returncode is None:
+                # The consumer went away mid-run.
+                kill_process_group(proc)
+                await proc.wait()
+            await asyncio.to_thread(lease.release)
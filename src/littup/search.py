@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .db import db_session
+from .models import SnapshotText
+from .tree import BINARY_SNIFF_BYTES, looks_binary
+
+# Larger files are still snapshotted, just not indexed for search.
+MAX_INDEXED_FILE_BYTES = 1024 * 1024
+SNIPPET_TOKENS = 12
+
+
+@dataclass(frozen=True)
+class SearchSource:
+    kind: str
+    table: str
+    label: str
+    body: str
+
+    @property
+    def fts(self) -> str:
+        return f"{self.table}_fts"
+
+
+SOURCES = {
+    "message": SearchSource("message", "agent_messages", "role", "content"),
+    "memory": SearchSource("memory", "memories", "source", "content"),
+    "file": SearchSource("file", "snapshot_texts", "path", "body"),
+}
+
+
+def _index_ddl(source: SearchSource) -> list[str]:
+    cols = f"{source.label}, {source.body}, project_id"
+    new_vals = f"new.id, new.{source.label}, new.{source.body}, new.project_id"
+    old_vals = f"old.id, old.{source.label}, old.{source.body}, old.project_id"
+    delete = f"INSERT INTO {source.fts}({source.fts}, rowid, {cols}) VALUES ('delete', {old_vals});"
+    insert = f"INSERT INTO {source.fts}(rowid, {cols}) VALUES ({new_vals});"
+    return [
+        f"CREATE VIRTUAL TABLE {source.fts} USING fts5({cols}, content='{source.table}', content_rowid='id')",
+        f"CREATE TRIGGER IF NOT EXISTS {source.fts}_ai AFTER INSERT ON {source.table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {source.fts}_ad AFTER DELETE ON {source.table} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {source.fts}_au AFTER UPDATE ON {source.table} BEGIN {delete} {insert} END",
+    ]
+
+
+def install_search_index(engine: Engine) -> None:
+    """Create the FTS5 tables and sync triggers, backfilling any table that did not exist yet."""
+    with engine.begin() as conn:
+        existing = set(conn.scalars(text("SELECT name FROM sqlite_master WHERE type = 'table'")))
+        for source in SOURCES.values():
+            if source.fts in existing:
+                continue
+            for statement in _index_ddl(source):
+                conn.execute(text(statement))
+            conn.execute(text(f"INSERT INTO {source.fts}({source.fts}) VALUES ('rebuild')"))
+
+
+def _decode_text(data: bytes) -> str | None:
+    if len(data) > MAX_INDEXED_FILE_BYTES or looks_binary(data[:BINARY_SNIFF_BYTES]):
+        return None
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+
+def index_snapshot_texts(s: Session, project_id: int, snapshot_id: int, files: dict[str, tuple[str, bytes]]) -> None:
+    """Add newly seen (path, hash) file versions to the search index; binary and oversized files are skipped."""
+    rows = []
+    for rel, (digest, data) in files.items():
+        body = _decode_text(data)
+        if body is not None:
+            rows.append(
+                {"project_id": project_id, "path": rel, "blob_hash": digest, "snapshot_id": snapshot_id, "body": body}
+            )
+    if rows:
+        s.execute(sqlite_insert(SnapshotText).on_conflict_do_nothing(), rows)
+
+
+def _match_expression(query: str, source: SearchSource, project_id: int | None) -> str:
+    # Quote every term so user input is never parsed as FTS5 syntax; a trailing * keeps prefix search.
+    terms = []
+    for raw in query.split():
+        prefix = raw.endswith("*")
+        term = raw.rstrip("*").replace('"', '""')
+        if term:
+            terms.append(f'"{term}"' + ("*" if prefix else ""))
+    if not terms:
+        return ""
+    expression = f"{{{source.label} {source.body}}} : ({' '.join(terms)})"
+    if project_id is not None:
+        # project_id is indexed as a token, so the filter is an index intersection rather than a scan.
+        expression = f'project_id : "{int(project_id)}" AND {expression}'
+    return expression
+
+
+def search(
+    query: str,
+    project_id: int | None = None,
+    kinds: list[str] | None = None,
+    limit: int = 20,
+) -> list[dict]:
+    results: list[dict] = []
+    with db_session() as s:
+        for kind in kinds or list(SOURCES):
+            source = SOURCES[kind]
+            match = _match_expression(query, source, project_id)
+            if not match:
+                continue
+            rows = s.execute(
+                text(
+                    f"SELECT rowid, project_id, {source.label}, "
+                    f"snippet({source.fts}, 1, '[', ']', '…', {SNIPPET_TOKENS}), rank "
+                    f"FROM {source.fts} WHERE {source.fts} MATCH :match ORDER BY rank LIMIT :limit"
+                ),
+                {"match": match, "limit": limit},
+            )
+            results.extend(
+                {"kind": kind, "id": row_id, "project_id": pid, "label": label, "snippet": snippet, "score": -score}
+                for row_id, pid, label, snippet, score in rows
+            )
+    results.sort(key=lambda hit: hit["score"], reverse=True)
+    return results[:limit]
@@ -1,16 +1,31 @@
 from __future__ import annotations
 
+import difflib
 import json
 import shutil
-import subprocess
-import tempfile
+import time
+from collections.abc import Callable, Iterator
+from datetime import datetime
 from pathlib import Path
 
-from sqlalchemy import select
-
-from .config import ensure_storage_paths, get_settings
-from .db import db_session
-from .models import AgentMessage, Memory, Project, Snapshot
+from sqlalchemy import Insert, Select, Update, and_, delete, func, insert, or_, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import load_only
+
+from .blobs import LOOKUP_CHUNK, blob_hash, existing_hashes, get_blobs, put_blobs
+from .cache import TTLCache
+from .config import current_settings
+from .db import Base, add_missing_columns, db_session, get_engine, schema_lock
+from . import memory_index, run_cache
+from .impact import JOBS_ONLY_MESSAGE, is_impact_command
+from .metrics import snapshot_bytes, snapshot_files, snapshot_seconds
+from .models import AgentMessage, FileState, Memory, Project, Snapshot, SnapshotFile
+from .sandbox import run_command
+from .search import index_snapshot_texts, install_search_index
+from .templates import registry as template_registry
+from .tree import BINARY_SNIFF_BYTES, IgnoreRules, TreeEntry, is_binary_file, list_directory, looks_binary, read_range, scan_files, walk_tree
+
+STREAM_BATCH_SIZE = 500
 
 ROLES = ["Planner", "Coder", "Tester", "Reviewer", "Documenter"]
 DEFAULT_TEAM_ASSIGNMENT = {
@@ -21,38 +36,245 @@ DEFAULT_TEAM_ASSIGNMENT = {
     "Documenter": "Lorekeeper",
 }
 
-settings = ensure_storage_paths(get_settings())
+settings = current_settings()
 ROOT_DIR = settings.projects_dir
-ROOT_DIR.mkdir(parents=True, exist_ok=True)
+
+# Process-local, so other processes' writes show up after at most the TTL.
+project_cache = TTLCache(settings.project_cache_size, settings.project_cache_ttl)
+project_list_cache = TTLCache(64, settings.project_cache_ttl)
+
+# Files modified this recently may change again within the filesystem's mtime
+# granularity without their size changing, so their index entries are not trusted.
+RACY_WINDOW_NS = 2_000_000_000
+READ_CHUNK_BYTES = 64 * 1024
+DIFF_CONTEXT_LINES = 3
+# Changed files whose contents are loaded per round trip while streaming diffs.
+DIFF_BATCH_SIZE = 50
 
 
 def init_db() -> None:
-    from .db import Base, engine
+    engine = get_engine()
+    with schema_lock():
+        Base.metadata.create_all(bind=engine)
+        added = add_missing_columns(engine)
+        install_search_index(engine)
+        migrate_legacy_snapshots()
+        if any(column.startswith("projects.") for column in added):
+            # Backfill the activity counters of projects created before they existed.
+            with db_session() as s:
+                recount_projects(s)
+
+
+def projects_query(limit: int | None = None, after_id: int | None = None) -> Select:
+    stmt = select(Project).order_by(Project.updated_at.desc(), Project.id.desc())
+    if after_id is not None:
+        cursor = select(Project.updated_at).where(Project.id == after_id).scalar_subquery()
+        stmt = stmt.where(or_(Project.updated_at < cursor, and_(Project.updated_at == cursor, Project.id < after_id)))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def list_projects(limit: int | None = None, after_id: int | None = None) -> list[Project]:
+    projects = project_list_cache.get((limit, after_id))
+    if projects is None:
+        with db_session() as s:
+            projects = list(s.scalars(projects_query(limit, after_id)).all())
+        cache_projects(projects, (limit, after_id))
+    return list(projects)
+
+
+def projects_version() -> tuple:
+    """A cheap token that changes whenever a project is created, updated or gains messages or snapshots."""
+    with db_session() as s:
+        return tuple(
+            s.execute(
+                select(
+                    func.count(),
+                    func.max(Project.id),
+                    func.max(Project.updated_at),
+                    func.sum(Project.message_count),
+                    func.sum(Project.snapshot_count),
+                    func.sum(Project.bytes_on_disk),
+                )
+            ).one()
+        )
 
-    Base.metadata.create_all(bind=engine)
+
+def counters_update(project_id: int) -> Update:
+    """UPDATE of a project's activity counters; activity is not an edit, so `updated_at` is kept."""
+    return update(Project).where(Project.id == project_id).values(updated_at=Project.updated_at)
+
+
+def recount_projects(s, project_ids: list[int] | None = None) -> None:
+    """Recompute the denormalized counters from the rows they summarize, e.g. after bulk imports."""
+    stmt = update(Project).values(
+        message_count=select(func.count()).where(AgentMessage.project_id == Project.id).scalar_subquery(),
+        last_message_at=select(func.max(AgentMessage.created_at)).where(AgentMessage.project_id == Project.id).scalar_subquery(),
+        snapshot_count=select(func.count()).where(Snapshot.project_id == Project.id).scalar_subquery(),
+        bytes_on_disk=select(func.coalesce(func.sum(FileState.size), 0)).where(FileState.project_id == Project.id).scalar_subquery(),
+        updated_at=Project.updated_at,
+    )
+    if project_ids is not None:
+        stmt = stmt.where(Project.id.in_(project_ids))
+    s.execute(stmt)
+
+
+def dashboard_query() -> Select:
+    return select(
+        Project.id,
+        Project.name,
+        Project.template,
+        Project.status,
+        Project.team_name,
+        Project.updated_at,
+        Project.message_count,
+        Project.snapshot_count,
+        Project.bytes_on_disk,
+        Project.last_message_at,
+    ).order_by(Project.updated_at.desc(), Project.id.desc())
+
+
+def dashboard_out(rows) -> dict:
+    projects = [
+        {
+            "id": row.id,
+            "name": row.name,
+            "template": row.template,
+            "status": row.status,
+            "team_name": row.team_name,
+            "updated_at": row.updated_at.isoformat(),
+            "message_count": row.message_count,
+            "snapshot_count": row.snapshot_count,
+            "bytes_on_disk": row.bytes_on_disk,
+            "last_message_at": row.last_message_at.isoformat() if row.last_message_at else None,
+        }
+        for row in rows
+    ]
+    totals = {
+        "projects": len(projects),
+        **{field: sum(p[field] for p in projects) for field in ("message_count", "snapshot_count", "bytes_on_disk")},
+    }
+    return {"projects": projects, "totals": totals}
 
 
-def list_projects() -> list[Project]:
+def dashboard() -> dict:
+    """Every project's summary and counters from one read of the projects table (not the project cache)."""
     with db_session() as s:
-        return list(s.scalars(select(Project).order_by(Project.updated_at.desc())).all())
+        return dashboard_out(s.execute(dashboard_query()).all())
+
+
+def project_version(project_id: int) -> tuple:
+    """Newest message and snapshot ids for a project; changes whenever its chat or history does."""
+    newest_message = select(func.max(AgentMessage.id)).where(AgentMessage.project_id == project_id).scalar_subquery()
+    newest_snapshot = select(func.max(Snapshot.id)).where(Snapshot.project_id == project_id).scalar_subquery()
+    with db_session() as s:
+        return tuple(s.execute(select(newest_message, newest_snapshot)).one())
+
+
+def cache_projects(projects: list[Project], list_key: tuple | None = None) -> None:
+    for project in projects:
+        project_cache.put(project.id, project)
+    if list_key is not None:
+        project_list_cache.put(list_key, projects)
+
+
+def invalidate_project(project_id: int | None = None) -> None:
+    """Drop cached metadata after a project is created or changed; listings are always dropped."""
+    if project_id is not None:
+        project_cache.invalidate(project_id)
+    project_list_cache.clear()
+
+
+def project_cache_stats() -> dict[str, dict[str, int]]:
+    return {"projects": project_cache.stats(), "project_lists": project_list_cache.stats(), "runs": run_cache.stats()}
 
 
 def create_project(name: str, template: str, team_name: str = "Core Team") -> Project:
+    return create_projects([(name, template, team_name)])[0]
+
+
+def create_projects(specs: list[tuple[str, str, str]]) -> list[Project]:
+    """Create (name, template, team_name) projects in one transaction, each with its initial snapshot.
+
+    Template files, hashes and blobs come pre-indexed from the template registry, so a new project
+    costs a copy-on-write clone and a few inserts; nothing is reread or rehashed.
+    """
+    created: list[int] = []
+    rescan: list[int] = []
+    racy_after = time.time_ns() - RACY_WINDOW_NS
+    try:
+        with db_session() as s:
+            templates = {name: template_registry.get(name) for name in {template for _, template, _ in specs}}
+            for tpl in templates.values():
+                if tpl is not None:
+                    template_registry.store_blobs(s, tpl, settings.snapshot_compression)
+            for name, template, team_name in specs:
+                project = Project(name=name, template=template, team_name=team_name, status="active")
+                s.add(project)
+                s.flush()
+                created.append(project.id)
+                tpl = templates[template]
+                dst = get_project_path(project.id)
+                if tpl is None or any(dst.iterdir()):
+                    # Leftover files from an earlier database: snapshot whatever is on disk instead.
+                    rescan.append(project.id)
+                    continue
+                template_registry.materialize(tpl, dst)
+                project.snapshot_count = 1
+                project.bytes_on_disk = sum(size for size, _, _ in tpl.files.values())
+                snap = Snapshot(project_id=project.id, note="Initial template scaffold", content="")
+                s.add(snap)
+                s.flush()
+                if tpl.files:
+                    s.execute(
+                        insert(SnapshotFile),
+                        [{"snapshot_id": snap.id, "path": rel, "blob_hash": digest} for rel, digest in tpl.manifest.items()],
+                    )
+                    s.execute(
+                        insert(FileState),
+                        [
+                            {
+                                "project_id": project.id,
+                                "path": rel,
+                                "size": size,
+                                "mtime_ns": mtime_ns if mtime_ns < racy_after else 0,
+                                "blob_hash": digest,
+                            }
+                            for rel, (size, mtime_ns, digest) in tpl.files.items()
+                        ],
+                    )
+                    texts = {rel: (tpl.files[rel][2], data) for rel, data in tpl.contents.items()}
+                    index_snapshot_texts(s, project.id, snap.id, texts)
+    except Exception:
+        for project_id in created:
+            shutil.rmtree(get_project_path(project_id), ignore_errors=True)
+        raise
+    invalidate_project()
+    for project_id in rescan:
+        save_snapshot(project_id, "Initial template scaffold")
+    return [get_project(project_id) for project_id in created]
+
+
+def insert_project(name: str, template: str, team_name: str = "Core Team", status: str = "active") -> int:
+    """Add the project row only, without scaffolding files or a first snapshot."""
     with db_session() as s:
-        project = Project(name=name, template=template, team_name=team_name, status="active")
+        project = Project(name=name, template=template, team_name=team_name, status=status)
         s.add(project)
         s.flush()
         project_id = project.id
-
-    setup_project_files(project_id, template)
-    save_snapshot(project_id, "Initial template scaffold")
-    with db_session() as s:
-        return s.get(Project, project_id)
+    invalidate_project(project_id)
+    return project_id
 
 
 def get_project(project_id: int) -> Project | None:
-    with db_session() as s:
-        return s.get(Project, project_id)
+    project = project_cache.get(project_id)
+    if project is None:
+        with db_session() as s:
+            project = s.get(Project, project_id)
+        if project is not None:
+            project_cache.put(project_id, project)
+    return project
 
 
 def get_project_path(project_id: int) -> Path:
@@ -62,20 +284,101 @@ def get_project_path(project_id: int) -> Path:
 
 
 def setup_project_files(project_id: int, template: str) -> None:
-    here = Path(__file__).resolve().parents[2]
-    src = here / "templates" / template
+    tpl = template_registry.get(template)
     dst = get_project_path(project_id)
-    if src.exists() and not any(dst.iterdir()):
-        shutil.copytree(src, dst, dirs_exist_ok=True)
+    if tpl is not None and not any(dst.iterdir()):
+        template_registry.materialize(tpl, dst)
 
 
 def list_project_files(project_id: int) -> list[str]:
+    return sorted(scan_files(get_project_path(project_id)))
+
+
+def iter_project_files(project_id: int, max_depth: int | None = None) -> Iterator[str]:
+    """Lazily yield editable file paths, skipping .gitignore'd and tooling directories."""
+    for entry in walk_tree(get_project_path(project_id), max_depth=max_depth):
+        if not entry.is_dir:
+            yield entry.path
+
+
+def list_project_dir(project_id: int, rel_dir: str = "", offset: int = 0, limit: int = 200) -> tuple[list[TreeEntry], bool]:
+    root = get_project_path(project_id)
+    resolve_project_file(project_id, rel_dir or ".")
+    return list_directory(root, rel_dir, offset, limit, IgnoreRules.for_root(root))
+
+
+def resolve_project_file(project_id: int, rel_path: str) -> Path:
+    root = get_project_path(project_id).resolve()
+    target = (root / rel_path).resolve()
+    if target != root and root not in target.parents:
+        raise ValueError(f"Path escapes the project: {rel_path}")
+    return target
+
+
+def file_info(project_id: int, rel_path: str) -> dict | None:
+    target = resolve_project_file(project_id, rel_path)
+    if not target.is_file():
+        return None
+    return {"path": rel_path, "size": target.stat().st_size, "binary": is_binary_file(target)}
+
+
+def read_file_range(project_id: int, rel_path: str, offset: int = 0, length: int = READ_CHUNK_BYTES) -> bytes:
+    """Read at most `length` bytes from `offset` without loading the rest of the file."""
+    target = resolve_project_file(project_id, rel_path)
+    return read_range(target, offset, length) if target.is_file() else b""
+
+
+def refresh_file_index(project_id: int) -> tuple[dict[str, str], dict[str, bytes]]:
+    """Sync the file-state index with disk, rehashing only files whose size or mtime changed.
+
+    Returns the current path -> hash manifest and the contents of the files that had to be reread.
+    """
     project_path = get_project_path(project_id)
-    files: list[str] = []
-    for item in sorted(project_path.rglob("*")):
-        if item.is_file():
-            files.append(str(item.relative_to(project_path)))
-    return files
+    stats = scan_files(project_path)
+    racy_after = time.time_ns() - RACY_WINDOW_NS
+    manifest: dict[str, str] = {}
+    fresh: dict[str, bytes] = {}
+    with db_session() as s:
+        indexed = {
+            row.path: row
+            for row in s.execute(
+                select(FileState.path, FileState.size, FileState.mtime_ns, FileState.blob_hash).where(
+                    FileState.project_id == project_id
+                )
+            )
+        }
+        changed = []
+        for rel, st in stats.items():
+            entry = indexed.get(rel)
+            if entry is not None and entry.size == st.st_size and entry.mtime_ns == st.st_mtime_ns:
+                manifest[rel] = entry.blob_hash
+                continue
+            data = (project_path / rel).read_bytes()
+            manifest[rel] = blob_hash(data)
+            fresh[rel] = data
+            # A zero mtime never matches, so racily-clean files get rehashed on the next refresh.
+            mtime_ns = st.st_mtime_ns if st.st_mtime_ns < racy_after else 0
+            changed.append(
+                {"project_id": project_id, "path": rel, "size": len(data), "mtime_ns": mtime_ns, "blob_hash": manifest[rel]}
+            )
+        if changed:
+            # Concurrent refreshes of one project write the same keys; whichever commits last wins.
+            upsert = sqlite_insert(FileState)
+            s.execute(
+                upsert.on_conflict_do_update(
+                    index_elements=["project_id", "path"],
+                    set_={column: upsert.excluded[column] for column in ("size", "mtime_ns", "blob_hash")},
+                ),
+                changed,
+            )
+        removed = sorted(indexed.keys() - stats.keys())
+        for start in range(0, len(removed), LOOKUP_CHUNK):
+            # A row the other caller already removed is simply not matched.
+            chunk = removed[start : start + LOOKUP_CHUNK]
+            s.execute(delete(FileState).where(FileState.project_id == project_id, FileState.path.in_(chunk)))
+        if fresh or removed:
+            s.execute(counters_update(project_id).values(bytes_on_disk=sum(st.st_size for st in stats.values())))
+    return manifest, fresh
 
 
 def read_file(project_id: int, rel_path: str) -> str:
@@ -90,59 +393,378 @@ def write_file(project_id: int, rel_path: str, content: str) -> None:
 
 
 def add_message(project_id: int, role: str, content: str) -> None:
-    with db_session() as s:
-        s.add(AgentMessage(project_id=project_id, role=role, content=content))
-        s.add(Memory(project_id=project_id, source="Memoria", content=f"{role}: {content}"))
+    add_messages(project_id, [(role, content)])
 
 
-def get_messages(project_id: int) -> list[AgentMessage]:
+def add_messages(project_id: int, turns: list[tuple[str, str]]) -> None:
+    """Write a whole team turn, messages and their Memoria copies, in a single transaction."""
+    if not turns:
+        return
+    with db_session() as s:
+        for stmt in message_inserts(project_id, turns):
+            s.execute(stmt)
+    memory_index.update(project_id)
+
+
+def message_inserts(project_id: int, turns: list[tuple[str, str]]) -> list[Insert | Update]:
+    """The statements writing a turn: messages, their Memoria copies and the project's counters."""
+    now = datetime.utcnow()
+    return [
+        insert(AgentMessage).values(
+            [{"project_id": project_id, "role": role, "content": content, "created_at": now} for role, content in turns]
+        ),
+        insert(Memory).values(
+            [
+                {"project_id": project_id, "source": "Memoria", "content": f"{role}: {content}", "created_at": now}
+                for role, content in turns
+            ]
+        ),
+        counters_update(project_id).values(message_count=Project.message_count + len(turns), last_message_at=now),
+    ]
+
+
+def search_memories(project_id: int, query: str, limit: int = 10) -> list[dict]:
+    """The project's memories most similar to `query`, best first, with their cosine scores."""
+    hits = memory_index.search(project_id, query, limit)
     with db_session() as s:
-        return list(s.scalars(select(AgentMessage).where(AgentMessage.project_id == project_id).order_by(AgentMessage.created_at)).all())
+        rows = {m.id: m for m in s.scalars(select(Memory).where(Memory.id.in_([memory_id for memory_id, _ in hits])))}
+    return [
+        {
+            "id": memory_id,
+            "source": rows[memory_id].source,
+            "content": rows[memory_id].content,
+            "created_at": rows[memory_id].created_at.isoformat(),
+            "score": round(score, 6),
+        }
+        for memory_id, score in hits
+        if memory_id in rows
+    ]
+
+
+def get_messages(
+    project_id: int,
+    limit: int | None = None,
+    before_id: int | None = None,
+    after_id: int | None = None,
+) -> list[AgentMessage]:
+    """Messages in chronological order; with a limit, the newest page before `before_id` (or oldest after `after_id`)."""
+    stmt, newest_first = messages_query(project_id, limit, before_id, after_id)
+    with db_session() as s:
+        rows = list(s.scalars(stmt).all())
+    return rows[::-1] if newest_first else rows
+
+
+def messages_query(
+    project_id: int,
+    limit: int | None = None,
+    before_id: int | None = None,
+    after_id: int | None = None,
+) -> tuple[Select, bool]:
+    """Build the page query; the flag says rows come back newest-first and must be reversed."""
+    stmt = select(AgentMessage).where(AgentMessage.project_id == project_id)
+    if before_id is not None:
+        stmt = stmt.where(AgentMessage.id < before_id)
+    if after_id is not None:
+        stmt = stmt.where(AgentMessage.id > after_id)
+    newest_first = limit is not None and after_id is None
+    stmt = stmt.order_by(AgentMessage.id.desc() if newest_first else AgentMessage.id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt, newest_first
+
+
+def iter_messages(project_id: int, after_id: int | None = None, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[AgentMessage]:
+    # Keyset batches in short sessions, so a slow consumer never pins a read transaction.
+    cursor = after_id or 0
+    while True:
+        batch = get_messages(project_id, limit=batch_size, after_id=cursor)
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        cursor = batch[-1].id
+
+
+def _write_manifest(s, project_id: int, snapshot_id: int, manifest: dict[str, str], files: dict[str, bytes]) -> None:
+    """Record a snapshot's manifest; `files` holds the contents that were (re)read for it."""
+    put_blobs(s, {manifest[rel]: data for rel, data in files.items()}, settings.snapshot_compression)
+    index_snapshot_texts(s, project_id, snapshot_id, {rel: (manifest[rel], data) for rel, data in files.items()})
+    if manifest:
+        s.execute(
+            insert(SnapshotFile),
+            [{"snapshot_id": snapshot_id, "path": rel, "blob_hash": digest} for rel, digest in manifest.items()],
+        )
 
 
 def save_snapshot(project_id: int, note: str) -> Snapshot:
-    project_path = get_project_path(project_id)
-    state = {}
-    for rel in list_project_files(project_id):
-        state[rel] = read_file(project_id, rel)
+    with snapshot_seconds.time():
+        snap, manifest, fresh = _save_snapshot(project_id, note)
+    snapshot_files.observe(len(manifest))
+    snapshot_bytes.observe(sum(len(data) for data in fresh.values()))
+    return snap
+
+
+def _save_snapshot(project_id: int, note: str) -> tuple[Snapshot, dict[str, str], dict[str, bytes]]:
+    manifest, fresh = refresh_file_index(project_id)
     with db_session() as s:
-        snap = Snapshot(project_id=project_id, note=note, content=json.dumps(state))
+        # Indexed hashes normally already have blobs; backfill any that were never stored.
+        fresh_hashes = {manifest[rel] for rel in fresh}
+        missing = set(manifest.values()) - fresh_hashes - existing_hashes(s, manifest.values())
+        if missing:
+            project_path = get_project_path(project_id)
+            for rel in [rel for rel, digest in manifest.items() if digest in missing]:
+                fresh[rel] = (project_path / rel).read_bytes()
+                manifest[rel] = blob_hash(fresh[rel])
+        snap = Snapshot(project_id=project_id, note=note, content="")
         s.add(snap)
         s.flush()
-        return snap
+        _write_manifest(s, project_id, snap.id, manifest, fresh)
+        s.execute(counters_update(project_id).values(snapshot_count=Project.snapshot_count + 1))
+        return snap, manifest, fresh
+
+
+def get_snapshot_manifest(snapshot_id: int) -> dict[str, str]:
+    with db_session() as s:
+        rows = s.execute(
+            select(SnapshotFile.path, SnapshotFile.blob_hash)
+            .where(SnapshotFile.snapshot_id == snapshot_id)
+            .order_by(SnapshotFile.path)
+        )
+        return {path: digest for path, digest in rows}
+
+
+def read_snapshot_files(snapshot_id: int, paths: list[str] | None = None) -> dict[str, bytes]:
+    manifest = get_snapshot_manifest(snapshot_id)
+    if paths is not None:
+        manifest = {rel: manifest[rel] for rel in paths if rel in manifest}
+    with db_session() as s:
+        project_id = s.scalar(select(Snapshot.project_id).where(Snapshot.id == snapshot_id))
+        blobs = get_blobs(s, manifest.values())
+    for rel in manifest:
+        resolve_project_file(project_id, rel)
+    return {rel: blobs[digest] for rel, digest in manifest.items()}
+
+
+def _diff_manifests(old: dict[str, str], new: dict[str, str]) -> dict[str, list[str]]:
+    return {
+        "added": sorted(new.keys() - old.keys()),
+        "removed": sorted(old.keys() - new.keys()),
+        "modified": sorted(rel for rel in old.keys() & new.keys() if old[rel] != new[rel]),
+    }
+
+
+def diff_snapshots(old_id: int, new_id: int) -> dict[str, list[str]]:
+    return _diff_manifests(get_snapshot_manifest(old_id), get_snapshot_manifest(new_id))
 
 
-def get_snapshots(project_id: int) -> list[Snapshot]:
+def changed_since_snapshot(project_id: int, snapshot_id: int) -> dict[str, list[str]]:
+    manifest, _ = refresh_file_index(project_id)
+    return _diff_manifests(get_snapshot_manifest(snapshot_id), manifest)
+
+
+def require_snapshot(project_id: int, snapshot_id: int) -> None:
+    with db_session() as s:
+        snap = s.get(Snapshot, snapshot_id)
+        if snap is None or snap.project_id != project_id:
+            raise ValueError(f"Snapshot {snapshot_id} does not belong to project {project_id}")
+
+
+def _diff_lines(data: bytes | None) -> list[str]:
+    lines = (data or b"").decode("utf-8", errors="replace").splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n\\ No newline at end of file\n"
+    return lines
+
+
+def unified_file_diff(rel: str, old: bytes | None, new: bytes | None, context: int = DIFF_CONTEXT_LINES) -> dict:
+    status = "added" if old is None else "removed" if new is None else "modified"
+    if looks_binary((old or b"")[:BINARY_SNIFF_BYTES]) or looks_binary((new or b"")[:BINARY_SNIFF_BYTES]):
+        return {"path": rel, "status": status, "binary": True, "diff": f"Binary files a/{rel} and b/{rel} differ\n"}
+    diff = difflib.unified_diff(
+        _diff_lines(old),
+        _diff_lines(new),
+        "/dev/null" if old is None else f"a/{rel}",
+        "/dev/null" if new is None else f"b/{rel}",
+        n=context,
+    )
+    return {"path": rel, "status": status, "binary": False, "diff": "".join(diff)}
+
+
+def _blob_reader(manifest: dict[str, str]) -> Callable[[list[str]], dict[str, bytes]]:
+    def read(paths: list[str]) -> dict[str, bytes]:
+        with db_session() as s:
+            blobs = get_blobs(s, {manifest[rel] for rel in paths})
+        return {rel: blobs[manifest[rel]] for rel in paths}
+
+    return read
+
+
+def _iter_diffs(
+    old: dict[str, str],
+    new: dict[str, str],
+    read_old: Callable[[list[str]], dict[str, bytes]],
+    read_new: Callable[[list[str]], dict[str, bytes]],
+    context: int,
+) -> Iterator[dict]:
+    changed = sorted(rel for rel in old.keys() | new.keys() if old.get(rel) != new.get(rel))
+    for start in range(0, len(changed), DIFF_BATCH_SIZE):
+        batch = changed[start : start + DIFF_BATCH_SIZE]
+        before = read_old([rel for rel in batch if rel in old])
+        after = read_new([rel for rel in batch if rel in new])
+        for rel in batch:
+            yield unified_file_diff(rel, before.get(rel), after.get(rel), context)
+
+
+def iter_snapshot_diffs(old_id: int, new_id: int, context: int = DIFF_CONTEXT_LINES) -> Iterator[dict]:
+    """Yield a unified diff per file whose hash differs; unchanged files are never loaded."""
+    old, new = get_snapshot_manifest(old_id), get_snapshot_manifest(new_id)
+    yield from _iter_diffs(old, new, _blob_reader(old), _blob_reader(new), context)
+
+
+def iter_workspace_diffs(project_id: int, snapshot_id: int, context: int = DIFF_CONTEXT_LINES) -> Iterator[dict]:
+    """Like `iter_snapshot_diffs`, from a snapshot to the current working tree."""
+    require_snapshot(project_id, snapshot_id)
+    old = get_snapshot_manifest(snapshot_id)
+    new, _ = refresh_file_index(project_id)
+    project_path = get_project_path(project_id)
+
+    def read_disk(paths: list[str]) -> dict[str, bytes]:
+        return {rel: (project_path / rel).read_bytes() for rel in paths}
+
+    yield from _iter_diffs(old, new, _blob_reader(old), read_disk, context)
+
+
+def restore_snapshot(project_id: int, snapshot_id: int) -> dict[str, list[str]]:
+    """Bring the working tree back to a snapshot, touching only files that differ from it.
+
+    Returns the changes that were undone, in the shape of `changed_since_snapshot`.
+    """
+    require_snapshot(project_id, snapshot_id)
+    wanted = get_snapshot_manifest(snapshot_id)
+    current, _ = refresh_file_index(project_id)
+    changes = _diff_manifests(wanted, current)
+    # Every path is checked before anything is touched, so a bad manifest leaves the tree as it was.
+    targets = {rel: resolve_project_file(project_id, rel) for paths in changes.values() for rel in paths}
+    contents = read_snapshot_files(snapshot_id, changes["removed"] + changes["modified"])
+    root = get_project_path(project_id).resolve()
+    for rel in changes["added"]:
+        targets[rel].unlink(missing_ok=True)
+        # Drop directories this emptied, so a file of the snapshot can take a directory's place.
+        for parent in targets[rel].parents:
+            if parent == root or any(parent.iterdir()):
+                break
+            parent.rmdir()
+    for rel, data in contents.items():
+        target = targets[rel]
+        for parent in reversed(target.relative_to(root).parents[:-1]):
+            # A file where the snapshot has a directory (only ignored or untracked ones are left by now).
+            if (root / parent).is_file():
+                (root / parent).unlink()
+        if target.is_dir():
+            # Likewise a directory, holding only ignored files, where the snapshot has a file.
+            shutil.rmtree(target)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+    return changes
+
+
+def migrate_legacy_snapshots(batch_size: int = 100) -> int:
+    migrated = 0
+    while True:
+        with db_session() as s:
+            rows = s.execute(
+                select(Snapshot.id, Snapshot.project_id, Snapshot.content).where(Snapshot.content != "").limit(batch_size)
+            ).all()
+            if not rows:
+                return migrated
+            for snapshot_id, project_id, content in rows:
+                state = {rel: text.encode("utf-8") for rel, text in json.loads(content).items()}
+                manifest = {rel: blob_hash(data) for rel, data in state.items()}
+                _write_manifest(s, project_id, snapshot_id, manifest, state)
+            s.execute(update(Snapshot).where(Snapshot.id.in_([row[0] for row in rows])).values(content=""))
+            migrated += len(rows)
+
+
+def get_snapshots(
+    project_id: int,
+    limit: int | None = None,
+    before_id: int | None = None,
+    after_id: int | None = None,
+) -> list[Snapshot]:
+    """Snapshots newest first; with a limit, the newest page before `before_id`."""
     with db_session() as s:
-        return list(s.scalars(select(Snapshot).where(Snapshot.project_id == project_id).order_by(Snapshot.created_at.desc())).all())
+        return list(s.scalars(snapshots_query(project_id, limit, before_id, after_id)).all())
+
+
+def snapshots_query(
+    project_id: int,
+    limit: int | None = None,
+    before_id: int | None = None,
+    after_id: int | None = None,
+) -> Select:
+    stmt = (
+        select(Snapshot)
+        .options(load_only(Snapshot.id, Snapshot.project_id, Snapshot.note, Snapshot.created_at))
+        .where(Snapshot.project_id == project_id)
+        .order_by(Snapshot.id.desc())
+    )
+    if before_id is not None:
+        stmt = stmt.where(Snapshot.id < before_id)
+    if after_id is not None:
+        stmt = stmt.where(Snapshot.id > after_id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def iter_snapshots(project_id: int, before_id: int | None = None, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Snapshot]:
+    cursor = before_id
+    while True:
+        batch = get_snapshots(project_id, limit=batch_size, before_id=cursor)
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        cursor = batch[-1].id
 
 
 def evolve_project(project_id: int, feedback: str) -> str:
     planner_update = f"Roadmap evolved with feedback: {feedback}"
-    add_message(project_id, "Planner", planner_update)
-    add_message(project_id, "Reviewer", "Requested another quality and architecture pass.")
+    add_messages(
+        project_id,
+        [("Planner", planner_update), ("Reviewer", "Requested another quality and architecture pass.")],
+    )
     save_snapshot(project_id, f"Evolution: {feedback[:60]}")
     return planner_update
 
 
-def run_local_command(project_id: int, command: str) -> tuple[int, str]:
-    allowed = {"python", "pytest", "bash", "sh"}
-    if command.split()[0] not in allowed:
-        return 1, "Command blocked by local sandbox policy."
-
-    workdir = get_project_path(project_id)
-    with tempfile.TemporaryDirectory(prefix="littup-run-") as sandbox:
-        sb = Path(sandbox)
-        shutil.copytree(workdir, sb / "project", dirs_exist_ok=True)
-        proc = subprocess.run(
-            command,
-            shell=True,
-            cwd=sb / "project",
-            capture_output=True,
-            text=True,
-            timeout=30,
-        )
-        return proc.returncode, (proc.stdout + "\n" + proc.stderr).strip()
+def run_cache_key(project_id: int, command: str) -> str | None:
+    """Run-cache key of `command` on the project's current tree, or None if it is not cacheable."""
+    return run_cache.cache_key(project_id, command, refresh_file_index(project_id)[0]) if run_cache.cacheable(command) else None
+
+
+def store_run_result(key: str, project_id: int, command: str, exit_code: int, output: str) -> bool:
+    # Files edited while the command ran may or may not have been part of its sandbox copy.
+    if run_cache_key(project_id, command) != key:
+        return False
+    return run_cache.store(key, project_id, command, exit_code, output)
+
+
+def run_project_command(project_id: int, command: str, use_cache: bool = True) -> tuple[int, str, bool]:
+    """(exit code, output, whether it was reused from an identical earlier run) of `command`."""
+    if is_impact_command(command):
+        return 1, JOBS_ONLY_MESSAGE, False
+    key = run_cache_key(project_id, command)
+    hit = run_cache.lookup(key, use_cache) if key is not None else None
+    if hit is not None:
+        return *hit, True
+    code, output = run_command(get_project_path(project_id), command)
+    if key is not None:
+        store_run_result(key, project_id, command, code, output)
+    return code, output, False
+
+
+def run_local_command(project_id: int, command: str, use_cache: bool = True) -> tuple[int, str]:
+    code, output, _ = run_project_command(project_id, command, use_cache)
+    return code, output
 
 
 def triad_integrations() -> dict[str, str]:
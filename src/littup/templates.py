@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from sqlalchemy.orm import Session
+
+from .blobs import blob_hash, put_blobs
+from .tree import clone_file, walk_tree
+
+TEMPLATES_DIR = Path(__file__).resolve().parents[2] / "templates"
+
+
+@dataclass(frozen=True)
+class Template:
+    name: str
+    root: Path
+    # path -> (size, mtime_ns, hash), exactly what a fresh copy's file-state index entries hold.
+    files: dict[str, tuple[int, int, str]]
+    contents: dict[str, bytes]
+    signature: tuple
+
+    @property
+    def manifest(self) -> dict[str, str]:
+        return {rel: digest for rel, (_, _, digest) in self.files.items()}
+
+
+def _signature(root: Path) -> tuple:
+    return tuple(
+        (entry.path, entry.size, os.stat(root / entry.path).st_mtime_ns)
+        for entry in walk_tree(root)
+        if not entry.is_dir
+    )
+
+
+class TemplateRegistry:
+    """Scans and hashes each template once per process; a template is re-indexed only if its files change."""
+
+    def __init__(self, root: Path = TEMPLATES_DIR) -> None:
+        self.root = root
+        self._templates: dict[str, Template] = {}
+        self._lock = threading.Lock()
+
+    def names(self) -> list[str]:
+        return sorted(p.name for p in self.root.iterdir() if p.is_dir()) if self.root.exists() else []
+
+    def get(self, name: str) -> Template | None:
+        root = self.root / name
+        if not name or "/" in name or name.startswith(".") or not root.is_dir():
+            return None
+        signature = _signature(root)
+        with self._lock:
+            cached = self._templates.get(name)
+            if cached is not None and cached.signature == signature:
+                return cached
+        files: dict[str, tuple[int, int, str]] = {}
+        contents: dict[str, bytes] = {}
+        for rel, size, mtime_ns in signature:
+            data = (root / rel).read_bytes()
+            files[rel] = (size, mtime_ns, blob_hash(data))
+            contents[rel] = data
+        template = Template(name, root, files, contents, signature)
+        with self._lock:
+            self._templates[name] = template
+        return template
+
+    def store_blobs(self, s: Session, template: Template, compress: bool) -> None:
+        """Make sure the template's file versions are in the blob store; a single lookup once they are."""
+        put_blobs(s, {template.files[rel][2]: data for rel, data in template.contents.items()}, compress)
+
+    def materialize(self, template: Template, dst: Path) -> None:
+        """Copy the template into `dst`, as copy-on-write reflinks where the filesystem allows.
+
+        Hardlinks are not used: files are edited in place, which would write through to the template.
+        """
+        for rel in template.files:
+            target = dst / rel
+            target.parent.mkdir(parents=True, exist_ok=True)
+            clone_file(template.root / rel, target)
+
+
+registry = TemplateRegistry()
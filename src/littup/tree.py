@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import errno
+import os
+import shutil
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from itertools import islice
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: plain copies only.
+    fcntl = None
+
+# Linux FICLONE ioctl: copy-on-write clone on btrfs, XFS and other reflink-capable filesystems.
+FICLONE = 0x40049409
+# FICLONE failures meaning the filesystem (or the pair of them) cannot clone, rather than a failed copy.
+REFLINK_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOTSUP, errno.EXDEV, errno.EINVAL, errno.ENOTTY}
+# Directories nobody wants to browse in the editor, on top of the project's own .gitignore.
+DEFAULT_IGNORES = (".git/", "node_modules/", "__pycache__/", ".venv/", "venv/", ".pytest_cache/", ".mypy_cache/")
+BINARY_SNIFF_BYTES = 8192
+
+
+_reflink_supported = fcntl is not None
+
+
+def clone_file(src: Path, dst: Path) -> None:
+    """Copy `src` to `dst` with metadata, as a reflink when the filesystem supports it."""
+    global _reflink_supported
+    if _reflink_supported:
+        with open(src, "rb") as source, open(dst, "wb") as target:
+            try:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            except OSError as exc:
+                if exc.errno not in REFLINK_UNSUPPORTED:
+                    raise
+                _reflink_supported = False
+        if _reflink_supported:
+            shutil.copystat(src, dst)
+            return
+    shutil.copy2(src, dst)
+
+
+def scan_files(root: Path) -> dict[str, os.stat_result]:
+    """Stat every file under `root` in one scandir pass, keyed by POSIX relative path."""
+    found: dict[str, os.stat_result] = {}
+    pending = [root]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(Path(entry.path))
+                elif entry.is_file():
+                    found[Path(entry.path).relative_to(root).as_posix()] = entry.stat()
+    return found
+
+
+@dataclass(frozen=True)
+class IgnoreRule:
+    pattern: str
+    negate: bool
+    dir_only: bool
+    anchored: bool
+
+    @classmethod
+    def parse(cls, line: str) -> IgnoreRule | None:
+        line = line.rstrip("\n").rstrip()
+        if not line or line.startswith("#"):
+            return None
+        negate = line.startswith("!")
+        line = line[1:] if negate else line
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        # A slash anywhere but the end ties the pattern to the root rather than any level.
+        anchored = "/" in line
+        line = line.lstrip("/").replace("**/", "*").replace("/**", "/*").replace("**", "*")
+        return cls(line, negate, dir_only, anchored) if line else None
+
+    def matches(self, rel: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if self.anchored:
+            return fnmatchcase(rel, self.pattern)
+        return fnmatchcase(rel.rsplit("/", 1)[-1], self.pattern)
+
+
+class IgnoreRules:
+    """A .gitignore-style rule list; later rules win, and `!pattern` re-includes."""
+
+    def __init__(self, patterns: Iterable[str] = ()) -> None:
+        self.rules = [rule for rule in map(IgnoreRule.parse, patterns) if rule is not None]
+
+    @classmethod
+    def for_root(cls, root: Path) -> IgnoreRules:
+        patterns = list(DEFAULT_IGNORES)
+        gitignore = root / ".gitignore"
+        if gitignore.is_file():
+            patterns.extend(gitignore.read_text(encoding="utf-8", errors="replace").splitlines())
+        return cls(patterns)
+
+    def ignored(self, rel: str, is_dir: bool) -> bool:
+        result = False
+        for rule in self.rules:
+            if rule.matches(rel, is_dir):
+                result = not rule.negate
+        return result
+
+
+@dataclass(frozen=True)
+class TreeEntry:
+    path: str
+    is_dir: bool
+    size: int
+    depth: int
+
+
+def _entries(directory: Path, rel_prefix: str, depth: int, ignore: IgnoreRules) -> Iterator[tuple[TreeEntry, str]]:
+    try:
+        with os.scandir(directory) as it:
+            listing = sorted(it, key=lambda entry: (not entry.is_dir(follow_symlinks=False), entry.name))
+    except OSError:
+        return
+    for entry in listing:
+        rel = rel_prefix + entry.name
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if ignore.ignored(rel, is_dir):
+            continue
+        if is_dir:
+            yield TreeEntry(rel, True, 0, depth), entry.path
+        elif entry.is_file():
+            yield TreeEntry(rel, False, entry.stat().st_size, depth), entry.path
+
+
+def walk_tree(root: Path, ignore: IgnoreRules | None = None, max_depth: int | None = None) -> Iterator[TreeEntry]:
+    """Lazily yield entries depth-first, directories before files; only one directory is listed at a time."""
+    ignore = IgnoreRules.for_root(root) if ignore is None else ignore
+
+    def _walk(directory: Path, rel_prefix: str, depth: int) -> Iterator[TreeEntry]:
+        for entry, full_path in _entries(directory, rel_prefix, depth, ignore):
+            yield entry
+            if entry.is_dir and (max_depth is None or depth < max_depth):
+                yield from _walk(Path(full_path), entry.path + "/", depth + 1)
+
+    yield from _walk(root, "", 0)
+
+
+def list_directory(
+    root: Path,
+    rel_dir: str = "",
+    offset: int = 0,
+    limit: int = 200,
+    ignore: IgnoreRules | None = None,
+) -> tuple[list[TreeEntry], bool]:
+    """One page of a single directory's children, and whether more follow."""
+    ignore = IgnoreRules.for_root(root) if ignore is None else ignore
+    rel_dir = rel_dir.strip("/")
+    prefix = f"{rel_dir}/" if rel_dir else ""
+    depth = rel_dir.count("/") + 1 if rel_dir else 0
+    page = [entry for entry, _ in islice(_entries(root / rel_dir, prefix, depth, ignore), offset, offset + limit + 1)]
+    return page[:limit], len(page) > limit
+
+
+def looks_binary(sample: bytes) -> bool:
+    if b"\0" in sample:
+        return True
+    try:
+        sample.decode("utf-8")
+    except UnicodeDecodeError as exc:
+        # A multi-byte character cut off by the sample boundary is still text.
+        return exc.start < len(sample) - 3
+    return False
+
+
+def is_binary_file(path: Path) -> bool:
+    with open(path, "rb") as handle:
+        return looks_binary(handle.read(BINARY_SNIFF_BYTES))
+
+
+def read_range(path: Path, offset: int = 0, length: int = 64 * 1024) -> bytes:
+    with open(path, "rb") as handle:
+        handle.seek(offset)
+        return handle.read(length)
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import logging
+import threading
+
+from .services import add_messages
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriteBehind:
+    """Coalesces bursts of single chat writes into one `add_messages` transaction per project.
+
+    Queued messages are not visible to readers until the next flush, which happens every
+    `flush_interval` seconds, as soon as `max_batch` messages are pending, or on `close()`.
+    """
+
+    def __init__(self, flush_interval: float = 0.05, max_batch: int = 500) -> None:
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending: list[tuple[int, str, str]] = []
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._closed = False
+
+    def submit(self, project_id: int, role: str, content: str) -> None:
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("write-behind queue is closed")
+            self._pending.append((project_id, role, content))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="littup-write-behind", daemon=True)
+                self._thread.start()
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        with self._cond:
+            batch, self._pending = self._pending, []
+        by_project: dict[int, list[tuple[str, str]]] = {}
+        for project_id, role, content in batch:
+            by_project.setdefault(project_id, []).append((role, content))
+        for project_id, turns in by_project.items():
+            try:
+                add_messages(project_id, turns)
+            except Exception:
+                logger.exception("Dropped %d queued messages for project %s", len(turns), project_id)
+        return len(batch)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._closed and len(self._pending) < self.max_batch:
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
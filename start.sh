@@ -6,6 +6,7 @@ export HOST="${HOST:-0.0.0.0}"
 export PORT="${PORT:-8501}"
 export LITTUP_API_HOST="${LITTUP_API_HOST:-127.0.0.1}"
 export LITTUP_API_PORT="${LITTUP_API_PORT:-8756}"
+export LITTUP_API_WORKERS="${LITTUP_API_WORKERS:-1}"
 
 if [[ -n "${LITTUP_DATA_DIR:-}" ]]; then
   mkdir -p "${LITTUP_DATA_DIR}"
@@ -17,9 +18,11 @@ if [[ -n "${LITTUP_DB_PATH:-}" ]]; then
   mkdir -p "$(dirname "${LITTUP_DB_PATH}")"
 fi
 
-uvicorn littup.api:app \
+# Each worker is a separate process with its own app, engines and pools; they share only SQLite and the data dir.
+uvicorn littup.api:create_app --factory \
   --host "${LITTUP_API_HOST}" \
   --port "${LITTUP_API_PORT}" \
+  --workers "${LITTUP_API_WORKERS}" \
   --log-level "${LITTUP_LOG_LEVEL:-info}" &
 API_PID=$!
 
@@ -0,0 +1,353 @@
+from fastapi.testclient import TestClient
+
+from littup import api, services
+
+
+def test_chat_and_history_pagination():
+    services.init_db()
+    project = services.create_project("Paged API Project", "python_script")
+    for idx in range(5):
+        services.add_message(project.id, "Planner", f"message {idx}")
+    client = TestClient(api.app)
+
+    latest = client.get(f"/projects/{project.id}/chat", params={"limit": 2}).json()
+    assert [m["content"] for m in latest] == ["message 3", "message 4"]
+
+    older = client.get(f"/projects/{project.id}/chat", params={"limit": 2, "before_id": latest[0]["id"]}).json()
+    assert [m["content"] for m in older] == ["message 1", "message 2"]
+
+    newer = client.get(f"/projects/{project.id}/chat", params={"after_id": older[-1]["id"]}).json()
+    assert [m["content"] for m in newer] == ["message 3", "message 4"]
+
+    history = client.get(f"/projects/{project.id}/history", params={"limit": 1}).json()
+    assert history[0]["note"] == "Initial template scaffold"
+    services.write_file(project.id, "main.py", "print('paged history')\n")
+    services.save_snapshot(project.id, "Edited main.py")
+    assert [snap.note for snap in services.get_snapshots(project.id, after_id=history[0]["id"])] == ["Edited main.py"]
+
+    assert client.get("/projects/999999/chat").status_code == 404
+
+
+def test_project_listing_keyset():
+    services.init_db()
+    first_page = services.list_projects(limit=1)
+    rest = services.list_projects(after_id=first_page[0].id)
+    assert [p.id for p in first_page + rest] == [p.id for p in services.list_projects()]
+
+
+def test_chat_and_history_streams():
+    import json
+
+    services.init_db()
+    project = services.create_project("Streaming API Project", "python_script")
+    services.add_message(project.id, "Coder", "first")
+    services.add_message(project.id, "Tester", "second")
+    client = TestClient(api.app)
+
+    response = client.get(f"/projects/{project.id}/chat/stream")
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["content"] for r in rows] == ["first", "second"]
+
+    events = client.get(f"/projects/{project.id}/history/stream", params={"format": "sse"}).text
+    assert events.startswith("id: ") and "Initial template scaffold" in events
+
+
+def test_chat_batch_writes_messages_and_memories():
+    from sqlalchemy import func, select
+
+    from littup.db import db_session
+    from littup.models import Memory
+
+    services.init_db()
+    project = services.create_project("Batch Chat Project", "python_script")
+    client = TestClient(api.app)
+    turn = [{"role": role, "content": f"{role} ready"} for role in services.ROLES]
+
+    response = client.post(f"/projects/{project.id}/chat:batch", json={"messages": turn})
+    assert response.json() == {"ok": True, "count": len(services.ROLES)}
+    assert [m.role for m in services.get_messages(project.id)] == services.ROLES
+    with db_session() as s:
+        assert s.scalar(select(func.count()).select_from(Memory).where(Memory.project_id == project.id)) == len(turn)
+
+
+def test_search_across_messages_memories_and_files():
+    services.init_db()
+    project = services.create_project("Search Project", "python_script")
+    other = services.create_project("Search Other Project", "python_script")
+    services.add_message(project.id, "Planner", "Wire the zeppelin telemetry dashboard")
+    services.add_message(other.id, "Planner", "Unrelated zeppelin note")
+    services.write_file(project.id, "engine.py", "def zeppelin_lift():\n    return 42\n")
+    services.save_snapshot(project.id, "Add engine")
+    client = TestClient(api.app)
+
+    hits = client.get("/search", params={"q": "zeppelin*", "project_id": project.id}).json()
+    assert {hit["kind"] for hit in hits} == {"message", "memory", "file"}
+    assert all(hit["project_id"] == project.id for hit in hits)
+    assert any("[zeppelin]" in hit["snippet"] for hit in hits if hit["kind"] == "message")
+
+    files = client.get("/search", params={"q": 'zeppelin_lift "', "kind": "file"}).json()
+    assert [hit["label"] for hit in files] == ["engine.py"]
+    assert client.get("/search", params={"q": "x", "kind": "nope"}).status_code == 422
+
+
+def test_run_endpoint_executes_in_sandbox():
+    services.init_db()
+    project = services.create_project("Async Run Project", "python_script")
+    services.write_file(project.id, "main.py", "print('hello from the sandbox')\n")
+    client = TestClient(api.app)
+
+    body = client.post(f"/projects/{project.id}/run", json={"command": "python main.py"}).json()
+    assert body == {"exit_code": 0, "output": "hello from the sandbox", "cached": False}
+    again = client.post(f"/projects/{project.id}/run", json={"command": "python main.py"}).json()
+    assert again == {**body, "cached": True}
+    fresh = client.post(f"/projects/{project.id}/run", json={"command": "python main.py", "use_cache": False}).json()
+    assert fresh == body
+
+    blocked = client.post(f"/projects/{project.id}/run", json={"command": "rm -rf /"}).json()
+    assert blocked["exit_code"] == 1
+
+    chained = client.post(f"/projects/{project.id}/run", json={"command": "python main.py && echo SHELL_OK"}).json()
+    assert chained["exit_code"] == 0 and chained["output"].endswith("SHELL_OK")
+    # The sync path shares the entry, and executes the command the same way.
+    assert services.run_project_command(project.id, "python main.py && echo SHELL_OK") == (0, chained["output"], True)
+    unbalanced = client.post(f"/projects/{project.id}/run", json={"command": "python -c 'oops"})
+    assert unbalanced.status_code == 200 and unbalanced.json()["exit_code"] != 0
+
+    impacted = client.post(f"/projects/{project.id}/run", json={"command": "pytest -q --impacted"}).json()
+    assert impacted["exit_code"] == 1 and "queued jobs" in impacted["output"]
+    streamed = client.post(f"/projects/{project.id}/run/stream", json={"command": "pytest -q --impacted"}).text
+    assert "queued jobs" in streamed
+    assert services.run_local_command(project.id, "pytest -q --impacted")[0] == 1
+
+
+def test_dashboard_reports_project_counters():
+    services.init_db()
+    project = services.create_project("Dashboard Project", "python_script")
+    client = TestClient(api.app)
+    client.post(f"/projects/{project.id}/chat", json={"role": "Planner", "content": "kickoff"})
+
+    body = client.get("/dashboard").json()
+    summary = next(p for p in body["projects"] if p["id"] == project.id)
+    assert summary["message_count"] == 1 and summary["snapshot_count"] == 1 and summary["last_message_at"]
+    assert body["totals"]["projects"] == len(body["projects"])
+    assert body["totals"]["message_count"] >= 1
+
+
+def test_project_checks_are_served_from_cache():
+    services.init_db()
+    project = services.create_project("Cached Project", "python_script")
+    client = TestClient(api.app)
+
+    before = client.get("/cache/stats").json()["projects"]
+    for _ in range(3):
+        assert client.get(f"/projects/{project.id}/history").status_code == 200
+    after = client.get("/cache/stats").json()["projects"]
+    assert after["hits"] - before["hits"] >= 3
+
+    services.create_project("Cached Project Two", "python_script")
+    assert "Cached Project Two" in [p["name"] for p in client.get("/projects").json()]
+
+
+def test_file_listing_and_ranged_reads():
+    services.init_db()
+    project = services.create_project("Files API Project", "python_script")
+    services.write_file(project.id, "big.txt", "0123456789" * 1000)
+    client = TestClient(api.app)
+
+    listing = client.get(f"/projects/{project.id}/files", params={"limit": 1}).json()
+    assert len(listing["entries"]) == 1 and listing["next_offset"] == 1
+
+    chunk = client.get(f"/projects/{project.id}/files/content", params={"path": "big.txt", "offset": 5, "length": 4})
+    assert chunk.content == b"5678"
+    assert chunk.headers["x-file-size"] == "10000" and chunk.headers["x-file-binary"] == "false"
+
+    assert client.get(f"/projects/{project.id}/files/content", params={"path": "../../etc/passwd"}).status_code == 400
+    assert client.get(f"/projects/{project.id}/files/content", params={"path": "missing.txt"}).status_code == 404
+
+
+def test_snapshot_diff_stream_and_restore():
+    services.init_db()
+    project = services.create_project("Diff API Project", "python_script")
+    base = services.get_snapshots(project.id)[0]
+    services.write_file(project.id, "main.py", "print('api diff')\n")
+    client = TestClient(api.app)
+
+    patch = client.get(f"/projects/{project.id}/diff", params={"old_id": base.id})
+    assert patch.headers["content-type"].startswith("text/x-diff")
+    assert "+print('api diff')" in patch.text
+
+    assert client.get(f"/projects/{project.id}/diff", params={"old_id": 999999}).status_code == 404
+    restored = client.post(f"/projects/{project.id}/history/{base.id}/restore").json()
+    assert restored["modified"] == ["main.py"]
+    assert client.get(f"/projects/{project.id}/diff", params={"old_id": base.id}).text == ""
+
+
+def test_metrics_endpoint_reports_routes_queries_and_snapshots():
+    services.init_db()
+    project = services.create_project("Metrics Project", "python_script")
+    client = TestClient(api.app)
+    client.get(f"/projects/{project.id}/chat")
+    client.post(f"/projects/{project.id}/run", json={"command": "python -c 'print(1)'"})
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'littup_http_request_duration_seconds_count{method="GET",route="/projects/{project_id}/chat",status="200"}' in body
+    assert 'littup_db_queries_total{engine="sync",operation="SELECT"}' in body
+    assert "littup_snapshot_duration_seconds_count" in body
+    assert 'littup_sandbox_run_duration_seconds_count{mode="async",outcome="ok"}' in body
+    assert "littup_job_queue_depth " in body
+
+
+def test_launchpad_export_import_round_trip():
+    import io
+    import tarfile
+    import zipfile
+
+    services.init_db()
+    project = services.create_project("Launchpad Project", "python_script")
+    services.write_file(project.id, "data/notes.md", "# notes\n" * 100)
+    services.save_snapshot(project.id, "Added notes")
+    services.add_message(project.id, "Planner", "ship it")
+    client = TestClient(api.app)
+
+    archive = client.get(f"/projects/{project.id}/export", params={"format": "tar.gz"})
+    assert archive.headers["content-type"] == "application/gzip"
+    with tarfile.open(fileobj=io.BytesIO(archive.content)) as tar:
+        names = tar.getnames()
+    assert names[0] == "launchpad_manifest.json" and "files/data/notes.md" in names
+
+    imported = client.post("/projects:import", params={"name": "Imported"}, content=archive.content)
+    assert imported.status_code == 201
+    new_id = imported.json()["id"]
+    assert services.read_file(new_id, "data/notes.md") == "# notes\n" * 100
+    assert [m.content for m in services.get_messages(new_id)] == ["ship it"]
+    notes = [snap.note for snap in services.get_snapshots(new_id)]
+    assert notes == ["Imported from Launchpad package", "Added notes", "Initial template scaffold"]
+    restored = services.read_snapshot_files(services.get_snapshots(new_id)[2].id)
+    assert "data/notes.md" not in restored and "main.py" in restored
+
+    bare = client.get(f"/projects/{project.id}/export", params={"format": "zip", "history": "false"})
+    assert all(not n.startswith("history/") for n in zipfile.ZipFile(io.BytesIO(bare.content)).namelist())
+    assert client.post("/projects:import", content=bare.content).status_code == 201
+
+    assert client.post("/projects:import", content=b"not an archive").status_code == 400
+
+    def repack(edit):
+        out = io.BytesIO()
+        with tarfile.open(fileobj=io.BytesIO(archive.content)) as tar, tarfile.open(fileobj=out, mode="w:gz") as dest:
+            for member in tar.getmembers():
+                data = edit(member.name, tar.extractfile(member).read())
+                if data is not None:
+                    member.size = len(data)
+                    dest.addfile(member, io.BytesIO(data))
+        return out.getvalue()
+
+    def escape(name, data):
+        if name.startswith("history/snapshots"):
+            return data.replace(b'"main.py"', b'"../../escaped.txt"')
+        return data
+
+    before = len(services.list_projects())
+    assert client.post("/projects:import", content=repack(escape)).status_code == 400
+    without_blobs = repack(lambda name, data: None if name.startswith("blobs/") else data)
+    assert client.post("/projects:import", content=without_blobs).status_code == 400
+    assert len(services.list_projects()) == before
+
+
+def test_batch_project_creation():
+    services.init_db()
+    client = TestClient(api.app)
+    payload = {"projects": [{"name": "Fleet A", "template": "game"}, {"name": "Fleet B", "template": "web_app"}]}
+    created = client.post("/projects:batch", json=payload)
+    assert created.status_code == 201
+    assert [p["name"] for p in created.json()] == ["Fleet A", "Fleet B"]
+    assert "README.md" in services.list_project_files(created.json()[1]["id"])
+
+    assert client.post("/projects:batch", json=payload).status_code == 409
+    assert client.post("/projects", json={"name": "Fleet A", "template": "game"}).status_code == 409
+    dupes = {"projects": [{"name": "Fleet C", "template": "game"}] * 2}
+    assert client.post("/projects:batch", json=dupes).status_code == 422
+
+
+def test_memory_search_endpoint():
+    services.init_db()
+    project = services.create_project("Memory Search Project", "python_script")
+    services.add_message(project.id, "Planner", "Cache compiled templates between requests")
+    client = TestClient(api.app)
+
+    hits = client.get(f"/projects/{project.id}/memories/search", params={"q": "templates cache"}).json()
+    assert hits and hits[0]["source"] == "Memoria" and "compiled templates" in hits[0]["content"]
+    assert client.get("/projects/999999/memories/search", params={"q": "x"}).status_code == 404
+
+    # Chat posted through the API is indexed as it is written, like the sync path.
+    from sqlalchemy import func, select
+
+    from littup import memory_index
+    from littup.db import db_session
+    from littup.models import Memory
+
+    batch = {"messages": [{"role": "Coder", "content": "Shard the queue"}]}
+    assert client.post(f"/projects/{project.id}/chat:batch", json=batch).status_code == 200
+    with db_session() as s:
+        latest = s.scalar(select(func.max(Memory.id)).where(Memory.project_id == project.id))
+    assert memory_index._last_id(memory_index.index_dir(project.id)) == latest
+
+
+def test_run_stream_yields_output_then_exit_code():
+    import json
+
+    services.init_db()
+    project = services.create_project("Streaming Run Project", "python_script")
+    client = TestClient(api.app)
+    command = "python -u -c 'import time\nfor i in range(3):\n    print(i)\n    time.sleep(0.05)'"
+    response = client.post(f"/projects/{project.id}/run/stream", json={"command": command})
+    items = [json.loads(line) for line in response.text.splitlines()]
+    assert "".join(item["output"] for item in items).split() == ["0", "1", "2"]
+    assert [item["exit_code"] for item in items][-1] == 0
+    assert all(item["exit_code"] is None for item in items[:-1])
+
+
+# Generous enough for a loaded CI runner; a regression to eager engine or NumPy imports still shows up here.
+IMPORT_BUDGET_SECONDS = 3.0
+FIRST_RESPONSE_BUDGET_SECONDS = 5.0
+
+COLD_START = """
+import json, os, sys, time
+started = time.perf_counter()
+import littup.api as api
+imported = time.perf_counter()
+untouched = not os.path.exists(os.environ["LITTUP_DATA_DIR"])
+from fastapi.testclient import TestClient
+with TestClient(api.create_app()) as client:
+    status = client.get("/projects").status_code
+responded = time.perf_counter()
+print(json.dumps({"import": imported - started, "first_response": responded - started, "untouched": untouched,
+                  "numpy": "numpy" in sys.modules, "status": status}))
+"""
+
+
+def test_cold_start_budget(tmp_path):
+    import json
+    import os
+    import subprocess
+    import sys
+
+    data_dir = tmp_path / "cold"
+    env = {
+        **os.environ,
+        "LITTUP_DATA_DIR": str(data_dir),
+        "LITTUP_DB_PATH": str(data_dir / "littup.db"),
+        "LITTUP_PROJECTS_DIR": str(data_dir / "projects"),
+        "LITTUP_COMPACTION_INTERVAL": "0",
+    }
+    result = subprocess.run([sys.executable, "-c", COLD_START], env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+
+    # Importing the API touches nothing on disk; the first worker startup creates storage and the schema.
+    assert timings["untouched"] and (data_dir / "littup.db").exists()
+    assert timings["status"] == 200 and not timings["numpy"]
+    assert timings["import"] < IMPORT_BUDGET_SECONDS, f"import took {timings['import']:.3f}s"
+    assert timings["first_response"] < FIRST_RESPONSE_BUDGET_SECONDS, f"first response took {timings['first_response']:.3f}s"
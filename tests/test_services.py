@@ -6,3 +6,578 @@ def test_integrations_present():
     assert "Agentora" in data
     assert "Memoria" in data
     assert "Launchpad" in data
+
+
+def test_snapshots_deduplicate_unchanged_files():
+    import json
+
+    from littup import services
+    from littup.db import db_session
+    from littup.models import Blob, Snapshot
+
+    services.init_db()
+    project = services.create_project("Blob Store Project", "python_script")
+    with db_session() as s:
+        blobs_before = s.query(Blob).count()
+
+    services.write_file(project.id, "main.py", "print('v2')\n")
+    second = services.save_snapshot(project.id, "Edited main.py")
+    with db_session() as s:
+        assert s.query(Blob).count() == blobs_before + 1
+
+    first = min(services.get_snapshots(project.id), key=lambda snap: snap.id)
+    assert services.diff_snapshots(first.id, second.id)["modified"] == ["main.py"]
+
+    services.restore_snapshot(project.id, first.id)
+    assert "v2" not in services.read_file(project.id, "main.py")
+
+    with db_session() as s:
+        legacy = Snapshot(project_id=project.id, note="Legacy", content=json.dumps({"a.txt": "hello"}))
+        s.add(legacy)
+        s.flush()
+        legacy_id = legacy.id
+    assert services.migrate_legacy_snapshots() == 1
+    assert services.read_snapshot_files(legacy_id) == {"a.txt": b"hello"}
+
+
+def test_file_index_rehashes_only_changed_files():
+    import os
+
+    from littup import services
+
+    services.init_db()
+    project = services.create_project("File Index Project", "python_script")
+    project_path = services.get_project_path(project.id)
+    for rel in services.list_project_files(project.id):
+        os.utime(project_path / rel, ns=(1_000_000_000, 1_000_000_000))
+
+    services.refresh_file_index(project.id)
+    _, fresh = services.refresh_file_index(project.id)
+    assert fresh == {}
+
+    services.write_file(project.id, "main.py", "print('changed')\n")
+    os.utime(project_path / "main.py", ns=(2_000_000_000, 2_000_000_000))
+    base = services.get_snapshots(project.id)[0]
+    _, fresh = services.refresh_file_index(project.id)
+    assert list(fresh) == ["main.py"]
+    assert services.changed_since_snapshot(project.id, base.id)["modified"] == ["main.py"]
+
+
+def test_concurrent_file_index_refreshes_do_not_conflict():
+    import threading
+
+    from littup import services
+
+    services.init_db()
+    project = services.create_project("Concurrent Index Project", "python_script")
+    for round_ in range(5):
+        for idx in range(20):
+            services.write_file(project.id, f"pkg/mod_{round_}_{idx}.py", f"VALUE = {idx}\n")
+        if round_:
+            (services.get_project_path(project.id) / f"pkg/mod_{round_ - 1}_0.py").unlink()
+        barrier = threading.Barrier(2)
+        errors: list[Exception] = []
+
+        def refresh() -> None:
+            barrier.wait()
+            try:
+                services.refresh_file_index(project.id)
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=refresh) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+    manifest, _ = services.refresh_file_index(project.id)
+    assert "pkg/mod_4_19.py" in manifest and "pkg/mod_3_0.py" not in manifest
+
+
+def test_engine_applies_storage_profile_pragmas():
+    from sqlalchemy import text
+
+    from littup.db import engine, settings
+
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar().upper() == settings.storage.journal_mode
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == settings.storage.busy_timeout_ms
+
+
+def test_write_behind_coalesces_messages():
+    from littup import services
+    from littup.writebehind import MessageWriteBehind
+
+    services.init_db()
+    project = services.create_project("Write Behind Project", "python_script")
+    queue = MessageWriteBehind(flush_interval=60)
+    for idx in range(3):
+        queue.submit(project.id, "Coder", f"queued {idx}")
+    assert services.get_messages(project.id) == []
+    queue.close()
+    assert [m.content for m in services.get_messages(project.id)] == ["queued 0", "queued 1", "queued 2"]
+
+
+def test_job_runner_executes_and_cancels_jobs():
+    import os
+    import time
+    from datetime import datetime, timedelta
+
+    from littup import jobs, services
+    from littup.db import db_session
+    from littup.models import RunJob
+
+    services.init_db()
+    project = services.create_project("Job Queue Project", "python_script")
+    services.write_file(project.id, "main.py", "print('queued hello')\n")
+    services.write_file(project.id, "slow.py", "import time\ntime.sleep(30)\n")
+    slow = jobs.submit_job(project.id, "python slow.py")
+    fast = jobs.submit_job(project.id, "python main.py", priority=10)
+    # Claimed by a live PID (a reused one after a restart) but no heartbeat for minutes: orphaned.
+    with db_session() as s:
+        orphan = RunJob(
+            project_id=project.id,
+            command="python main.py",
+            status="running",
+            claimed_by=os.getpid(),
+            heartbeat_at=datetime.utcnow() - timedelta(minutes=5),
+            output="",
+        )
+        s.add(orphan)
+        s.flush()
+
+    runner = jobs.JobRunner(max_workers=2, per_project=1).start()
+    try:
+        done = jobs.wait_for_job(fast.id, timeout=15)
+        assert done.status == "succeeded" and "queued hello" in done.output
+
+        while jobs.get_job(slow.id).status == "queued":
+            time.sleep(0.05)
+        jobs.cancel_job(slow.id)
+        cancelled = jobs.wait_for_job(slow.id, timeout=15)
+        assert cancelled.status == "cancelled" and cancelled.exit_code == jobs.CANCELLED_EXIT_CODE
+        assert jobs.wait_for_job(orphan.id, timeout=15).status == "succeeded"
+        assert jobs.job_stats()["sample_size"] >= 2
+    finally:
+        runner.stop()
+
+
+def test_warm_sandbox_syncs_changes_and_reverts_run_artifacts():
+    from littup import sandbox, services
+
+    services.init_db()
+    project = services.create_project("Warm Sandbox Project", "python_script")
+    workdir = services.get_project_path(project.id)
+
+    first = sandbox.acquire_sandbox(workdir)
+    assert first.warm
+    (first.path / "main.py").write_text("# clobbered by a run\n")
+    (first.path / "artifact.log").write_text("left behind\n")
+    busy = sandbox.acquire_sandbox(workdir)
+    assert not busy.warm and busy.path != first.path
+    busy.release()
+    first.release()
+
+    services.write_file(project.id, "extra.py", "VALUE = 1\n")
+    second = sandbox.acquire_sandbox(workdir)
+    try:
+        assert second.path == first.path
+        assert (second.path / "main.py").read_text() == (workdir / "main.py").read_text()
+        assert (second.path / "extra.py").exists()
+        assert not (second.path / "artifact.log").exists()
+    finally:
+        second.release()
+    assert f"project_{project.id}" in sandbox.evict_sandboxes(budget_bytes=0)
+
+
+def test_clone_file_only_gives_up_reflinks_when_unsupported(monkeypatch, tmp_path):
+    import errno
+
+    import pytest
+
+    from littup import tree
+
+    if tree.fcntl is None:
+        pytest.skip("no FICLONE on this platform")
+    monkeypatch.setattr(tree, "_reflink_supported", True)
+    with pytest.raises(FileNotFoundError):
+        tree.clone_file(tmp_path / "missing.txt", tmp_path / "copy.txt")
+    assert tree._reflink_supported
+
+    def unsupported(*args):
+        raise OSError(errno.EOPNOTSUPP, "Operation not supported")
+
+    monkeypatch.setattr(tree.fcntl, "ioctl", unsupported)
+    (tmp_path / "source.txt").write_text("hello\n")
+    tree.clone_file(tmp_path / "source.txt", tmp_path / "copy.txt")
+    assert (tmp_path / "copy.txt").read_text() == "hello\n" and not tree._reflink_supported
+
+
+def test_lazy_tree_respects_ignore_rules_and_detects_binaries():
+    import pytest
+
+    from littup import services
+
+    services.init_db()
+    project = services.create_project("Tree Project", "python_script")
+    services.write_file(project.id, ".gitignore", "*.log\nbuild/\n!keep.log\n")
+    services.write_file(project.id, "debug.log", "noise")
+    services.write_file(project.id, "keep.log", "kept")
+    services.write_file(project.id, "build/out.txt", "artifact")
+    services.write_file(project.id, "node_modules/pkg/index.js", "module")
+    services.write_file(project.id, "pkg/deep/nested/mod.py", "x = 1\n")
+    (services.get_project_path(project.id) / "blob.bin").write_bytes(b"\x89PNG\0\0data" * 100)
+
+    files = list(services.iter_project_files(project.id))
+    assert "keep.log" in files and "pkg/deep/nested/mod.py" in files
+    assert not {"debug.log", "build/out.txt", "node_modules/pkg/index.js"} & set(files)
+    assert "pkg/deep/nested/mod.py" not in services.iter_project_files(project.id, max_depth=1)
+
+    page, has_more = services.list_project_dir(project.id, limit=1)
+    assert has_more and page[0].is_dir
+    assert services.list_project_dir(project.id, "pkg/deep")[0][0].path == "pkg/deep/nested"
+
+    assert services.file_info(project.id, "blob.bin")["binary"]
+    assert not services.file_info(project.id, "keep.log")["binary"]
+    assert services.read_file_range(project.id, "pkg/deep/nested/mod.py", 4, 1) == b"1"
+    with pytest.raises(ValueError):
+        services.read_file_range(project.id, "../outside.txt")
+
+
+def test_snapshot_diffs_and_restore_touch_only_changed_files():
+    import pytest
+
+    from littup import services
+    from littup.db import db_session
+    from littup.models import SnapshotFile
+
+    services.init_db()
+    project = services.create_project("Diff Project", "python_script")
+    base = services.get_snapshots(project.id)[0]
+    services.write_file(project.id, "main.py", "print('changed')\n")
+    services.write_file(project.id, "notes.txt", "new file")
+    edited = services.save_snapshot(project.id, "Edits")
+
+    diffs = {d["path"]: d for d in services.iter_snapshot_diffs(base.id, edited.id)}
+    assert set(diffs) == {"main.py", "notes.txt"}
+    assert "+print('changed')" in diffs["main.py"]["diff"]
+    assert diffs["notes.txt"]["status"] == "added" and "No newline at end of file" in diffs["notes.txt"]["diff"]
+
+    untouched = services.get_project_path(project.id) / "test_main.py"
+    mtime = untouched.stat().st_mtime_ns
+    changes = services.restore_snapshot(project.id, base.id)
+    assert changes == {"added": ["notes.txt"], "removed": [], "modified": ["main.py"]}
+    assert not (services.get_project_path(project.id) / "notes.txt").exists()
+    assert untouched.stat().st_mtime_ns == mtime
+    assert list(services.iter_workspace_diffs(project.id, base.id)) == []
+
+    with db_session() as s:
+        digest = s.get(SnapshotFile, (edited.id, "main.py")).blob_hash
+        s.add(SnapshotFile(snapshot_id=edited.id, path="../escaped.txt", blob_hash=digest))
+    with pytest.raises(ValueError):
+        services.restore_snapshot(project.id, edited.id)
+    with pytest.raises(ValueError):
+        services.read_snapshot_files(edited.id)
+    assert not (services.get_project_path(project.id).parent / "escaped.txt").exists()
+    assert "changed" not in services.read_file(project.id, "main.py")
+    with db_session() as s:
+        s.delete(s.get(SnapshotFile, (edited.id, "../escaped.txt")))
+
+
+def test_restore_swaps_files_and_directories():
+    from littup import services
+
+    services.init_db()
+    project = services.create_project("Swap Project", "python_script")
+    root = services.get_project_path(project.id)
+    services.write_file(project.id, "a", "was a file")
+    services.write_file(project.id, "pkg/mod.py", "x = 1\n")
+    before = services.save_snapshot(project.id, "Before swap")
+
+    (root / "a").unlink()
+    services.write_file(project.id, "a/b.py", "now a directory\n")
+    (root / "pkg" / "mod.py").unlink()
+    (root / "pkg").rmdir()
+    services.write_file(project.id, "pkg", "now a file")
+    after = services.save_snapshot(project.id, "After swap")
+
+    services.restore_snapshot(project.id, before.id)
+    assert services.read_file(project.id, "a") == "was a file"
+    assert services.read_file(project.id, "pkg/mod.py") == "x = 1\n"
+    assert list(services.iter_workspace_diffs(project.id, before.id)) == []
+
+    services.restore_snapshot(project.id, after.id)
+    assert services.read_file(project.id, "a/b.py") == "now a directory\n"
+    assert services.read_file(project.id, "pkg") == "now a file"
+
+
+def test_retention_thins_snapshots_and_collects_orphans():
+    import sqlite3
+    from datetime import datetime, timedelta
+
+    from sqlalchemy import func, select, update
+
+    from littup import services
+    from littup.blobs import blob_hash
+    from littup.config import RetentionPolicy
+    from littup.db import db_session, storage_settings
+    from littup.models import Blob, Snapshot
+    from littup.retention import compact
+
+    services.init_db()
+    project = services.create_project("Retention Project", "python_script")
+    for day in range(4):
+        services.write_file(project.id, "main.py", f"print('day {day}')\n" * 40)
+        services.save_snapshot(project.id, f"day {day}")
+    snapshot_ids = [snap.id for snap in services.get_snapshots(project.id)]
+    now = datetime.utcnow()
+    with db_session() as s:
+        for age, snap_id in enumerate(snapshot_ids):
+            s.execute(update(Snapshot).where(Snapshot.id == snap_id).values(created_at=now - timedelta(days=age)))
+    policy = RetentionPolicy(keep_last=1, keep_hourly=0, keep_daily=3, keep_weekly=0, max_bytes=0, cold_after_days=7)
+    orphan = blob_hash(("print('day 0')\n" * 40).encode())
+
+    # A dry run only reads, so it does not wait for (or block) a writer.
+    writer = sqlite3.connect(storage_settings().db_path, timeout=0)
+    try:
+        writer.execute("BEGIN IMMEDIATE")
+        report = compact(policy, dry_run=True, now=now)
+    finally:
+        writer.rollback()
+        writer.close()
+    planned = next(p for p in report["projects"] if p["project_id"] == project.id)
+    assert planned["dropped"] == snapshot_ids[3:]
+    assert report["blobs_removed"] >= 1 and report["blob_bytes_reclaimed"] > 0
+    assert len(services.get_snapshots(project.id)) == 5
+
+    applied = compact(policy, now=now)
+    for field in ("snapshots_dropped", "blobs_removed", "blob_bytes_reclaimed", "search_rows_removed"):
+        assert applied[field] == report[field]
+    vacuum = applied["vacuum"]
+    assert vacuum["auto_vacuum"] == "incremental" and vacuum["free_bytes_after"] <= vacuum["free_bytes"]
+    assert [snap.id for snap in services.get_snapshots(project.id)] == snapshot_ids[:3]
+    assert next(p for p in services.dashboard()["projects"] if p["id"] == project.id)["snapshot_count"] == 3
+    with db_session() as s:
+        assert s.scalar(select(func.count()).select_from(Blob).where(Blob.hash == orphan)) == 0
+    assert services.read_snapshot_files(snapshot_ids[2])["main.py"].startswith(b"print('day 1')")
+
+
+def test_slow_query_log(caplog):
+    from sqlalchemy import create_engine, text
+
+    from littup.metrics import db_queries, instrument_engine
+
+    engine = create_engine("sqlite://")
+    instrument_engine(engine, "probe", slow_query_ms=1)
+    with caplog.at_level("WARNING", logger="littup.sql.slow"), engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        conn.execute(text("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 300000) SELECT count(*) FROM n"))
+    assert db_queries.value(engine="probe", operation="SELECT") == db_queries.value(engine="probe", operation="WITH") == 1
+    slow = [r.getMessage() for r in caplog.records if r.name == "littup.sql.slow"]
+    assert len(slow) == 1 and "WITH RECURSIVE" in slow[0]
+
+
+def test_bench_seeding_and_summary():
+    from littup import services
+    from littup.bench import seed_project, summarize
+
+    services.init_db()
+    project_id = seed_project(files=12, messages=30, snapshots=2, name="Seeded Bench")
+    assert len(services.get_messages(project_id)) == 30
+    assert len(services.get_snapshots(project_id)) == 3
+    assert sum(rel.startswith("pkg/") for rel in services.list_project_files(project_id)) == 12
+
+    stats = summarize([0.001, 0.002, 0.003, 0.010])
+    assert stats["calls"] == 4 and stats["p50_ms"] == 3.0 and stats["max_ms"] == 10.0
+
+
+def test_version_tokens_change_on_writes():
+    from littup import services
+
+    services.init_db()
+    before = services.projects_version()
+    project = services.create_project("Versioned Project", "python_script")
+    assert services.projects_version() != before
+
+    token = services.project_version(project.id)
+    assert services.project_version(project.id) == token
+    services.add_message(project.id, "Coder", "bump")
+    assert services.project_version(project.id) != token
+    token = services.project_version(project.id)
+    services.save_snapshot(project.id, "bump")
+    assert services.project_version(project.id) != token
+
+
+def test_batch_creation_reuses_indexed_templates():
+    from littup import services
+    from littup.db import db_session
+    from littup.models import FileState
+    from littup.templates import TemplateRegistry
+
+    registry = TemplateRegistry()
+    template = registry.get("python_script")
+    assert registry.get("python_script") is template
+    assert set(template.manifest) == {"main.py", "test_main.py"}
+    assert registry.get("../python_script") is None and registry.get("missing") is None
+
+    services.init_db()
+    projects = services.create_projects([(f"Batch {n}", "python_script", "Core Team") for n in range(3)])
+    for project in projects:
+        first = services.get_snapshots(project.id)[0]
+        assert first.note == "Initial template scaffold"
+        assert services.read_snapshot_files(first.id) == template.contents
+        with db_session() as s:
+            states = {state.path: state.blob_hash for state in s.query(FileState).filter_by(project_id=project.id)}
+        assert states == template.manifest
+
+    services.write_file(projects[0].id, "main.py", "print('mine')\n")
+    assert "mine" not in (template.root / "main.py").read_text()
+    assert services.read_file(projects[1].id, "main.py") == template.contents["main.py"].decode()
+
+
+def test_memory_recall_ranks_relevant_memories():
+    from littup import memory_index, services
+
+    services.init_db()
+    project = services.create_project("Recall Project", "python_script")
+    services.add_messages(
+        project.id,
+        [
+            ("Planner", "Use a sqlite database with write-ahead logging"),
+            ("Coder", "The game loop renders sprites at sixty frames"),
+            ("Reviewer", "Database migrations must run before the api starts"),
+        ],
+    )
+    hits = services.search_memories(project.id, "sqlite database", limit=2)
+    assert [hit["content"].split(":")[0] for hit in hits] == ["Planner", "Reviewer"]
+    assert 0 < hits[1]["score"] < hits[0]["score"] <= 1.0001
+
+    # Memories written by other paths are picked up on the next search.
+    with open(memory_index.index_dir(project.id) / memory_index.FILE_NAMES["weights"], "ab") as torn:
+        torn.write(b"\0" * 6)
+    services.add_message(project.id, "Coder", "sprites sprites and more sprites")
+    assert services.search_memories(project.id, "sprites")[0]["content"].startswith("Coder: sprites")
+    assert services.search_memories(project.id, "nothing matches") == []
+
+
+def test_sandbox_limits_and_bounded_output(monkeypatch):
+    import dataclasses
+    import time
+
+    from littup import sandbox, services
+    from littup.sandbox import OutputBuffer
+
+    buffer = OutputBuffer(10)
+    buffer.write("abcdefgh")
+    assert buffer.drain() == "abcde"
+    buffer.write("ijklmnop")
+    assert buffer.drain() == ""
+    assert buffer.close() == "\n[... 6 characters omitted ...]\nlmnop"
+
+    services.init_db()
+    project = services.create_project("Limits Project", "python_script")
+    monkeypatch.setattr(sandbox, "limits", dataclasses.replace(sandbox.limits, cpu_seconds=1, output_chars=2048))
+    started = time.monotonic()
+    code, output = services.run_local_command(project.id, "python -c 'while True: pass'")
+    assert code != 0 and time.monotonic() - started < 15
+
+    code, output = services.run_local_command(project.id, "python -c 'print(\"x\" * 100000); print(\"end\")'")
+    assert code == 0 and len(output) < 2100
+    assert "characters omitted" in output and output.endswith("end")
+
+    code, output = sandbox.run_command(services.get_project_path(project.id), "python -c 'import time; time.sleep(5)'", 0.5)
+    assert (code, output) == (sandbox.TIMEOUT_EXIT_CODE, "Timed out after 0.5s.")
+
+
+def test_impacted_jobs_rerun_only_affected_tests():
+    from littup import jobs, services
+
+    services.init_db()
+    project = services.create_project("Impact Project", "python_script")
+    services.write_file(project.id, "shapes.py", "def area(w, h):\n    return w * h\n")
+    services.write_file(project.id, "test_shapes.py", "from shapes import area\n\n\ndef test_area():\n    assert area(2, 3) == 6\n")
+
+    runner = jobs.JobRunner(max_workers=1).start()
+    try:
+        def run() -> str:
+            job = jobs.wait_for_job(jobs.submit_job(project.id, "pytest -q --impacted").id, timeout=60)
+            assert job.status == "succeeded", job.output
+            return job.output
+
+        assert "no coverage recorded" in run()
+        services.write_file(project.id, "shapes.py", "def area(w, h):\n    return h * w\n")
+        output = run()
+        assert "Running 1 of 2" in output and "1 passed, 1 deselected" in output
+        assert "No tests affected" in run()
+        services.write_file(project.id, "data.txt", "fixture data\n")
+        assert "Running all tests: data.txt changed" in run()
+    finally:
+        runner.stop()
+
+
+def test_run_cache_reuses_results_of_unchanged_trees():
+    from sqlalchemy import create_engine
+
+    from littup import run_cache, services
+    from littup.db import Base, add_missing_columns
+
+    services.init_db()
+    project = services.create_project("Run Cache Project", "python_script")
+    services.write_file(project.id, "main.py", "import random\nprint(random.random())\n")
+    code, output, cached = services.run_project_command(project.id, "python main.py")
+    assert code == 0 and not cached
+    assert services.run_project_command(project.id, "python main.py") == (code, output, True)
+    rerun = services.run_project_command(project.id, "python main.py", use_cache=False)
+    assert not rerun[2] and rerun[1] != output
+    assert services.run_project_command(project.id, "python main.py") == (*rerun[:2], True)
+
+    services.write_file(project.id, "main.py", "print('edited')\n")
+    assert services.run_project_command(project.id, "python main.py") == (0, "edited", False)
+    stats = run_cache.stats()
+    assert stats["entries"] >= 2 and stats["hits"] >= 2 and stats["bypassed"] >= 1
+    assert run_cache.evict(budget=0) == stats["entries"] and run_cache.stats()["entries"] == 0
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        # A run_jobs table from before the run cache.
+        conn.exec_driver_sql("ALTER TABLE run_jobs DROP COLUMN use_cache")
+        conn.exec_driver_sql("ALTER TABLE run_jobs DROP COLUMN cached")
+        conn.exec_driver_sql(
+            "INSERT INTO run_jobs (project_id, command, priority, status, cancel_requested, output, created_at)"
+            " VALUES (1, 'python main.py', 0, 'queued', 0, '', '2026-01-01')"
+        )
+    assert add_missing_columns(engine) == ["run_jobs.use_cache", "run_jobs.cached"]
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT use_cache, cached FROM run_jobs").one() == (1, 0)
+
+
+def test_project_counters_track_messages_snapshots_and_files():
+    from littup import services
+    from littup.db import db_session
+
+    services.init_db()
+    project = services.create_project("Counted Project", "python_script")
+
+    def summary() -> dict:
+        return next(p for p in services.dashboard()["projects"] if p["id"] == project.id)
+
+    created = summary()
+    assert (created["message_count"], created["snapshot_count"], created["last_message_at"]) == (0, 1, None)
+    assert created["bytes_on_disk"] == sum(
+        path.stat().st_size for path in services.get_project_path(project.id).rglob("*") if path.is_file()
+    )
+
+    services.add_messages(project.id, [("Planner", "plan"), ("Coder", "code")])
+    services.add_message(project.id, "Tester", "test")
+    services.write_file(project.id, "extra.py", "x" * 1000)
+    services.save_snapshot(project.id, "more files")
+    after = summary()
+    assert (after["message_count"], after["snapshot_count"]) == (3, 2)
+    assert after["bytes_on_disk"] == created["bytes_on_disk"] + 1000 and after["last_message_at"] is not None
+    assert after["updated_at"] == created["updated_at"]
+
+    with db_session() as s:
+        services.recount_projects(s, [project.id])
+    assert summary() == after